@@ -29,6 +29,27 @@ mkdir -p "$APP_DIR/static/css"
 echo "Copying application files..."
 cp src/app.py "$APP_DIR/"
 cp src/post_process.py "$APP_DIR/"
+cp src/pipeline.py "$APP_DIR/"
+cp src/memory_cache.py "$APP_DIR/"
+cp src/image_stats.py "$APP_DIR/"
+cp src/tiff_io.py "$APP_DIR/"
+cp src/artifact_index.py "$APP_DIR/"
+cp src/admission.py "$APP_DIR/"
+cp src/lazy_import.py "$APP_DIR/"
+cp src/batch.py "$APP_DIR/"
+cp src/background.py "$APP_DIR/"
+cp src/profiling.py "$APP_DIR/"
+cp src/server.py "$APP_DIR/"
+cp src/shared_arrays.py "$APP_DIR/"
+cp src/compute_pool.py "$APP_DIR/"
+cp src/watch_folder.py "$APP_DIR/"
+cp src/coalesce.py "$APP_DIR/"
+cp src/artifact_store.py "$APP_DIR/"
+cp src/affinity.py "$APP_DIR/"
+cp src/compressed_upload.py "$APP_DIR/"
+cp src/channel_layout.py "$APP_DIR/"
+cp src/quicklook.py "$APP_DIR/"
+cp src/config_manager.py "$APP_DIR/"
 cp requirements.txt "$APP_DIR/"
 cp README.md "$APP_DIR/"
 
@@ -49,16 +70,17 @@ import os
 sys.path.insert(0, '/opt/auto-stretch')
 
 # Import and run the application
-from app import app
+from app import run_server
 
 if __name__ == '__main__':
-    # Get port from environment variable or use default
+    # Get port from environment variable or use default (ignored when
+    # systemd passes the listening socket from auto-stretch.socket)
     port = int(os.environ.get('APP_PORT', 5000))
 
     print(f"Starting Auto Stretch on port {port}...")
 
-    # Run on all interfaces for systemd service
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # Warms up, reports readiness to systemd, and drains on stop/reload
+    run_server(port)
 APPSTART
 
 # Set proper permissions
@@ -76,6 +98,27 @@ find "$BUILD_DIR/opt" -type f -exec chmod 0644 {} \;
 chmod 0755 "$APP_DIR/app_start.py"
 chmod 0644 "$APP_DIR/app.py"
 chmod 0644 "$APP_DIR/post_process.py"
+chmod 0644 "$APP_DIR/pipeline.py"
+chmod 0644 "$APP_DIR/memory_cache.py"
+chmod 0644 "$APP_DIR/image_stats.py"
+chmod 0644 "$APP_DIR/tiff_io.py"
+chmod 0644 "$APP_DIR/artifact_index.py"
+chmod 0644 "$APP_DIR/admission.py"
+chmod 0644 "$APP_DIR/lazy_import.py"
+chmod 0644 "$APP_DIR/batch.py"
+chmod 0644 "$APP_DIR/background.py"
+chmod 0644 "$APP_DIR/profiling.py"
+chmod 0644 "$APP_DIR/server.py"
+chmod 0644 "$APP_DIR/shared_arrays.py"
+chmod 0644 "$APP_DIR/compute_pool.py"
+chmod 0644 "$APP_DIR/watch_folder.py"
+chmod 0644 "$APP_DIR/coalesce.py"
+chmod 0644 "$APP_DIR/artifact_store.py"
+chmod 0644 "$APP_DIR/affinity.py"
+chmod 0644 "$APP_DIR/compressed_upload.py"
+chmod 0644 "$APP_DIR/channel_layout.py"
+chmod 0644 "$APP_DIR/quicklook.py"
+chmod 0644 "$APP_DIR/config_manager.py"
 
 # Systemd service files
 find "$BUILD_DIR/etc" -type d -exec chmod 0755 {} \;
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Load-testing harness for Auto Stretch
+
+Drives a mixed workload against a running (or locally started) server and
+reports throughput, p50/p95/p99 latency per endpoint, error rates and the
+server's RSS/CPU over time. Workloads are described by scenario files in
+scripts/load_scenarios/, so server modes and cache settings can be compared
+reproducibly.
+
+Usage:
+    python scripts/load_test.py scripts/load_scenarios/smoke.json
+    python scripts/load_test.py scenario.json --url http://localhost:5000
+    python scripts/load_test.py scenario.json --report results.json
+
+Scenario format (JSON):
+    {
+      "name": "slider-drag",
+      "image": {"width": 2000, "height": 1500, "dtype": "uint16", "compression": null},
+      "config": {"stage_cache_mb": 1024},      # only used when the harness starts the server
+      "phases": [
+        {"type": "upload", "concurrency": 2, "count": 4},
+        {"type": "reprocess", "sessions": 2, "burst": 10, "interval_ms": 50},
+        {"type": "download", "concurrency": 4, "count": 8},
+        {"type": "mixed", "phases": [ ...phases run concurrently... ]}
+      ]
+    }
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tifffile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+DEFAULT_PARAMS = {
+    'gamma_red': 0.7,
+    'gamma_green': 0.8,
+    'gamma_blue': 0.75,
+    'green_multiplier': 0.93,
+    'blue_multiplier': 1.08,
+    'dark_threshold': 0.15,
+    'dark_multiplier': 0.3,
+    'mid_threshold': 0.4,
+    'mid_boost': 1.5,
+    'bright_multiplier': 1.1,
+    'saturation_boost': 1.0
+}
+
+
+def make_synthetic_tiff(path, width, height, dtype='uint16', compression=None, seed=0):
+    """Write a star-field-like RGB TIFF of the requested size"""
+    rng = np.random.default_rng(seed)
+    info = np.iinfo(dtype) if np.issubdtype(np.dtype(dtype), np.integer) else None
+    peak = info.max if info else 1.0
+
+    # Faint sky background with noise plus a sprinkling of bright stars
+    img = rng.gamma(2.0, peak * 0.01, size=(height, width, 3))
+    stars = rng.integers(0, height * width, size=max(1, height * width // 2000))
+    img.reshape(-1, 3)[stars] = peak * rng.uniform(0.5, 1.0, size=(stars.size, 1))
+    img = np.clip(img, 0, peak).astype(dtype)
+
+    tifffile.imwrite(path, img, compression=compression)
+    return os.path.getsize(path)
+
+
+def encode_multipart(fields, files):
+    """Encode form fields and files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/tiff\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    """Thread-safe collector of per-endpoint request results"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, endpoint, latency, status, nbytes=0, superseded=False):
+        """
+        Args:
+            superseded: The server dropped the request for a newer one from
+                the same client (409 'superseded'); intended, not an error
+        """
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency, status, nbytes, superseded))
+
+    def summary(self, elapsed):
+        """
+        Per-endpoint report; superseded requests are counted separately and
+        left out of the error rate and latency percentiles
+        """
+        report = {}
+        with self._lock:
+            for endpoint, samples in self.samples.items():
+                completed = [s for s in samples if not s[3]]
+                latencies = np.array([s[0] for s in completed])
+                errors = sum(1 for s in completed if not 200 <= s[1] < 300)
+                nbytes = sum(s[2] for s in samples)
+                report[endpoint] = {
+                    'requests': len(samples),
+                    'superseded': len(samples) - len(completed),
+                    'errors': errors,
+                    'error_rate': errors / len(completed) if completed else 0.0,
+                    'status_codes': {str(code): sum(1 for s in samples if s[1] == code)
+                                     for code in sorted({s[1] for s in samples})},
+                    'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+                    'throughput_mbps': nbytes / (1024 * 1024) / elapsed if elapsed else 0.0,
+                    'p50_s': float(np.percentile(latencies, 50)) if completed else None,
+                    'p95_s': float(np.percentile(latencies, 95)) if completed else None,
+                    'p99_s': float(np.percentile(latencies, 99)) if completed else None,
+                    'max_s': float(latencies.max()) if completed else None
+                }
+        return report
+
+
+class ResourceSampler(threading.Thread):
+    """Samples a process's RSS and CPU usage from /proc at a fixed interval"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _read(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+        rss_bytes = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu_seconds, rss_bytes
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            last_cpu, _ = self._read()
+        except OSError:
+            return
+        last_time = start
+        while not self._stop_event.wait(self.interval):
+            try:
+                cpu, rss = self._read()
+            except OSError:
+                break
+            now = time.monotonic()
+            cpu_percent = 100.0 * (cpu - last_cpu) / (now - last_time)
+            self.samples.append({'t': round(now - start, 2), 'rss_mb': rss / (1024 * 1024),
+                                 'cpu_percent': cpu_percent})
+            last_cpu, last_time = cpu, now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class LoadTest:
+    """Runs the phases of a scenario against a server"""
+
+    def __init__(self, base_url, image_path, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.image_path = image_path
+        self.recorder = recorder
+        with open(image_path, 'rb') as f:
+            self.image_bytes = f.read()
+        self._lock = threading.Lock()
+        self.inputs = []      # input_file IDs available for reprocessing
+        self.downloads = []   # download URLs available for fetching
+
+    def _request(self, endpoint, url, data=None, content_type=None, stream=False):
+        req = urllib.request.Request(url, data=data)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        start = time.perf_counter()
+        status, body, nbytes = 0, b'', len(data) if data else 0
+        try:
+            with urllib.request.urlopen(req, timeout=600) as response:
+                status = response.status
+                if stream:
+                    while True:
+                        chunk = response.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        nbytes += len(chunk)
+                else:
+                    body = response.read()
+        except urllib.error.HTTPError as e:
+            status = e.code
+            body = e.read()
+        except (urllib.error.URLError, socket.timeout, ConnectionError):
+            status = 0
+        latency = time.perf_counter() - start
+        try:
+            result = json.loads(body) if body else None
+        except ValueError:
+            result = None
+        superseded = status == 409 and isinstance(result, dict) and bool(result.get('superseded'))
+        self.recorder.record(endpoint, latency, status, nbytes, superseded=superseded)
+        return status, result
+
+    def upload(self, params=None):
+        body, content_type = encode_multipart(
+            dict(params or DEFAULT_PARAMS),
+            {'file': (os.path.basename(self.image_path), self.image_bytes)})
+        status, result = self._request('/upload', f'{self.base_url}/upload', body, content_type)
+        if status == 200 and result and result.get('success'):
+            with self._lock:
+                self.inputs.append(result['input_file'])
+                self.downloads.append(result['download_url'])
+        return status
+
+    def reprocess(self, input_file, params):
+        fields = dict(params)
+        fields['input_file'] = input_file
+        body, content_type = encode_multipart(fields, {})
+        status, result = self._request('/reprocess', f'{self.base_url}/reprocess', body, content_type)
+        if status == 200 and result and result.get('success'):
+            with self._lock:
+                self.downloads.append(result['download_url'])
+        return status
+
+    def download(self, url):
+        return self._request('/download', f'{self.base_url}{url}', stream=True)[0]
+
+    def _ensure_inputs(self, count):
+        while len(self.inputs) < count:
+            if self.upload() != 200:
+                raise RuntimeError('Seed upload failed; is the server healthy?')
+
+    def run_phase(self, phase):
+        kind = phase['type']
+
+        if kind == 'upload':
+            with ThreadPoolExecutor(phase.get('concurrency', 1)) as pool:
+                list(pool.map(lambda _: self.upload(), range(phase.get('count', 1))))
+
+        elif kind == 'reprocess':
+            # Each session mimics a slider drag: a burst of small parameter changes
+            sessions = phase.get('sessions', 1)
+            self._ensure_inputs(sessions)
+            param = phase.get('param', 'saturation_boost')
+            interval = phase.get('interval_ms', 50) / 1000.0
+
+            def drag(input_file):
+                value = DEFAULT_PARAMS[param]
+                with ThreadPoolExecutor(phase.get('in_flight', 4)) as pool:
+                    for _ in range(phase.get('burst', 10)):
+                        value = round(value + random.choice((-0.05, 0.05)), 2)
+                        pool.submit(self.reprocess, input_file, dict(DEFAULT_PARAMS, **{param: value}))
+                        time.sleep(interval)
+
+            with ThreadPoolExecutor(sessions) as pool:
+                list(pool.map(drag, self.inputs[:sessions]))
+
+        elif kind == 'download':
+            if not self.downloads:
+                self._ensure_inputs(1)
+            with ThreadPoolExecutor(phase.get('concurrency', 1)) as pool:
+                urls = [self.downloads[i % len(self.downloads)] for i in range(phase.get('count', 1))]
+                list(pool.map(self.download, urls))
+
+        elif kind == 'mixed':
+            with ThreadPoolExecutor(len(phase['phases'])) as pool:
+                list(pool.map(self.run_phase, phase['phases']))
+
+        else:
+            raise ValueError(f'Unknown phase type: {kind}')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(config_overrides, workdir):
+    """Start the app on a free local port with the scenario's config"""
+    port = free_port()
+    config = dict(config_overrides or {})
+    config.setdefault('temp_dir', os.path.join(workdir, 'uploads'))
+    os.makedirs(config['temp_dir'], exist_ok=True)
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    env = dict(os.environ, AUTO_STRETCH_CONFIG=config_path)
+    launcher = ('import sys; sys.path.insert(0, sys.argv[1]); from app import app; '
+                'app.run(host="127.0.0.1", port=int(sys.argv[2]), threaded=True, use_reloader=False)')
+    process = subprocess.Popen([sys.executable, '-c', launcher, SRC_DIR, str(port)],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'{url}/status', timeout=1).read()
+            return process, url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            if process.poll() is not None:
+                raise RuntimeError('Server exited during startup')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Server did not become ready within 60s')
+
+
+def print_report(report):
+    print(f"\nScenario: {report['scenario']}  ({report['elapsed_s']:.1f}s)")
+    print(f"{'endpoint':<12}{'reqs':>6}{'sup':>6}{'err%':>7}{'rps':>8}{'MB/s':>8}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for endpoint, stats in report['endpoints'].items():
+        latencies = ''.join(f"{stats[key]:>8.2f}" if stats[key] is not None else f"{'-':>8}"
+                            for key in ('p50_s', 'p95_s', 'p99_s'))
+        print(f"{endpoint:<12}{stats['requests']:>6}{stats['superseded']:>6}{stats['error_rate'] * 100:>6.1f}%"
+              f"{stats['throughput_rps']:>8.2f}{stats['throughput_mbps']:>8.1f}{latencies}")
+    resources = report.get('server_resources') or []
+    if resources:
+        print(f"Server peak RSS: {max(r['rss_mb'] for r in resources):.0f} MB, "
+              f"peak CPU: {max(r['cpu_percent'] for r in resources):.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Auto Stretch load-testing harness')
+    parser.add_argument('scenario', help='Scenario JSON file')
+    parser.add_argument('--url', help='Target an already running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='Server PID to sample RSS/CPU from (with --url)')
+    parser.add_argument('--report', help='Write the full JSON report to this file')
+    args = parser.parse_args()
+
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix='auto-stretch-load-')
+    image = scenario.get('image', {})
+    image_path = os.path.join(workdir, 'synthetic.tif')
+    size = make_synthetic_tiff(image_path, image.get('width', 2000), image.get('height', 1500),
+                               image.get('dtype', 'uint16'), image.get('compression'))
+    print(f"Synthetic TIFF: {size / (1024 * 1024):.1f} MB")
+
+    process = None
+    if args.url:
+        url, pid = args.url, args.pid
+    else:
+        process, url = start_server(scenario.get('config'), workdir)
+        pid = process.pid
+        print(f"Started server at {url} (pid {pid})")
+
+    sampler = ResourceSampler(pid) if pid and os.path.exists(f'/proc/{pid}') else None
+    if sampler:
+        sampler.start()
+
+    recorder = Recorder()
+    test = LoadTest(url, image_path, recorder)
+    start = time.monotonic()
+    try:
+        for phase in scenario['phases']:
+            test.run_phase(phase)
+    finally:
+        elapsed = time.monotonic() - start
+        if sampler:
+            sampler.stop()
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        'scenario': scenario.get('name', os.path.basename(args.scenario)),
+        'image_mb': size / (1024 * 1024),
+        'config': scenario.get('config'),
+        'elapsed_s': elapsed,
+        'endpoints': recorder.summary(elapsed),
+        'server_resources': sampler.samples if sampler else None
+    }
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for Auto Stretch
+
+Measures, in fresh interpreters:
+
+- import time of the app module versus its heavy dependencies
+  (numpy, Pillow, tifffile), each imported on its own
+- time from process start until the server answers its first request
+- latency of the first /upload, with and without warm-up
+
+Compare runs against a time budget with --budget; the script exits non-zero
+if the app import or time-to-first-request exceeds it.
+
+Usage:
+    python scripts/startup_benchmark.py
+    python scripts/startup_benchmark.py --runs 5 --budget 1.0 --report startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from load_test import SRC_DIR, encode_multipart, free_port, make_synthetic_tiff
+
+
+IMPORT_TARGETS = ['app', 'numpy', 'PIL.Image', 'tifffile']
+
+
+def measure_import(module, env):
+    """Seconds to import module in a fresh interpreter (excluding interpreter start-up)"""
+    code = ('import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter(); '
+            f'import {module}; print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code, SRC_DIR], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_request(env, warm, tiff_bytes):
+    """
+    Start the server and time its first page load and first upload
+
+    Returns:
+        dict: ready_s (process start to first 200 on /) and first_upload_s
+    """
+    port = free_port()
+    launcher = ('import sys; sys.path.insert(0, sys.argv[1]); from app import app, warm_up; '
+                'warm_up() if sys.argv[3] == "1" else None; '
+                'app.run(host="127.0.0.1", port=int(sys.argv[2]), threaded=True, use_reloader=False)')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', launcher, SRC_DIR, str(port), '1' if warm else '0'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                urllib.request.urlopen(f'{url}/', timeout=1).read()
+                break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('Server did not start')
+                time.sleep(0.01)
+        ready = time.perf_counter() - start
+
+        body, content_type = encode_multipart({'use_siril': 'false'},
+                                              {'file': ('benchmark.tif', tiff_bytes)})
+        request = urllib.request.Request(f'{url}/upload', data=body,
+                                         headers={'Content-Type': content_type})
+        upload_start = time.perf_counter()
+        urllib.request.urlopen(request, timeout=120).read()
+        first_upload = time.perf_counter() - upload_start
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {'ready_s': ready, 'first_upload_s': first_upload}
+
+
+def summarize(samples):
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'max_s': max(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Auto Stretch cold-start benchmark')
+    parser.add_argument('--runs', type=int, default=3, help='Repetitions per measurement')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Fail if app import or time-to-first-request (median, seconds) exceeds this')
+    parser.add_argument('--report', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='auto-stretch-startup-')
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump({'temp_dir': workdir, 'config_poll_s': 0}, f)
+    env = dict(os.environ, AUTO_STRETCH_CONFIG=config_path)
+
+    report = {'imports': {}, 'server': {}}
+    for module in IMPORT_TARGETS:
+        samples = [measure_import(module, env) for _ in range(args.runs)]
+        report['imports'][module] = summarize(samples)
+        print(f"import {module:<10} {report['imports'][module]['median_s'] * 1000:8.1f} ms")
+
+    tiff_path = os.path.join(workdir, 'benchmark.tif')
+    make_synthetic_tiff(tiff_path, 1000, 750)
+    with open(tiff_path, 'rb') as f:
+        tiff_bytes = f.read()
+    for warm in (False, True):
+        runs = [measure_first_request(env, warm, tiff_bytes) for _ in range(args.runs)]
+        mode = 'warm_up' if warm else 'lazy'
+        report['server'][mode] = {
+            'ready': summarize([r['ready_s'] for r in runs]),
+            'first_upload': summarize([r['first_upload_s'] for r in runs])
+        }
+        print(f"{mode:<8} first request {report['server'][mode]['ready']['median_s']:6.2f} s, "
+              f"first upload {report['server'][mode]['first_upload']['median_s']:6.2f} s")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.budget is not None:
+        worst = max(report['imports']['app']['median_s'], report['server']['lazy']['ready']['median_s'])
+        if worst > args.budget:
+            print(f"Startup budget exceeded: {worst:.2f}s > {args.budget:.2f}s")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Memory-aware admission control for Auto Stretch
+
+Every processing job is sized from its TIFF header before any pixels are
+decoded, then admitted against a global memory budget. Jobs that do not fit
+wait in a bounded FIFO queue; when the queue is full or the wait times out
+the caller gets AdmissionRejected, which the web app turns into
+503 Service Unavailable with a Retry-After header.
+
+ProcessingRate learns how long jobs take per megapixel, so uploads can be
+answered with an estimated processing time.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Working dtype of the pipeline (float32)
+WORKING_ITEMSIZE = 4
+
+# Peak number of full-size float32 planes alive at once while running the
+# pipeline (cached stage outputs plus per-stage temporaries)
+PIPELINE_FACTOR = 6
+
+# Seconds between cancellation checks of a queued job
+CHECK_INTERVAL = 0.1
+
+# Processing time per megapixel until jobs have been timed on this machine
+DEFAULT_SECONDS_PER_MEGAPIXEL = 0.25
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job cannot be admitted within the memory budget"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def default_budget_bytes():
+    """Half of physical memory, or 4 GB if it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return 4 * 1024 ** 3
+
+
+def estimate_job_bytes(input_path):
+    """
+    Estimate a job's peak memory from the TIFF header, without decoding
+
+    width x height x channels x working dtype size x pipeline factor, plus
+    the decoded native array.
+
+    Returns:
+        int: Estimated peak bytes
+    """
+    import tifffile
+
+    try:
+        with tifffile.TiffFile(input_path) as tif:
+            series = tif.series[0]
+            shape = series.shape
+            native_itemsize = series.dtype.itemsize
+    except Exception:
+        # Unknown layout: assume the whole file decodes to 16-bit pixels
+        size = os.path.getsize(input_path)
+        return size + size // 2 * WORKING_ITEMSIZE * PIPELINE_FACTOR
+
+    pixels = math.prod(shape)
+    return pixels * native_itemsize + pixels * WORKING_ITEMSIZE * PIPELINE_FACTOR
+
+
+def estimate_decode_bytes(input_path):
+    """
+    Memory needed to decode a TIFF in full, from its header
+
+    Uncompressed, contiguous images are memory-mapped rather than decoded,
+    and cost nothing up front.
+
+    Returns:
+        int: Decoded size in bytes, or 0 for memory-mappable images
+    """
+    import tifffile
+
+    try:
+        with tifffile.TiffFile(input_path) as tif:
+            series = tif.series[0]
+            if series.dataoffset is not None:
+                return 0
+            return math.prod(series.shape) * series.dtype.itemsize
+    except Exception:
+        # Unknown layout: assume the whole file decodes to 16-bit pixels
+        return os.path.getsize(input_path)
+
+
+class AdmissionController:
+    """Admits jobs against a memory budget with a bounded FIFO wait queue"""
+
+    def __init__(self, budget_bytes, max_queue=8, queue_timeout=60):
+        """
+        Args:
+            budget_bytes: Total estimated bytes allowed to run concurrently
+            max_queue: Maximum number of waiting jobs before rejecting outright
+            queue_timeout: Seconds a job may wait before it is rejected
+        """
+        self.budget_bytes = int(budget_bytes)
+        self.max_queue = int(max_queue)
+        self.queue_timeout = float(queue_timeout)
+        self._condition = threading.Condition()
+        self._admitted_bytes = 0
+        self._running = 0
+        self._queue = []
+        self._next_ticket = 0
+        self._rejected = 0
+        self._completed = 0
+
+    def configure(self, budget_bytes=None, max_queue=None, queue_timeout=None):
+        """Update limits at runtime; waiting jobs are re-evaluated"""
+        with self._condition:
+            if budget_bytes is not None:
+                self.budget_bytes = int(budget_bytes)
+            if max_queue is not None:
+                self.max_queue = int(max_queue)
+            if queue_timeout is not None:
+                self.queue_timeout = float(queue_timeout)
+            self._condition.notify_all()
+
+    def _fits(self, nbytes):
+        # A job larger than the whole budget may still run, but only alone
+        if self._running == 0:
+            return True
+        return self._admitted_bytes + nbytes <= self.budget_bytes
+
+    def _retry_after(self):
+        """Suggested Retry-After seconds for a rejected job"""
+        return max(1, int(math.ceil(self.queue_timeout / 2)))
+
+    @contextmanager
+    def admit(self, nbytes, check=None):
+        """
+        Hold nbytes of the budget for the duration of the with-block
+
+        Args:
+            nbytes: Estimated peak memory of the job
+            check: Optional callable run while queued; an exception it raises
+                withdraws the job from the queue and propagates
+
+        Raises:
+            AdmissionRejected: Queue full or wait timed out
+        """
+        nbytes = int(nbytes)
+        with self._condition:
+            if not self._queue and self._fits(nbytes):
+                ticket = None
+            else:
+                if len(self._queue) >= self.max_queue:
+                    self._rejected += 1
+                    raise AdmissionRejected('Server is busy: processing queue is full',
+                                            self._retry_after())
+
+                ticket = self._next_ticket
+                self._next_ticket += 1
+                self._queue.append(ticket)
+                deadline = time.monotonic() + self.queue_timeout
+
+                # FIFO: wait until this job is at the head and fits
+                while not (self._queue[0] == ticket and self._fits(nbytes)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._queue.remove(ticket)
+                        self._rejected += 1
+                        self._condition.notify_all()
+                        raise AdmissionRejected('Server is busy: timed out waiting for memory',
+                                                self._retry_after())
+                    if check is not None:
+                        try:
+                            check()
+                        except BaseException:
+                            self._queue.remove(ticket)
+                            self._condition.notify_all()
+                            raise
+                        remaining = min(remaining, CHECK_INTERVAL)
+                    self._condition.wait(remaining)
+
+                self._queue.pop(0)
+
+            self._admitted_bytes += nbytes
+            self._running += 1
+            self._condition.notify_all()
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._admitted_bytes -= nbytes
+                self._running -= 1
+                self._completed += 1
+                self._condition.notify_all()
+
+    def stats(self):
+        """Return a snapshot of admission state for monitoring"""
+        with self._condition:
+            return {
+                'budget_bytes': self.budget_bytes,
+                'admitted_bytes': self._admitted_bytes,
+                'running_jobs': self._running,
+                'queue_depth': len(self._queue),
+                'max_queue': self.max_queue,
+                'rejected_jobs': self._rejected,
+                'completed_jobs': self._completed
+            }
+
+
+class ProcessingRate:
+    """Running estimate of processing seconds per megapixel on this machine"""
+
+    def __init__(self, seconds_per_megapixel=DEFAULT_SECONDS_PER_MEGAPIXEL, weight=0.2):
+        """
+        Args:
+            seconds_per_megapixel: Initial estimate
+            weight: Weight of each new measurement (exponential moving average)
+        """
+        self.seconds_per_megapixel = seconds_per_megapixel
+        self.weight = weight
+        self._lock = threading.Lock()
+
+    def observe(self, megapixels, seconds):
+        """Record the duration of a job that processed an image from scratch"""
+        if megapixels <= 0:
+            return
+        with self._lock:
+            self.seconds_per_megapixel += self.weight * (seconds / megapixels - self.seconds_per_megapixel)
+
+    def estimate(self, megapixels):
+        """Estimated seconds to process an image of that size"""
+        return round(megapixels * self.seconds_per_megapixel, 1)
@@ -0,0 +1,127 @@
+"""
+Consistent-hash node affinity for Auto Stretch clusters
+
+Reprocessing an image is fast on the node that already has its decoded
+stages in the stage cache, and slow anywhere else. Every input ID is
+therefore owned by one node of the cluster, picked by a consistent-hash
+ring, and requests about an input that reach another node (the load
+balancer does not know about owners) are forwarded to the owner.
+
+Uploads pick their input ID so that the uploading node owns it, keeping the
+image on the node that decoded it. Adding or removing a node moves only the
+inputs on its share of the ring; a node that takes over an input fetches it
+from the shared artifact store on first use.
+
+Forwarded requests carry the cluster's shared secret; the forwarding header
+is ignored on requests without it, so clients cannot pick the node that
+handles them or pose as another client.
+"""
+
+import bisect
+import hashlib
+import hmac
+import json
+import socket
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Marks a forwarded request (value: the original client address); a node
+# always handles such requests itself, so forwarding never loops
+FORWARDED_HEADER = 'X-Auto-Stretch-Forwarded-For'
+
+# Shared secret (cluster_secret) proving that a request comes from a node
+SECRET_HEADER = 'X-Auto-Stretch-Cluster-Secret'
+
+# Request and response headers passed through when forwarding
+REQUEST_HEADERS = ('If-None-Match', 'Accept')
+RESPONSE_HEADERS = ('Content-Type', 'ETag', 'Cache-Control', 'Retry-After', 'X-ROI')
+
+
+class NodeUnavailable(Exception):
+    """The owner node could not be reached; the request should be handled locally"""
+
+
+def _point(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes"""
+
+    def __init__(self, nodes, replicas=128):
+        """
+        Args:
+            nodes: Node identifiers (base URLs)
+            replicas: Virtual nodes per node; more gives a more even split
+        """
+        self.nodes = list(dict.fromkeys(nodes))
+        ring = sorted((_point(f'{node}#{index}'), node) for node in self.nodes for index in range(replicas))
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def owner(self, key):
+        """Return the node owning key"""
+        index = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._owners[index]
+
+
+def is_forwarded(headers, secret):
+    """Whether a request was forwarded by a node holding the cluster secret"""
+    if not secret or FORWARDED_HEADER not in headers:
+        return False
+    return hmac.compare_digest(headers.get(SECRET_HEADER, '').encode(), secret.encode())
+
+
+def forward(node, method, path, form=None, client=None, headers=None, timeout=600, json_body=None,
+            secret=None):
+    """
+    Send a request to another node and return its response
+
+    Args:
+        node: Base URL of the node
+        path: Path and query string
+        form: Form fields for POST (MultiDict or dict), sent URL-encoded
+        client: Original client address
+        headers: Request headers to pass through
+        json_body: JSON-serializable body for POST, instead of form
+        secret: Cluster secret identifying this node to the receiving one
+
+    Returns:
+        tuple: (status, headers dict, body bytes); error statuses included
+
+    Raises:
+        NodeUnavailable: The node refused or dropped the connection
+        TimeoutError: The node did not answer within timeout
+    """
+    data = None
+    request_headers = {name: headers[name] for name in REQUEST_HEADERS if headers and name in headers}
+    request_headers[FORWARDED_HEADER] = client or ''
+    if secret:
+        request_headers[SECRET_HEADER] = secret
+    if form is not None:
+        items = form.items(multi=True) if hasattr(form, 'getlist') else form.items()
+        data = urllib.parse.urlencode(list(items)).encode()
+        request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    elif json_body is not None:
+        data = json.dumps(json_body).encode()
+        request_headers['Content-Type'] = 'application/json'
+
+    request = urllib.request.Request(node.rstrip('/') + path, data=data, method=method,
+                                     headers=request_headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, _pass_headers(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, _pass_headers(e.headers), e.read()
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, socket.timeout):
+            raise TimeoutError(f'{node} did not answer within {timeout}s') from e
+        raise NodeUnavailable(f'{node}: {e.reason}') from e
+    except ConnectionError as e:
+        raise NodeUnavailable(f'{node}: {e}') from e
+
+
+def _pass_headers(headers):
+    return {name: headers[name] for name in RESPONSE_HEADERS if headers.get(name) is not None}
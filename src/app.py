@@ -1,12 +1,17 @@
 import os
+import io
+import re
+import time
+import atexit
+import hmac
+import hashlib
+import logging
+import shutil
 import tempfile
 import subprocess
-from flask import Flask, render_template, request, send_file, jsonify
+from contextlib import contextmanager, nullcontext
+from flask import Flask, Response, render_template, request, send_file, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-from PIL import Image
-import numpy as np
-from datetime import datetime
-import tifffile
 
 # Import configuration manager
 try:
@@ -16,6 +21,36 @@ except ImportError:
     CONFIG_AVAILABLE = False
     print("Warning: config_manager not available. Using defaults.")
 
+from lazy_import import LazyModule
+from memory_cache import MemoryLRU
+from artifact_index import ArtifactIndex, INDEX_FILENAME
+from artifact_store import create_store
+import affinity
+from admission import (AdmissionController, AdmissionRejected, ProcessingRate, default_budget_bytes,
+                       estimate_decode_bytes, estimate_job_bytes, PIPELINE_FACTOR, WORKING_ITEMSIZE)
+import batch
+import compressed_upload
+from coalesce import LatestWins, Superseded
+from profiling import Profiler
+
+def configure_image_stack(pipeline_module):
+    """Apply image-stack tunables once the pipeline has been imported"""
+    import tiff_io
+
+    # Memory budget for cached intermediate pipeline stages
+    pipeline_module.stage_cache.resize(current_config.get('stage_cache_mb', 1024) * 1024 * 1024)
+
+    # Worker threads for decoding compressed TIFF strips/tiles
+    tiff_io.configure(current_config.get('decode_workers', 0))
+
+# The image stack (numpy, Pillow, tifffile) is imported on first use, so the
+# server can start answering requests that do not need it right away
+pipeline = LazyModule('pipeline', on_load=configure_image_stack)
+image_stats = LazyModule('image_stats')
+# Loads the pipeline first, so thumbnails are decoded with the configured workers
+quicklook = LazyModule('quicklook', on_load=lambda module: pipeline.load())
+Image = LazyModule('PIL.Image')
+
 # Get the directory where this script is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -24,9 +59,81 @@ if CONFIG_AVAILABLE:
     config = ConfigManager.load_config()
     max_upload_mb = config.get('max_upload_mb', 500)
     upload_folder = config.get('temp_dir') or tempfile.gettempdir()
+    index_db = config.get('index_db') or os.path.join(upload_folder, INDEX_FILENAME)
+    profiles_dir = config.get('profiles_dir') or os.path.join(upload_folder, 'auto-stretch-profiles')
+    log_level = config.get('log_level', 'INFO')
 else:
+    config = {}
     max_upload_mb = 500
     upload_folder = tempfile.gettempdir()
+    index_db = os.path.join(upload_folder, INDEX_FILENAME)
+    profiles_dir = os.path.join(upload_folder, 'auto-stretch-profiles')
+    log_level = 'INFO'
+
+logging.basicConfig(level=getattr(logging, log_level, logging.INFO),
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('AutoStretch')
+
+# Recently generated preview PNGs (artifact ID -> bytes), served without touching disk
+preview_cache = MemoryLRU(0)
+
+# Index of stored inputs, outputs and previews (artifact ID -> path and metadata)
+artifact_index = ArtifactIndex(index_db)
+
+# Store shared by the nodes of a cluster; files missing here are fetched from it
+artifact_store = create_store(config.get('artifact_store'))
+
+# Ownership of inputs across the cluster (None on a single node)
+node_url = config.get('node_url')
+cluster_secret = config.get('cluster_secret')
+cluster = None
+if config.get('cluster_nodes'):
+    if node_url not in config['cluster_nodes']:
+        logger.warning(f"node_url {node_url!r} is not one of cluster_nodes; affinity routing disabled")
+    elif not cluster_secret:
+        logger.warning("cluster_secret is not set; affinity routing disabled")
+    else:
+        cluster = affinity.HashRing(config['cluster_nodes'])
+
+# Limit concurrent processing by estimated peak memory
+admission = AdmissionController(default_budget_bytes())
+
+# Measured processing speed, for the estimates returned with uploads
+processing_rate = ProcessingRate()
+
+# On-demand cProfile/tracemalloc captures of live requests (armed via /admin/profile)
+profiler = Profiler(profiles_dir)
+
+# Newest /reprocess per client and image; older ones are abandoned
+reprocess_requests = LatestWins()
+
+# Multi-file uploads and the bounded worker pool that processes them
+batches = batch.BatchRegistry(max_workers=config.get('batch_workers', 2))
+
+# Optional worker processes for the stretch; images are exchanged with them
+# through shared memory. Sized at startup only.
+shared_store = None
+compute_pool = None
+if config.get('compute_workers', 0):
+    import shared_arrays
+    from compute_pool import ComputePool
+    shared_store = shared_arrays.SharedArrayStore()
+    shared_arrays.sweep_orphans()
+    atexit.register(shared_store.release_all)
+    compute_pool = ComputePool(shared_store, config['compute_workers'],
+                               cache_bytes=config.get('stage_cache_mb', 1024) * 1024 * 1024
+                               // config['compute_workers'],
+                               decode_workers=config.get('decode_workers', 0))
+
+# Configuration the runtime tunables were last applied from
+current_config = config
+
+# Output settings that can change at runtime (see apply_tunables)
+PREVIEW_MAX_WIDTH = 1200
+OUTPUT_COMPRESSION = None
+
+# Artifacts behind content-hashed URLs never change, so browsers may cache them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 # Initialize Flask with explicit template and static folder paths
 app = Flask(__name__,
@@ -35,120 +142,133 @@ app = Flask(__name__,
 app.config['MAX_CONTENT_LENGTH'] = max_upload_mb * 1024 * 1024  # Max file size from config
 app.config['UPLOAD_FOLDER'] = upload_folder
 
-# Optimize upload performance
-app.config['MAX_CONTENT_PATH'] = max_upload_mb * 1024 * 1024
+# Decompress request bodies sent with Content-Encoding: gzip or zstd
+app.wsgi_app = compressed_upload.DecodeRequestBody(app.wsgi_app)
+
+def apply_tunables(config, changed=None):
+    """
+    Push performance tunables from the configuration into the running subsystems
+
+    Called once at startup and again by ConfigManager whenever config.json
+    changes, so these settings take effect without a restart.
+    """
+    global current_config, PREVIEW_MAX_WIDTH, OUTPUT_COMPRESSION
+    current_config = config
+
+    # Stage cache and decode workers are applied when the image stack loads
+    if pipeline.loaded:
+        configure_image_stack(pipeline.load())
+    preview_cache.resize(config.get('preview_cache_mb', 64) * 1024 * 1024)
+
+    # 0 = half of physical RAM
+    memory_budget_mb = config.get('memory_budget_mb', 0)
+    admission.configure(
+        budget_bytes=memory_budget_mb * 1024 * 1024 if memory_budget_mb else default_budget_bytes(),
+        max_queue=config.get('admission_queue_size', 8),
+        queue_timeout=config.get('admission_timeout_s', 60))
+
+    PREVIEW_MAX_WIDTH = config.get('preview_max_width', 1200)
+    OUTPUT_COMPRESSION = config.get('output_compression')
+
+    max_upload = config.get('max_upload_mb', 500) * 1024 * 1024
+    app.config['MAX_CONTENT_LENGTH'] = max_upload
+    app.config['MAX_CONTENT_PATH'] = max_upload
+
+    level = config.get('log_level', 'INFO')
+    logging.getLogger().setLevel(getattr(logging, level, logging.INFO))
+
+    if changed:
+        logger.info(f"Reloaded configuration: {', '.join(sorted(changed))}")
+
+apply_tunables(config)
+
+if CONFIG_AVAILABLE and config.get('config_poll_s', 2):
+    ConfigManager.subscribe(apply_tunables)
+    ConfigManager.start_watcher(interval=config.get('config_poll_s', 2))
+
 # Use larger buffer for file operations (8MB)
 BUFFER_SIZE = 8 * 1024 * 1024
 
 ALLOWED_EXTENSIONS = {'tif', 'tiff'}
 
 def allowed_file(filename):
+    # Pre-compressed TIFFs (.tif.gz, .tif.zst) are decompressed on upload
+    filename, _ = compressed_upload.split_compression_suffix(filename)
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def stretch_image_with_params(input_path, output_path, params):
+def stretch_image_with_params(input_path, output_path, params, use_cache=True, stats=None, image=None,
+                              check=None):
     """
     Apply auto-stretch with configurable parameters
+
+    Intermediate stage results are memoized, so reprocessing with new
+    parameters only recomputes the stages downstream of the change.
+    Precomputed image statistics replace full-array rescans when given.
+    check() runs between stages and before saving; raising aborts the job.
+
+    Returns:
+        str: Content digest of the output, used for immutable artifact URLs
     """
-    # Load the image (use tifffile for better TIFF support)
-    try:
-        img_array = tifffile.imread(input_path).astype(np.float32)
-    except Exception:
-        # Fallback to PIL if tifffile fails
-        img = Image.open(input_path)
-        img_array = np.array(img, dtype=np.float32)
-
-    # Normalize to 0-1 range
-    if img_array.max() > 1:
-        img_array = img_array / img_array.max()
-
-    # Apply initial autostretch if values are very low (typical for raw astro images)
-    # This replaces what Siril's autostretch would do
-    needs_autostretch = img_array.max() < 0.9 and img_array.mean() < 0.1
-
-    if needs_autostretch:
-        # Aggressive histogram stretch for astronomical images
-        # Use global percentiles but with very aggressive clipping
-        for i in range(3):
-            channel = img_array[:,:,i]
-
-            # Use percentiles that focus on bringing out faint details
-            # This is similar to what Siril's autostretch does
-            low_percentile = np.percentile(channel, 0.001)  # Almost minimum
-            high_percentile = np.percentile(channel, 99.999)  # Almost maximum
-
-            # Clip and stretch
-            channel = np.clip(channel, low_percentile, high_percentile)
-            channel = (channel - low_percentile) / (high_percentile - low_percentile + 1e-10)
-            img_array[:,:,i] = channel
-
-        img_array = np.clip(img_array, 0, 1)
-
-        # Apply an aggressive midtone stretch to bring up faint details
-        img_array = np.power(img_array, 0.35)  # More aggressive midtone stretch
-
-    # Split into RGB channels
-    r, g, b = img_array[:,:,0], img_array[:,:,1], img_array[:,:,2]
-
-    # Apply gamma correction per channel (configurable)
-    r = np.power(r, params['gamma_red'])
-    g = np.power(g, params['gamma_green']) * params['green_multiplier']
-    b = np.power(b, params['gamma_blue']) * params['blue_multiplier']
-
-    # Recombine
-    img_array = np.stack([r, g, b], axis=-1)
-    img_array = np.clip(img_array, 0, 1)
-
-    # Apply tone curve only if NOT processing raw images
-    # Raw images are already mostly dark, no need to darken further
-    if not needs_autostretch:
-        # Darken background while brightening bright areas
-        # Create a luminosity mask
-        luminosity = 0.299 * img_array[:,:,0] + 0.587 * img_array[:,:,1] + 0.114 * img_array[:,:,2]
-
-        # Create a non-linear stretch curve (configurable)
-        darkening_curve = np.where(luminosity < params['dark_threshold'],
-                                     luminosity * params['dark_multiplier'],
-                                     luminosity)
-        darkening_curve = np.where((luminosity >= params['dark_threshold']) & (luminosity < params['mid_threshold']),
-                                     params['dark_threshold'] * params['dark_multiplier'] + (luminosity - params['dark_threshold']) * params['mid_boost'],
-                                     darkening_curve)
-        darkening_curve = np.where(luminosity >= params['mid_threshold'],
-                                     luminosity * params['bright_multiplier'],
-                                     darkening_curve)
-
-        # Apply curve while preserving color ratios
-        ratio = np.divide(darkening_curve, luminosity + 1e-10)
-        ratio = np.clip(ratio, 0, 3)
-        ratio = np.expand_dims(ratio, axis=2)
-
-        img_array = img_array * ratio
-        img_array = np.clip(img_array, 0, 1)
-
-    # Boost saturation by converting to HSV
-    img_pil = Image.fromarray((img_array * 255).astype(np.uint8))
-
-    # Convert to HSV
-    hsv = img_pil.convert('HSV')
-    h, s, v = hsv.split()
-
-    # Boost saturation selectively (configurable)
-    s_array = np.array(s, dtype=np.float32)
-    v_array = np.array(v, dtype=np.float32)
-
-    # More saturation in bright areas
-    bright_mask = v_array / 255.0
-    saturation_multiplier = 1.0 + (bright_mask ** 0.5) * params['saturation_boost']
-    s_array = s_array * saturation_multiplier
-    s_array = np.clip(s_array, 0, 255)
-    s = Image.fromarray(s_array.astype(np.uint8))
-
-    # Merge back
-    result = Image.merge('HSV', (h, s, v))
-    result = result.convert('RGB')
+    save_kwargs = {'compression': OUTPUT_COMPRESSION} if OUTPUT_COMPRESSION else {}
+
+    if compute_pool is not None:
+        # Stretch in a worker process; the result comes back in shared memory
+        if check is not None:
+            check()
+        handle = compute_pool.run_pipeline(input_path, params, use_cache=use_cache, stats=stats, image=image)
+        try:
+            if check is not None:
+                check()
+            Image.fromarray(shared_store.get(handle)).save(output_path, **save_kwargs)
+        finally:
+            shared_store.release(handle)
+        return pipeline.result_digest(input_path, params)
+
+    result = pipeline.run_pipeline(input_path, params, use_cache=use_cache, stats=stats, image=image,
+                                   check=check)
+    if check is not None:
+        check()
 
     # Save result
-    result.save(output_path)
-    return output_path
+    Image.fromarray(result).save(output_path, **save_kwargs)
+    return pipeline.result_digest(input_path, params)
+
+@contextmanager
+def decoded_input(input_path):
+    """
+    Decode an input TIFF for processing
+
+    With compute workers, pixels are decoded straight into shared memory so
+    the workers can map them; the segment is released when the block exits.
+    """
+    if shared_store is None:
+        yield pipeline.load_image(input_path)
+        return
+    image = pipeline.load_image(input_path, out=shared_store.allocate)
+    try:
+        yield image
+    finally:
+        shared_store.release(image)
+
+def save_preview(output_path, preview_path, preview_id):
+    """
+    Write a PNG preview of output_path and keep its bytes in the preview cache
+    """
+    img = Image.open(output_path)
+    # Resize for preview (max 1200px width by default)
+    max_width = PREVIEW_MAX_WIDTH
+    if img.width > max_width:
+        ratio = max_width / img.width
+        new_size = (max_width, int(img.height * ratio))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    data = buffer.getvalue()
+    with open(preview_path, 'wb') as f:
+        f.write(data)
+
+    preview_cache.put(preview_id, data, len(data))
 
 def run_siril_stretch(input_path, output_path):
     """
@@ -185,6 +305,389 @@ def run_siril_stretch(input_path, output_path):
         print(f"Siril processing error: {e}")
         return False
 
+def params_from_form(form):
+    """Read processing parameters from a request form, using the UI defaults"""
+    return {
+        'gamma_red': float(form.get('gamma_red', 0.7)),
+        'gamma_green': float(form.get('gamma_green', 0.8)),
+        'gamma_blue': float(form.get('gamma_blue', 0.75)),
+        'green_multiplier': float(form.get('green_multiplier', 0.93)),
+        'blue_multiplier': float(form.get('blue_multiplier', 1.08)),
+        'dark_threshold': float(form.get('dark_threshold', 0.15)),
+        'dark_multiplier': float(form.get('dark_multiplier', 0.3)),
+        'mid_threshold': float(form.get('mid_threshold', 0.4)),
+        'mid_boost': float(form.get('mid_boost', 1.5)),
+        'bright_multiplier': float(form.get('bright_multiplier', 1.1)),
+        'saturation_boost': float(form.get('saturation_boost', 1.0)),
+        'autostretch_mode': form.get('autostretch_mode', 'percentile'),
+        'autostretch_target_bg': float(form.get('autostretch_target_bg', 0.25)),
+        'autostretch_shadows_clip': float(form.get('autostretch_shadows_clip', -2.8)),
+        'background_extraction': form.get('background_extraction', 'false') == 'true',
+        'background_model': form.get('background_model', 'polynomial'),
+        'background_grid': int(form.get('background_grid', 16)),
+        'background_degree': int(form.get('background_degree', 2))
+    }
+
+def new_input_id():
+    """New input ID, chosen so that this node owns it in the cluster"""
+    input_id = artifact_index.new_id()
+    if cluster is not None:
+        # Each attempt hits this node with probability 1/len(nodes)
+        while cluster.owner(input_id) != node_url:
+            input_id = artifact_index.new_id()
+    return input_id
+
+def register_artifact(kind, path, artifact_id, **fields):
+    """Index a stored file and copy it to the shared artifact store, if any"""
+    artifact_index.add(kind, path, artifact_id=artifact_id, **fields)
+    if artifact_store is not None:
+        try:
+            artifact_store.put(artifact_index.get(artifact_id, touch=False))
+        except Exception as e:
+            # This node can still serve it; other nodes will report it missing
+            logger.error(f"Could not copy {kind} {artifact_id} to the artifact store: {e}")
+
+def find_artifact(artifact_id, kind, touch=True):
+    """
+    Return the index record of an artifact, or None
+
+    Artifacts whose file is not here (produced on another node, or removed
+    locally) are fetched from the shared artifact store and indexed. Without
+    a store the record is returned even if its file is gone.
+    """
+    record = artifact_index.get(artifact_id, kind=kind, touch=touch)
+    if artifact_store is None or (record is not None and os.path.exists(record['path'])):
+        return record
+
+    try:
+        metadata = artifact_store.get_record(artifact_id)
+        if metadata is None or metadata['kind'] != kind:
+            return record
+        path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(metadata['filename']))
+        if not artifact_store.fetch(artifact_id, path):
+            return record
+    except Exception as e:
+        logger.error(f"Could not fetch {kind} {artifact_id} from the artifact store: {e}")
+        return record
+
+    artifact_index.add(kind, path, artifact_id=artifact_id, original_name=metadata['original_name'],
+                       size=metadata['size'], content_hash=metadata['hash'], params=metadata['params'],
+                       owner=metadata['owner'], parent_id=metadata['parent_id'])
+    return artifact_index.get(artifact_id, kind=kind, touch=False)
+
+def forwarded_by_node():
+    """Whether this request was forwarded by another node of the cluster"""
+    return cluster is not None and affinity.is_forwarded(request.headers, cluster_secret)
+
+def client_address():
+    """Address of the client, also for requests forwarded by another node"""
+    if forwarded_by_node():
+        return request.headers[affinity.FORWARDED_HEADER]
+    return request.remote_addr
+
+def forward_to_owner(input_id):
+    """
+    Pass a request about input_id to the node that owns it
+
+    Returns:
+        The owner's response, or None to handle the request here: on a
+        single node, on the owner, for forwarded requests, and when the
+        owner cannot be reached (the input is then fetched from the store)
+    """
+    if cluster is None or forwarded_by_node():
+        return None
+    owner = cluster.owner(input_id)
+    if owner == node_url:
+        return None
+
+    try:
+        status, headers, body = affinity.forward(
+            owner, request.method, request.full_path,
+            form=request.form if request.method == 'POST' and not request.is_json else None,
+            json_body=request.get_json(silent=True) if request.is_json else None,
+            client=request.remote_addr, headers=request.headers, secret=cluster_secret,
+            timeout=current_config.get('affinity_timeout_s', 600))
+    except affinity.NodeUnavailable as e:
+        logger.warning(f"Owner of {input_id} unavailable, handling it here: {e}")
+        return None
+    except TimeoutError as e:
+        return jsonify({'error': str(e), 'input_file': input_id}), 504
+
+    response = app.response_class(body, status=status)
+    response.headers.update(headers)
+    return response
+
+def save_upload(file, owner):
+    """
+    Stream an uploaded file into the upload folder and index it
+
+    Returns:
+        tuple: (input_id, input_path, secure filename)
+    """
+    filename, codec = compressed_upload.split_compression_suffix(secure_filename(file.filename))
+    input_id = new_input_id()
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], f'input_{input_id}_{filename}')
+
+    # Use chunked writing with larger buffer for faster upload, hashing as we go.
+    # Pre-compressed files are decompressed on the fly, limited to the upload size.
+    content_hash = hashlib.sha256()
+    try:
+        with open(input_path, 'wb') as f:
+            if codec is None:
+                compressed_upload.copy_limited(file.stream, f, None, BUFFER_SIZE, content_hash.update)
+            else:
+                compressed_upload.copy_limited(compressed_upload.decompressed_stream(file.stream, codec), f,
+                                               app.config['MAX_CONTENT_LENGTH'], BUFFER_SIZE,
+                                               content_hash.update)
+    except Exception:
+        os.remove(input_path)
+        raise
+
+    register_artifact('input', input_path, input_id, original_name=filename,
+                      content_hash=content_hash.hexdigest(), owner=owner)
+    retain_content(input_path, content_hash.hexdigest())
+    return input_id, input_path, filename
+
+def retain_content(input_path, content_hash):
+    """
+    Keep a hash-addressed hard link to an uploaded input for /preflight
+
+    The link (blob_<sha256> in the upload folder) outlives the upload's own
+    handle, so the same content can be handed out again after /cleanup
+    without another transfer. It costs no extra disk space while the input
+    exists. Blobs beyond dedupe_store_mb are evicted least recently used first.
+    """
+    budget = current_config.get('dedupe_store_mb', 10240) * 1024 * 1024
+    if not budget:
+        return
+
+    record = artifact_index.find_by_hash(content_hash, kind='blob')
+    if record is not None and os.path.exists(record['path']):
+        artifact_index.touch(record['id'])
+        return
+
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f'blob_{content_hash}')
+    try:
+        os.link(input_path, path)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        # No hard links on this filesystem; copying would double the disk use
+        logger.debug(f"Not retaining {input_path} for deduplication: {e}")
+        return
+    artifact_index.add('blob', path, artifact_id=record['id'] if record else None, content_hash=content_hash)
+
+    excess = artifact_index.total_size(kind='blob') - budget
+    for blob in artifact_index.least_recently_used(limit=1000, kind='blob'):
+        if excess <= 0:
+            break
+        try:
+            os.remove(blob['path'])
+        except FileNotFoundError:
+            pass
+        artifact_index.remove(blob['id'])
+        excess -= blob['size'] or 0
+
+def link_stored_input(content_hash, size, filename, owner):
+    """
+    Create a new input handle for content the server already holds
+
+    Returns:
+        tuple: (input_id, input_path) or None if no stored blob matches
+    """
+    blob = artifact_index.find_by_hash(content_hash, kind='blob')
+    if blob is None or blob['size'] != size:
+        return None
+
+    input_id = new_input_id()
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], f'input_{input_id}_{filename}')
+    try:
+        os.link(blob['path'], input_path)
+    except FileNotFoundError:
+        # Evicted or removed behind the index's back
+        artifact_index.remove(blob['id'])
+        return None
+    except OSError:
+        shutil.copyfile(blob['path'], input_path)
+
+    artifact_index.touch(blob['id'])
+    register_artifact('input', input_path, input_id, original_name=filename, content_hash=content_hash,
+                      owner=owner)
+    return input_id, input_path
+
+def quick_look(input_path, params, image=None):
+    """
+    Thumbnail and header metadata of an input, for the upload response
+
+    The thumbnail is stretched with the request's parameters, so it previews
+    the result. Reading it takes milliseconds for most layouts (see
+    quicklook); an already decoded image is subsampled instead. Files that
+    must be decoded in full are admitted against the memory budget first.
+
+    Returns:
+        dict: 'metadata' and 'thumbnail' (JPEG data URL), or nothing if the
+            file cannot be inspected
+    """
+    try:
+        metadata = quicklook.describe_tiff(input_path)
+        if image is not None:
+            thumbnail, metadata['thumbnail_source'] = quicklook.subsample(image), 'decoded image'
+        else:
+            thumbnail, metadata['thumbnail_source'] = quicklook.read_thumbnail(input_path, full_decode=False)
+        if thumbnail is None:
+            with admission.admit(estimate_job_bytes(input_path)), decoded_input(input_path) as image:
+                thumbnail, metadata['thumbnail_source'] = quicklook.subsample(image), 'full decode'
+        metadata['estimated_seconds'] = processing_rate.estimate(metadata['megapixels'])
+        return {'metadata': metadata,
+                'thumbnail': quicklook.encode_thumbnail(pipeline.stretch_to_image(thumbnail, params))}
+    except Exception as e:
+        logger.warning(f"No quick look at {input_path}: {e}")
+        return {}
+
+def record_processing_time(stats, started):
+    """Time a job that processed an input from scratch, for later estimates"""
+    height, width = stats['shape'][:2]
+    processing_rate.observe(height * width / 1e6, time.perf_counter() - started)
+
+def process_input(input_id, input_path, filename, params, use_siril, owner, stats=None, image=None,
+                  profile=False, check=None):
+    """
+    Produce and index the output TIFF and preview PNG for an uploaded input
+
+    Must be called while holding a memory admission for the job.
+
+    Args:
+        profile: Let an armed profiler capture this job (interactive requests)
+        check: Optional cancellation checkpoint (see coalesce.Ticket.check)
+
+    Returns:
+        dict: preview_url, download_url, output_filename plus output and preview paths
+    """
+    output_id = artifact_index.new_id()
+    output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{output_id}_{filename}')
+
+    if profile and profiler.remaining:
+        capture = profiler.capture({
+            'endpoint': request.path,
+            'input_file': input_id,
+            'original_filename': filename,
+            'image_shape': stats['shape'] if stats else None,
+            'image_dtype': stats['dtype'] if stats else None,
+            'params': params,
+            'use_siril': use_siril
+        })
+    else:
+        capture = nullcontext({})
+
+    with capture as profile_info:
+        if use_siril:
+            # Run siril first, then post-process
+            basic_path = os.path.join(app.config['UPLOAD_FOLDER'], f'basic_{output_id}_{filename}')
+            if run_siril_stretch(input_path, basic_path):
+                profile_info['branch'] = 'siril'
+                try:
+                    digest = stretch_image_with_params(basic_path, output_path, params, use_cache=False,
+                                                       check=check)
+                finally:
+                    os.remove(basic_path)
+            else:
+                # Fallback to direct processing if siril fails
+                profile_info['branch'] = 'siril_failed_direct'
+                digest = stretch_image_with_params(input_path, output_path, params, stats=stats, image=image,
+                                                   check=check)
+        else:
+            # Direct post-processing without siril
+            profile_info['branch'] = 'direct'
+            digest = stretch_image_with_params(input_path, output_path, params, stats=stats, image=image,
+                                               check=check)
+
+    register_artifact('output', output_path, output_id,
+                      original_name=os.path.basename(output_path), content_hash=digest,
+                      params=params, owner=owner, parent_id=input_id)
+
+    # Convert to PNG for preview
+    preview_id = artifact_index.new_id()
+    preview_path = os.path.join(app.config['UPLOAD_FOLDER'], f'preview_{preview_id}.png')
+    save_preview(output_path, preview_path, preview_id)
+    register_artifact('preview', preview_path, preview_id, content_hash=digest,
+                      params=params, owner=owner, parent_id=input_id)
+
+    return {
+        'preview_url': f'/preview/{digest}/{preview_id}',
+        'download_url': f'/download/{digest}/{output_id}',
+        'output_filename': os.path.basename(output_path),
+        'output_path': output_path,
+        'preview_path': preview_path
+    }
+
+def warm_up():
+    """
+    Import the image stack and run every pipeline stage once on a tiny image
+
+    Meant to run once before the service reports readiness, so the first
+    real request does not pay for imports and first-call initialization.
+    """
+    start = time.perf_counter()
+    module = pipeline.load()
+    import numpy as np
+
+    sample = np.linspace(0, 1, 64 * 64 * 3, dtype=np.float32).reshape(64, 64, 3)
+    image_stats.compute_image_stats((sample * 65535).astype(np.uint16))
+
+    params = dict(module.DEFAULT_PARAMS, background_extraction=True)
+    state = (sample, {})
+    for name, _ in module.STAGE_PARAMS:
+        state = module.STAGE_FUNCTIONS[name](state[0], state[1], params)
+    Image.fromarray(state[0]).resize((32, 32), Image.Resampling.LANCZOS).save(io.BytesIO(), 'PNG')
+
+    logger.info(f"Warm-up completed in {time.perf_counter() - start:.2f}s")
+
+def run_server(port, debug=False):
+    """
+    Serve the app on all interfaces until stopped
+
+    Outside debug mode this goes through server.serve(): systemd socket
+    activation, readiness and watchdog notification, and graceful stop
+    (SIGTERM) and reload (SIGHUP) that let in-flight requests and queued
+    batch items finish first.
+    """
+    if debug:
+        if current_config.get('warm_up', True):
+            warm_up()
+        app.run(debug=True, host='0.0.0.0', port=port, threaded=True)
+        return
+
+    from server import serve
+    serve(app, '0.0.0.0', port,
+          warm_up=warm_up if current_config.get('warm_up', True) else None,
+          drain_timeout=current_config.get('drain_timeout_s', 300),
+          on_drain=drain_background_work,
+          health_path='/status')
+
+def drain_background_work(timeout=None):
+    """Finish queued batch items, then stop the compute workers"""
+    batches.shutdown()
+    if compute_pool is not None:
+        compute_pool.shutdown()
+
+def busy_response(error, input_id):
+    """503 response for a job that was not admitted"""
+    response = jsonify({
+        'error': f'{error}. Please retry shortly.',
+        'input_file': input_id,  # Already stored; retry via /reprocess without re-uploading
+        'retry_after': error.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.errorhandler(compressed_upload.UnsupportedEncoding)
+@app.errorhandler(compressed_upload.CorruptCompressedData)
+@app.errorhandler(compressed_upload.DecompressedTooLarge)
+def upload_error(error):
+    """JSON response for a compressed upload that cannot be stored"""
+    return jsonify({'error': error.description}), error.code
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -204,75 +707,92 @@ def upload_file():
 
     try:
         # Get parameters from form
-        params = {
-            'gamma_red': float(request.form.get('gamma_red', 0.7)),
-            'gamma_green': float(request.form.get('gamma_green', 0.8)),
-            'gamma_blue': float(request.form.get('gamma_blue', 0.75)),
-            'green_multiplier': float(request.form.get('green_multiplier', 0.93)),
-            'blue_multiplier': float(request.form.get('blue_multiplier', 1.08)),
-            'dark_threshold': float(request.form.get('dark_threshold', 0.15)),
-            'dark_multiplier': float(request.form.get('dark_multiplier', 0.3)),
-            'mid_threshold': float(request.form.get('mid_threshold', 0.4)),
-            'mid_boost': float(request.form.get('mid_boost', 1.5)),
-            'bright_multiplier': float(request.form.get('bright_multiplier', 1.1)),
-            'saturation_boost': float(request.form.get('saturation_boost', 1.0))
-        }
+        params = params_from_form(request.form)
 
         use_siril = request.form.get('use_siril', 'false') == 'true'
 
         # Save uploaded file with streaming and larger buffer for better performance
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], f'input_{timestamp}_{filename}')
-
-        # Use chunked writing with larger buffer for faster upload
-        with open(input_path, 'wb') as f:
-            while True:
-                chunk = file.stream.read(BUFFER_SIZE)
-                if not chunk:
-                    break
-                f.write(chunk)
-
-        # Process image
-        if use_siril:
-            # Run siril first, then post-process
-            basic_path = os.path.join(app.config['UPLOAD_FOLDER'], f'basic_{timestamp}_{filename}')
-            if run_siril_stretch(input_path, basic_path):
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{timestamp}_{filename}')
-                stretch_image_with_params(basic_path, output_path, params)
-                os.remove(basic_path)
-            else:
-                # Fallback to direct processing if siril fails
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{timestamp}_{filename}')
-                stretch_image_with_params(input_path, output_path, params)
-        else:
-            # Direct post-processing without siril
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{timestamp}_{filename}')
-            stretch_image_with_params(input_path, output_path, params)
-
-        # Convert to PNG for preview
-        preview_path = os.path.join(app.config['UPLOAD_FOLDER'], f'preview_{timestamp}.png')
-        img = Image.open(output_path)
-        # Resize for preview (max 1200px width)
-        max_width = 1200
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_size = (max_width, int(img.height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        img.save(preview_path, 'PNG')
+        input_id, input_path, filename = save_upload(file, request.remote_addr)
+
+        if request.form.get('defer', 'false') == 'true':
+            # Answer with a thumbnail right away; the client processes via /reprocess
+            return jsonify({
+                'success': True,
+                'deferred': True,
+                'input_file': input_id,
+                'original_filename': filename,
+                **quick_look(input_path, params)
+            })
+
+        # Size the job from the TIFF header and wait for memory before decoding
+        job_bytes = estimate_job_bytes(input_path)
+        with admission.admit(job_bytes):
+            started = time.perf_counter()
+            with decoded_input(input_path) as image:
+                # Decode once and compute image statistics for this and every later reprocess
+                stats = image_stats.compute_image_stats(image)
+                image_stats.save_image_stats(input_path, stats)
+
+                # Process image
+                result = process_input(input_id, input_path, filename, params, use_siril,
+                                       request.remote_addr, stats=stats, image=image, profile=True)
+                if not use_siril:
+                    record_processing_time(stats, started)
+                quick = quick_look(input_path, params, image=image)
 
         # Keep input file for reprocessing - don't delete it yet
         # It will be cleaned up when user resets or after timeout
 
         return jsonify({
             'success': True,
-            'preview_url': f'/preview/{os.path.basename(preview_path)}',
-            'download_url': f'/download/{os.path.basename(output_path)}',
-            'output_filename': os.path.basename(output_path),
-            'input_file': os.path.basename(input_path),  # Return input file for reprocessing
-            'original_filename': filename
+            'preview_url': result['preview_url'],
+            'download_url': result['download_url'],
+            'output_filename': result['output_filename'],
+            'input_file': input_id,  # Return input file for reprocessing
+            'original_filename': filename,
+            **quick
         })
 
+    except compressed_upload.UPLOAD_ERRORS as e:
+        return upload_error(e)
+    except AdmissionRejected as e:
+        return busy_response(e, input_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Hex SHA-256 digest, as sent to /preflight
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+@app.route('/preflight', methods=['POST'])
+def preflight_upload():
+    """
+    Skip uploading a file the server already holds
+
+    The client sends the SHA-256 and size of the file it is about to upload
+    (JSON: sha256, size, filename). If that exact content is stored, a new
+    input_file handle is returned right away (with a quick look, as from a
+    deferred /upload) and the client continues with /reprocess instead of
+    transferring the file.
+    """
+    data = request.get_json(silent=True) or {}
+    content_hash = str(data.get('sha256', '')).lower()
+    size = data.get('size')
+    filename = secure_filename(str(data.get('filename', '')))
+
+    if not SHA256_PATTERN.match(content_hash) or not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'sha256 (hex) and size (bytes) are required'}), 400
+    if not allowed_file(filename):
+        return jsonify({'error': 'Only TIFF files are allowed'}), 400
+    if compressed_upload.split_compression_suffix(filename)[1] is not None:
+        # Stored inputs are hashed decompressed
+        return jsonify({'exists': False})
+
+    try:
+        linked = link_stored_input(content_hash, size, filename, request.remote_addr)
+        if linked is None:
+            return jsonify({'exists': False})
+        return jsonify({'exists': True, 'input_file': linked[0], 'original_filename': filename,
+                        **quick_look(linked[1], None)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -280,103 +800,435 @@ def upload_file():
 def reprocess_file():
     """Reprocess an already uploaded file with new parameters"""
     try:
-        # Get the stored input file name
-        input_filename = request.form.get('input_file')
-        if not input_filename:
+        # Get the stored input file ID
+        input_id = request.form.get('input_file')
+        if not input_id:
             return jsonify({'error': 'No input file specified'}), 400
 
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+        # The node holding the image's cached stages does this fastest
+        forwarded = forward_to_owner(input_id)
+        if forwarded is not None:
+            return forwarded
 
         # Check if file still exists
-        if not os.path.exists(input_path):
+        record = find_artifact(input_id, 'input')
+        if record is None or not os.path.exists(record['path']):
             return jsonify({'error': 'Original file no longer available. Please re-upload.'}), 404
+        input_path = record['path']
 
         # Get new parameters from form
-        params = {
-            'gamma_red': float(request.form.get('gamma_red', 0.7)),
-            'gamma_green': float(request.form.get('gamma_green', 0.8)),
-            'gamma_blue': float(request.form.get('gamma_blue', 0.75)),
-            'green_multiplier': float(request.form.get('green_multiplier', 0.93)),
-            'blue_multiplier': float(request.form.get('blue_multiplier', 1.08)),
-            'dark_threshold': float(request.form.get('dark_threshold', 0.15)),
-            'dark_multiplier': float(request.form.get('dark_multiplier', 0.3)),
-            'mid_threshold': float(request.form.get('mid_threshold', 0.4)),
-            'mid_boost': float(request.form.get('mid_boost', 1.5)),
-            'bright_multiplier': float(request.form.get('bright_multiplier', 1.1)),
-            'saturation_boost': float(request.form.get('saturation_boost', 1.0))
-        }
+        params = params_from_form(request.form)
 
         use_siril = request.form.get('use_siril', 'false') == 'true'
 
-        # Generate new timestamp for output files
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-        # Extract original filename from input_path
-        original_filename = '_'.join(input_filename.split('_')[2:])  # Remove 'input_timestamp_' prefix
-
-        # Process image with new parameters
-        if use_siril:
-            # Run siril first, then post-process
-            basic_path = os.path.join(app.config['UPLOAD_FOLDER'], f'basic_{timestamp}_{original_filename}')
-            if run_siril_stretch(input_path, basic_path):
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{timestamp}_{original_filename}')
-                stretch_image_with_params(basic_path, output_path, params)
-                os.remove(basic_path)
-            else:
-                # Fallback to direct processing if siril fails
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{timestamp}_{original_filename}')
-                stretch_image_with_params(input_path, output_path, params)
-        else:
-            # Direct post-processing without siril
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], f'output_{timestamp}_{original_filename}')
-            stretch_image_with_params(input_path, output_path, params)
-
-        # Convert to PNG for preview
-        preview_path = os.path.join(app.config['UPLOAD_FOLDER'], f'preview_{timestamp}.png')
-        img = Image.open(output_path)
-        # Resize for preview (max 1200px width)
-        max_width = 1200
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_size = (max_width, int(img.height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        img.save(preview_path, 'PNG')
+        # Size the job from the TIFF header and wait for memory before decoding.
+        # A newer reprocess of the same image from the same client supersedes
+        # this one, whether it is still queued or already running.
+        job_bytes = estimate_job_bytes(input_path)
+        with reprocess_requests.track((client_address(), input_id)) as ticket, \
+                admission.admit(job_bytes, check=ticket.check):
+            # Reuse the statistics computed at upload time; inputs that never went
+            # through /upload (preflight, artifact store) get them on first use
+            stats = image_stats.load_image_stats(input_path)
+
+            original_filename = record['original_name']
+
+            started = time.perf_counter()
+            with decoded_input(input_path) if stats is None else nullcontext() as image:
+                if stats is None:
+                    stats = image_stats.compute_image_stats(image)
+                    image_stats.save_image_stats(input_path, stats)
+
+                # Process image with new parameters
+                result = process_input(input_id, input_path, original_filename, params, use_siril,
+                                       client_address(), stats=stats, image=image, profile=True,
+                                       check=ticket.check)
+                if image is not None and not use_siril:
+                    # First processing of a deferred or preflighted upload
+                    record_processing_time(stats, started)
 
         return jsonify({
             'success': True,
-            'preview_url': f'/preview/{os.path.basename(preview_path)}',
-            'download_url': f'/download/{os.path.basename(output_path)}',
-            'output_filename': os.path.basename(output_path),
-            'input_file': input_filename,  # Keep same input file for further reprocessing
+            'preview_url': result['preview_url'],
+            'download_url': result['download_url'],
+            'output_filename': result['output_filename'],
+            'input_file': input_id,  # Keep same input file for further reprocessing
             'original_filename': original_filename
         })
 
+    except AdmissionRejected as e:
+        return busy_response(e, input_id)
+    except Superseded as e:
+        # Only the newest request's result will be displayed
+        return jsonify({'error': str(e), 'superseded': True, 'input_file': input_id}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/preview/<filename>')
-def preview_file(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(file_path):
-        return send_file(file_path, mimetype='image/png')
-    return 'File not found', 404
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    """
+    Upload several TIFFs processed with one parameter set
+
+    Files are stored right away and processed in the background; poll
+    /batch/<id> for progress or stream /batch/<id>/download to receive a ZIP
+    of the results as they finish.
+    """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    max_files = current_config.get('max_batch_files', 50)
+    if len(files) > max_files:
+        return jsonify({'error': f'Too many files: at most {max_files} per batch'}), 400
 
-@app.route('/download/<filename>')
-def download_file(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True, download_name=filename)
-    return 'File not found', 404
+    rejected = [file.filename for file in files if not allowed_file(file.filename)]
+    if rejected:
+        return jsonify({'error': f'Only TIFF files are allowed: {", ".join(rejected)}'}), 400
+
+    try:
+        params = params_from_form(request.form)
+        use_siril = request.form.get('use_siril', 'false') == 'true'
+
+        job = batches.create(artifact_index.new_id(), params, owner=request.remote_addr)
+        for file in files:
+            input_id, input_path, filename = save_upload(file, request.remote_addr)
+            index = job.add_item(input_id, filename)
+            batches.submit(process_batch_item, job, index, input_path, use_siril)
+
+        response = job.to_dict()
+        response.update({
+            'success': True,
+            'status_url': f'/batch/{job.id}',
+            'download_url': f'/batch/{job.id}/download'
+        })
+        return jsonify(response), 202
+
+    except compressed_upload.UPLOAD_ERRORS as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Times a batch item retries admission before it is marked as failed
+BATCH_ADMISSION_RETRIES = 5
+
+def process_batch_item(job, index, input_path, use_siril):
+    """Process one file of a batch on a worker thread"""
+    item = job.items[index]
+    input_id, filename = item['input_file'], item['original_filename']
+    job.update_item(index, batch.PROCESSING)
+
+    for attempt in range(BATCH_ADMISSION_RETRIES + 1):
+        try:
+            with admission.admit(estimate_job_bytes(input_path)):
+                started = time.perf_counter()
+                with decoded_input(input_path) as image:
+                    # Decode once for the statistics and the pipeline
+                    stats = image_stats.compute_image_stats(image)
+                    image_stats.save_image_stats(input_path, stats)
+
+                    result = process_input(input_id, input_path, filename, job.params, use_siril,
+                                           job.owner, stats=stats, image=image)
+                    if not use_siril:
+                        record_processing_time(stats, started)
+            job.update_item(index, batch.DONE, result=result)
+            return
+        except AdmissionRejected as e:
+            # Background work can simply wait for interactive requests to drain
+            if attempt == BATCH_ADMISSION_RETRIES:
+                job.update_item(index, batch.ERROR, error=str(e))
+                return
+            time.sleep(e.retry_after)
+        except Exception as e:
+            logger.error(f"Batch {job.id}: failed to process {filename}: {e}")
+            job.update_item(index, batch.ERROR, error=str(e))
+            return
+
+@app.route('/batch/<batch_id>')
+def batch_status(batch_id):
+    """Progress of a batch and links to every finished item"""
+    job = batches.get(batch_id)
+    if job is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/batch/<batch_id>/download')
+def batch_download(batch_id):
+    """Stream a ZIP of the batch's outputs and previews as they finish"""
+    job = batches.get(batch_id)
+    if job is None:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    def entries():
+        used_names = set()
+
+        def unique(name):
+            stem, ext = os.path.splitext(name)
+            candidate, counter = name, 1
+            while candidate in used_names:
+                counter += 1
+                candidate = f'{stem}_{counter}{ext}'
+            used_names.add(candidate)
+            return candidate
+
+        for item in job.completed_items():
+            if item['status'] != batch.DONE:
+                continue
+            name = item['original_filename']
+            # Output TIFFs compress well; PNG previews are already compressed
+            yield unique(f'outputs/{name}'), item['result']['output_path'], True
+            yield unique(f'previews/{os.path.splitext(name)[0]}.png'), item['result']['preview_path'], False
+
+    response = Response(stream_with_context(batch.stream_zip(entries())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=batch_{batch_id}.zip'
+    return response
+
+@app.route('/status')
+def status():
+    """Processing load and cache usage for monitoring"""
+    return jsonify({
+        'admission': admission.stats(),
+        'seconds_per_megapixel': round(processing_rate.seconds_per_megapixel, 3),
+        'reprocess': reprocess_requests.stats(),
+        'stage_cache': pipeline.stage_cache.stats() if pipeline.loaded else None,
+        'preview_cache': preview_cache.stats(),
+        'shared_memory': shared_store.stats() if shared_store is not None else None,
+        'cluster': {'node': node_url, 'nodes': cluster.nodes} if cluster is not None else None,
+        'artifact_store': artifact_store.describe() if artifact_store is not None else None
+    })
+
+def cache_artifact_response(response, record, digest):
+    """
+    Apply caching headers to an artifact response
+
+    Content-hashed URLs are immutable; plain URLs must revalidate via ETag.
+    """
+    if digest is not None and digest == record['hash']:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def lookup_artifact(artifact_id, kind, digest=None):
+    """Return the index record for a servable artifact, or None"""
+    record = find_artifact(artifact_id, kind)
+    if record is None:
+        return None
+    if digest is not None and digest != record['hash']:
+        return None
+    return record
+
+@app.route('/preview/<artifact_id>')
+@app.route('/preview/<digest>/<artifact_id>')
+def preview_file(artifact_id, digest=None):
+    record = lookup_artifact(artifact_id, 'preview', digest)
+    if record is None:
+        return 'File not found', 404
+
+    # Hot previews are served straight from memory
+    data = preview_cache.get(artifact_id)
+    if data is not None:
+        response = app.response_class(data, mimetype='image/png')
+        response.set_etag(record['hash'])
+        response = cache_artifact_response(response, record, digest)
+        return response.make_conditional(request)
+
+    try:
+        response = send_file(record['path'], mimetype='image/png', conditional=True,
+                             etag=record['hash'])
+    except FileNotFoundError:
+        artifact_index.remove(artifact_id)
+        return 'File not found', 404
+    return cache_artifact_response(response, record, digest)
+
+@app.route('/download/<artifact_id>')
+@app.route('/download/<digest>/<artifact_id>')
+def download_file(artifact_id, digest=None):
+    record = lookup_artifact(artifact_id, 'output', digest)
+    if record is None:
+        return 'File not found', 404
+
+    try:
+        # conditional=True enables If-None-Match and byte-range (resumable) requests
+        response = send_file(record['path'], as_attachment=True, download_name=record['original_name'],
+                             conditional=True, etag=record['hash'])
+    except FileNotFoundError:
+        artifact_index.remove(artifact_id)
+        return 'File not found', 404
+    return cache_artifact_response(response, record, digest)
+
+# Largest region side /roi renders in one request
+ROI_MAX_SIZE = 2048
+
+@app.route('/roi/<input_file>')
+def render_roi(input_file):
+    """
+    Render a region of the processed image at 1:1 as PNG (the loupe)
+
+    Query arguments: x, y, width, height in full-resolution pixels plus the
+    same processing parameters as /reprocess.
+    """
+    forwarded = forward_to_owner(input_file)
+    if forwarded is not None:
+        return forwarded
+
+    record = find_artifact(input_file, 'input')
+    if record is None or not os.path.exists(record['path']):
+        return jsonify({'error': 'Original file no longer available. Please re-upload.'}), 404
+    input_path = record['path']
+
+    try:
+        params = params_from_form(request.args)
+        x = int(request.args.get('x', 0))
+        y = int(request.args.get('y', 0))
+        width = int(request.args.get('width', 256))
+        height = int(request.args.get('height', 256))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {e}'}), 400
+
+    try:
+        stats = image_stats.load_image_stats(input_path)
+        if stats is None:
+            # First use of an input that never went through /upload
+            with admission.admit(estimate_job_bytes(input_path)), decoded_input(input_path) as image:
+                stats = image_stats.compute_image_stats(image)
+            image_stats.save_image_stats(input_path, stats)
+
+        # Clip the rectangle to the frame
+        frame_height, frame_width = stats['shape'][:2]
+        x, y = min(max(x, 0), frame_width - 1), min(max(y, 0), frame_height - 1)
+        width = min(max(width, 1), ROI_MAX_SIZE, frame_width - x)
+        height = min(max(height, 1), ROI_MAX_SIZE, frame_height - y)
+        box = (x, y, width, height)
+
+        etag = hashlib.sha1(f'{pipeline.result_digest(input_path, params)}:{box}'.encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            # Only the region is processed, from a cached stage or the input itself.
+            # Without a cached stage, background extraction needs the whole frame,
+            # and inputs that cannot be memory-mapped are decoded in full.
+            channels = stats['shape'][2] if len(stats['shape']) > 2 else 1
+            job_bytes = width * height * channels * WORKING_ITEMSIZE * PIPELINE_FACTOR
+            cached = pipeline.cached_stage(input_path, params)
+            if cached[1] is None:
+                if params['background_extraction']:
+                    job_bytes = estimate_job_bytes(input_path)
+                else:
+                    job_bytes += estimate_decode_bytes(input_path)
+
+            with admission.admit(job_bytes):
+                region = pipeline.render_roi(input_path, params, box, stats=stats, cached=cached)
+
+            buffer = io.BytesIO()
+            Image.fromarray(region).save(buffer, 'PNG')
+            response = app.response_class(buffer.getvalue(), mimetype='image/png')
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['X-ROI'] = ','.join(str(value) for value in box)
+        return response
+
+    except AdmissionRejected as e:
+        return busy_response(e, input_file)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def admin_authorized():
+    """True if the request carries the configured admin token"""
+    token = current_config.get('admin_token')
+    # Header only: query strings end up in access logs and browser history
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+@app.route('/admin/profile', methods=['POST'])
+def arm_profiler():
+    """Profile the next N /upload or /reprocess requests (count=0 disarms)"""
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        count = int((request.get_json(silent=True) or request.form).get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be an integer'}), 400
+    remaining = profiler.arm(count)
+    logger.info(f"Profiler armed for the next {remaining} processing request(s)")
+    return jsonify({'success': True, 'remaining': remaining})
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """Stored profiling captures, newest first"""
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({'remaining': profiler.remaining, 'captures': profiler.list_captures()})
+
+@app.route('/admin/profiles/<filename>')
+def download_profile(filename):
+    """Download a capture: <capture_id>.prof (cProfile data) or <capture_id>.json (metadata)"""
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    capture_id, ext = os.path.splitext(filename)
+    path = profiler.capture_path(capture_id, ext)
+    if path is None:
+        return 'File not found', 404
+    return send_file(path, as_attachment=True, download_name=filename)
+
+@app.route('/stats/<input_file>')
+def get_stats(input_file):
+    """Return per-channel statistics and histograms for an uploaded file"""
+    forwarded = forward_to_owner(input_file)
+    if forwarded is not None:
+        return forwarded
+
+    record = find_artifact(input_file, 'input')
+    if record is None or not os.path.exists(record['path']):
+        return jsonify({'error': 'Original file no longer available. Please re-upload.'}), 404
+    input_path = record['path']
+
+    try:
+        stats = image_stats.load_image_stats(input_path)
+        if stats is None:
+            # First use of an input that never went through /upload
+            with admission.admit(estimate_job_bytes(input_path)), decoded_input(input_path) as image:
+                stats = image_stats.compute_image_stats(image)
+            image_stats.save_image_stats(input_path, stats)
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/cleanup', methods=['POST'])
 def cleanup_file():
-    """Clean up stored files when user wants to upload a new image"""
+    """
+    Clean up stored files when user wants to upload a new image
+
+    Removes the input with its statistics and every output and preview made
+    from it: here, on the node owning the input, and in the shared store.
+    The content stays available to /preflight through its blob.
+    """
     try:
-        input_filename = request.json.get('input_file')
-        if input_filename:
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+        input_id = request.json.get('input_file')
+        if not input_id:
+            return jsonify({'success': True})
+
+        for child in artifact_index.children(input_id):
+            if os.path.exists(child['path']):
+                os.remove(child['path'])
+            preview_cache.pop(child['id'])
+            artifact_index.remove(child['id'])
+
+        record = artifact_index.get(input_id, kind='input', touch=False)
+        if record:
+            input_path = record['path']
             if os.path.exists(input_path):
                 os.remove(input_path)
+            image_stats.discard_image_stats(input_path)
+            artifact_index.remove(input_id)
+        if artifact_store is not None:
+            artifact_store.delete_tree(input_id)
+
+        # The owner holds most of the input's outputs and previews
+        forwarded = forward_to_owner(input_id)
+        if forwarded is not None:
+            return forwarded
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -406,4 +1258,4 @@ if __name__ == '__main__':
 
     print(f"Starting Auto Stretch on port {port}...")
     print(f"Configuration: max_upload={max_upload_mb}MB, debug={debug}")
-    app.run(debug=debug, host='0.0.0.0', port=port, threaded=True)
+    run_server(port, debug=debug)
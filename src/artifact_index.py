@@ -0,0 +1,181 @@
+"""
+SQLite artifact index for Auto Stretch
+
+Maps unique artifact IDs to the files stored in the upload folder (inputs,
+processed outputs and previews) together with their metadata: original
+name, size, content hash, processing parameters, owner and access times.
+
+IDs are random tokens, so concurrent uploads can never collide the way
+timestamp-based filenames did, and every lookup is a primary-key query
+instead of parsing filenames and probing the filesystem. The metadata is
+what eviction and caching policies need (sizes, hashes, last access).
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    original_name TEXT,
+    size INTEGER,
+    hash TEXT,
+    params TEXT,
+    owner TEXT,
+    parent_id TEXT,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_hash ON artifacts (hash);
+CREATE INDEX IF NOT EXISTS artifacts_parent ON artifacts (parent_id);
+CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access);
+"""
+
+INDEX_FILENAME = 'auto-stretch-index.db'
+
+
+class ArtifactIndex:
+    """Thread-safe index of stored artifacts backed by a local SQLite database"""
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: Path of the SQLite database file (created if missing)
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection (SQLite connections are per-thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL lets readers proceed while another thread writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def new_id():
+        """Generate a collision-resistant artifact ID"""
+        return secrets.token_hex(8)
+
+    def add(self, kind, path, artifact_id=None, original_name=None, size=None,
+            content_hash=None, params=None, owner=None, parent_id=None):
+        """
+        Register an artifact
+
+        Args:
+            kind: 'input', 'output' or 'preview'
+            path: Absolute path of the stored file
+            artifact_id: ID to use (default: a new random ID)
+            original_name: User-facing filename
+            size: File size in bytes (default: read from disk)
+            content_hash: Content digest of the file
+            params: Processing parameters (dict) that produced the artifact
+            owner: Identifier of the client that created it
+            parent_id: ID of the artifact this one was derived from
+
+        Returns:
+            str: The artifact ID
+        """
+        artifact_id = artifact_id or self.new_id()
+        if size is None and os.path.exists(path):
+            size = os.path.getsize(path)
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO artifacts '
+                '(id, kind, path, original_name, size, hash, params, owner, parent_id, created, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (artifact_id, kind, path, original_name, size, content_hash,
+                 json.dumps(params) if params is not None else None,
+                 owner, parent_id, now, now))
+        return artifact_id
+
+    @staticmethod
+    def _row_to_dict(row):
+        if row is None:
+            return None
+        record = dict(row)
+        if record['params'] is not None:
+            record['params'] = json.loads(record['params'])
+        return record
+
+    def get(self, artifact_id, kind=None, touch=True):
+        """
+        Look up an artifact by ID
+
+        Args:
+            artifact_id: Artifact ID
+            kind: Only match artifacts of this kind (optional)
+            touch: Update the last-access time
+
+        Returns:
+            dict or None: Artifact record
+        """
+        conn = self._connect()
+        if kind is None:
+            row = conn.execute('SELECT * FROM artifacts WHERE id = ?', (artifact_id,)).fetchone()
+        else:
+            row = conn.execute('SELECT * FROM artifacts WHERE id = ? AND kind = ?',
+                               (artifact_id, kind)).fetchone()
+        if row is not None and touch:
+            self.touch(artifact_id)
+        return self._row_to_dict(row)
+
+    def touch(self, artifact_id):
+        """Record an access to an artifact"""
+        with self._connect() as conn:
+            conn.execute('UPDATE artifacts SET last_access = ? WHERE id = ?',
+                         (time.time(), artifact_id))
+
+    def find_by_hash(self, content_hash, kind='input'):
+        """Return the most recently used artifact with the given content hash"""
+        row = self._connect().execute(
+            'SELECT * FROM artifacts WHERE hash = ? AND kind = ? ORDER BY last_access DESC LIMIT 1',
+            (content_hash, kind)).fetchone()
+        return self._row_to_dict(row)
+
+    def children(self, parent_id):
+        """Return all artifacts derived from parent_id"""
+        rows = self._connect().execute('SELECT * FROM artifacts WHERE parent_id = ?',
+                                       (parent_id,)).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def least_recently_used(self, limit=100, kind=None):
+        """Return artifacts ordered from least to most recently accessed"""
+        if kind is None:
+            rows = self._connect().execute(
+                'SELECT * FROM artifacts ORDER BY last_access ASC LIMIT ?', (limit,)).fetchall()
+        else:
+            rows = self._connect().execute(
+                'SELECT * FROM artifacts WHERE kind = ? ORDER BY last_access ASC LIMIT ?',
+                (kind, limit)).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def total_size(self, kind=None):
+        """Total bytes of indexed artifacts (optionally of one kind)"""
+        if kind is None:
+            row = self._connect().execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()
+        else:
+            row = self._connect().execute('SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE kind = ?',
+                                          (kind,)).fetchone()
+        return row[0]
+
+    def remove(self, artifact_id):
+        """Remove an artifact from the index (the file itself is left alone)"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM artifacts WHERE id = ?', (artifact_id,))
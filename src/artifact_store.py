@@ -0,0 +1,286 @@
+"""
+Shared artifact storage for multi-node Auto Stretch deployments
+
+Each node keeps inputs, outputs and previews in its own upload folder and
+indexes them in its own ArtifactIndex. With several nodes behind a load
+balancer, every artifact is also written to a shared store, so a node that
+never saw an upload can still serve it: on a local miss the file and its
+index record are fetched from the store into the local upload folder.
+
+An artifact is stored as two objects, the file itself under its ID and its
+index record as JSON under '<id>.json'. The record is written last, so an
+artifact is visible only once its file is complete. Outputs and previews
+also get an empty marker 'children/<input id>/<id>', so everything derived
+from an input can be found and deleted with it (delete_tree).
+
+Backends:
+
+- 'local': a directory, typically a shared mount (NFS, CephFS, ...)
+- 's3': any S3-compatible API through boto3 (AWS, MinIO, Ceph RGW, or a
+  local stand-in such as moto_server for testing, via endpoint_url)
+"""
+
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+# Index record fields replicated with each artifact
+RECORD_FIELDS = ('id', 'kind', 'original_name', 'size', 'hash', 'params', 'owner', 'parent_id')
+
+_fetch_locks = {}  # artifact ID -> [lock, users]
+_fetch_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _fetch_lock(artifact_id):
+    """Serialize fetches of one artifact, so concurrent misses download it once"""
+    with _fetch_locks_guard:
+        entry = _fetch_locks.setdefault(artifact_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _fetch_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _fetch_locks[artifact_id]
+
+
+def record_metadata(record):
+    """The replicated part of an index record, plus the local filename"""
+    metadata = {field: record[field] for field in RECORD_FIELDS}
+    metadata['filename'] = os.path.basename(record['path'])
+    return metadata
+
+
+def _child_marker(parent_id, artifact_id):
+    return f'children/{parent_id}/{artifact_id}'
+
+
+class ArtifactStore:
+    """Common logic of the store backends; subclasses move the bytes"""
+
+    name = None
+
+    def put(self, record):
+        """Upload the file of an index record, then the record itself"""
+        self._put_file(record['id'], record['path'])
+        self._put_object(f"{record['id']}.json", json.dumps(record_metadata(record)).encode())
+        if record['parent_id']:
+            self._put_object(_child_marker(record['parent_id'], record['id']), b'')
+
+    def get_record(self, artifact_id):
+        """Return the stored metadata of an artifact, or None if it is not stored"""
+        data = self._get_record(artifact_id)
+        return json.loads(data) if data is not None else None
+
+    def fetch(self, artifact_id, path):
+        """
+        Download an artifact's file to path, unless another thread just did
+
+        The file is written next to path and renamed into place, so readers
+        never see a partial file.
+
+        Returns:
+            bool: False if the artifact is not in the store
+        """
+        with _fetch_lock(artifact_id):
+            if os.path.exists(path):
+                return True
+            partial = f'{path}.part'
+            try:
+                if not self._get_file(artifact_id, partial):
+                    return False
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+        return True
+
+    def delete(self, artifact_id):
+        """Remove an artifact (record first, so it disappears atomically)"""
+        self._delete(f'{artifact_id}.json')
+        self._delete(artifact_id)
+
+    def delete_tree(self, artifact_id):
+        """Remove an artifact and every artifact derived from it, from whichever node"""
+        prefix = _child_marker(artifact_id, '')
+        for key in self._list(prefix):
+            self.delete(key[len(prefix):])
+            self._delete(key)
+        self.delete(artifact_id)
+
+    def describe(self):
+        return {'backend': self.name}
+
+
+class LocalArtifactStore(ArtifactStore):
+    """Artifacts in a directory shared by all nodes"""
+
+    name = 'local'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _object_path(self, key):
+        return os.path.join(self.path, key)
+
+    def _write(self, key, write):
+        # Write under a temporary name and rename, so other nodes never see partial objects
+        target = self._object_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f'{target}.{os.getpid()}.{threading.get_ident()}.part'
+        try:
+            write(partial)
+            os.replace(partial, target)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _put_file(self, artifact_id, path):
+        self._write(artifact_id, lambda partial: shutil.copyfile(path, partial))
+
+    def _put_object(self, key, data):
+        def write(partial):
+            with open(partial, 'wb') as f:
+                f.write(data)
+        self._write(key, write)
+
+    def _get_record(self, artifact_id):
+        try:
+            with open(self._object_path(f'{artifact_id}.json'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _get_file(self, artifact_id, path):
+        try:
+            shutil.copyfile(self._object_path(artifact_id), path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _delete(self, key):
+        try:
+            os.remove(self._object_path(key))
+        except FileNotFoundError:
+            pass
+        if '/' in key:
+            # Drop the marker directory once empty
+            try:
+                os.rmdir(os.path.dirname(self._object_path(key)))
+            except OSError:
+                pass
+
+    def _list(self, prefix):
+        directory = self._object_path(prefix)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return [prefix + name for name in names if not name.endswith('.part')]
+
+    def describe(self):
+        return {'backend': self.name, 'path': self.path}
+
+
+class S3ArtifactStore(ArtifactStore):
+    """Artifacts in a bucket of an S3-compatible object store"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key_id=None, secret_access_key=None):
+        """
+        Args:
+            bucket: Bucket name (must exist)
+            prefix: Key prefix, e.g. 'auto-stretch/'
+            endpoint_url: API endpoint for non-AWS stores (MinIO, moto_server, ...)
+            region: Region name
+            access_key_id, secret_access_key: Credentials (default: the
+                usual boto3 chain of environment, config files and roles)
+        """
+        # Imported here: boto3 takes longer to import than the rest of the
+        # service, and only this backend needs it
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("The 's3' artifact store requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        # boto3 clients are thread-safe once created
+        self.client = boto3.session.Session().client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+
+    def _key(self, key):
+        return f'{self.prefix}{key}'
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def _put_file(self, artifact_id, path):
+        # Multipart and parallel for large files
+        self.client.upload_file(path, self.bucket, self._key(artifact_id))
+
+    def _put_object(self, key, data):
+        content_type = 'application/json' if key.endswith('.json') else 'application/octet-stream'
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, ContentType=content_type)
+
+    def _get_record(self, artifact_id):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(f'{artifact_id}.json'))
+        except self.client.exceptions.ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        return response['Body'].read()
+
+    def _get_file(self, artifact_id, path):
+        try:
+            self.client.download_file(self.bucket, self._key(artifact_id), path)
+        except self.client.exceptions.ClientError as e:
+            if self._missing(e):
+                return False
+            raise
+        return True
+
+    def _delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def _list(self, prefix):
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket,
+                                                                          Prefix=self._key(prefix)):
+            keys.extend(item['Key'][len(self.prefix):] for item in page.get('Contents', []))
+        return keys
+
+    def describe(self):
+        return {'backend': self.name, 'bucket': self.bucket, 'prefix': self.prefix,
+                'endpoint_url': self.endpoint_url}
+
+
+def create_store(settings):
+    """
+    Build the store described by the 'artifact_store' configuration entry
+
+    Returns:
+        ArtifactStore or None when no shared store is configured
+    """
+    if not settings:
+        return None
+    backend = settings.get('backend', 'local')
+    if backend == 'local':
+        return LocalArtifactStore(settings['path'])
+    if backend == 's3':
+        return S3ArtifactStore(settings['bucket'], prefix=settings.get('prefix', ''),
+                               endpoint_url=settings.get('endpoint_url'), region=settings.get('region'),
+                               access_key_id=settings.get('access_key_id'),
+                               secret_access_key=settings.get('secret_access_key'))
+    raise ValueError(f'Unknown artifact store backend: {backend}')
@@ -0,0 +1,222 @@
+"""
+Multi-file batches for Auto Stretch
+
+A batch is a set of uploaded TIFFs processed with one parameter set. Items
+are handed to a bounded thread pool (each job still goes through memory
+admission), and their state is tracked here so clients can poll progress.
+
+stream_zip() builds a ZIP archive of the finished outputs and previews on
+the fly: entries are written into an in-memory buffer that is drained after
+every chunk, so the archive is never materialized on disk and the download
+can start while later items are still processing.
+"""
+
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Item states
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+ERROR = 'error'
+
+# Chunk size used when copying files into the archive
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class Batch:
+    """Processing state of one multi-file upload"""
+
+    def __init__(self, batch_id, params, owner=None):
+        self.id = batch_id
+        self.params = params
+        self.owner = owner
+        self.created = time.time()
+        self.items = []
+        self._condition = threading.Condition()
+
+    def add_item(self, input_id, original_name):
+        """Register an uploaded file; returns its index within the batch"""
+        with self._condition:
+            self.items.append({
+                'input_file': input_id,
+                'original_filename': original_name,
+                'status': PENDING,
+                'error': None,
+                'result': None
+            })
+            return len(self.items) - 1
+
+    def update_item(self, index, status, result=None, error=None):
+        """Change an item's state and wake any waiting downloads"""
+        with self._condition:
+            item = self.items[index]
+            item['status'] = status
+            item['result'] = result
+            item['error'] = error
+            self._condition.notify_all()
+
+    @property
+    def finished(self):
+        with self._condition:
+            return all(item['status'] in (DONE, ERROR) for item in self.items)
+
+    def to_dict(self):
+        """Snapshot suitable for a JSON status response"""
+        with self._condition:
+            counts = {state: 0 for state in (PENDING, PROCESSING, DONE, ERROR)}
+            items = []
+            for item in self.items:
+                counts[item['status']] += 1
+                entry = {
+                    'input_file': item['input_file'],
+                    'original_filename': item['original_filename'],
+                    'status': item['status']
+                }
+                if item['error']:
+                    entry['error'] = item['error']
+                if item['result']:
+                    entry.update({key: value for key, value in item['result'].items()
+                                  if not key.endswith('_path')})
+                items.append(entry)
+            return {
+                'batch_id': self.id,
+                'total': len(items),
+                'counts': counts,
+                'finished': counts[DONE] + counts[ERROR] == len(items),
+                'items': items
+            }
+
+    def completed_items(self, timeout=None):
+        """
+        Yield items as they reach a final state, in completion order
+
+        Blocks between items until every item is done or failed.
+
+        Args:
+            timeout: Give up after this many seconds without progress
+        """
+        delivered = set()
+        while True:
+            with self._condition:
+                while True:
+                    ready = [index for index, item in enumerate(self.items)
+                             if index not in delivered and item['status'] in (DONE, ERROR)]
+                    if ready or len(delivered) == len(self.items):
+                        break
+                    if not self._condition.wait(timeout):
+                        return
+                items = [(index, dict(self.items[index])) for index in ready]
+
+            if not items:
+                return
+            for index, item in items:
+                delivered.add(index)
+                yield item
+
+
+class BatchRegistry:
+    """Holds recent batches and the worker pool that processes their items"""
+
+    def __init__(self, max_workers=2, max_batches=100):
+        """
+        Args:
+            max_workers: Items processed concurrently across all batches
+            max_batches: Number of batches remembered (oldest are forgotten)
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.max_batches = max_batches
+        self._batches = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def create(self, batch_id, params, owner=None):
+        batch = Batch(batch_id, params, owner)
+        with self._lock:
+            self._batches[batch_id] = batch
+            while len(self._batches) > self.max_batches:
+                self._batches.popitem(last=False)
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the shared bounded worker pool"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='BatchWorker')
+            executor = self._executor
+        return executor.submit(fn, *args)
+
+    def shutdown(self, timeout=None):
+        """
+        Wait for every submitted item to finish (used when the server drains)
+
+        Args:
+            timeout: Unused; the caller bounds the wait by joining this call
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+class _ChunkBuffer:
+    """Write-only, non-seekable sink that ZipFile writes into and we drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """
+    Generate a ZIP archive incrementally
+
+    Args:
+        entries: Iterable of (archive_name, file_path, compress) tuples; it may
+            block between entries (e.g. while waiting for processing)
+
+    Yields:
+        bytes: Consecutive pieces of the archive
+    """
+    sink = _ChunkBuffer()
+    # A non-seekable sink makes ZipFile use data descriptors, so each entry
+    # can be written without knowing its size or CRC up front
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for name, path, compress in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime(os.path.getmtime(path))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            with open(path, 'rb') as source, archive.open(info, 'w', force_zip64=True) as target:
+                while True:
+                    chunk = source.read(ZIP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    yield sink.drain()
@@ -0,0 +1,110 @@
+"""
+Channel layouts of input images for Auto Stretch
+
+Images arrive as mono planes (H x W), interleaved channels (H x W x C) or
+planar stacks (C x H x W, as written by many stacking tools). The pipeline
+stages work on H x W x C views:
+
+- Planar arrays are viewed with the channel axis moved last. Each channel
+  stays one contiguous plane, and nothing is transposed in memory.
+- Mono frames are viewed as H x W x 1. The stages process the single plane
+  (a third of the work and memory of replicating it to RGB) and the output
+  is grayscale.
+- With 2 or 4 channels the last one is alpha. It is split off before the
+  stages, converted to 8 bits once, and attached to the output unchanged.
+"""
+
+import numpy as np
+
+# Accepted values of the layout argument
+LAYOUTS = ('auto', 'HWC', 'CHW', 'HW')
+
+# Channel counts with a trailing alpha channel (gray + alpha, RGB + alpha)
+ALPHA_CHANNELS = (2, 4)
+
+
+def detect_layout(shape):
+    """
+    Guess the layout of an array shape
+
+    3-D arrays whose last axis has at most 4 entries are HWC, otherwise CHW
+    if the first one does.
+    """
+    if len(shape) == 2:
+        return 'HW'
+    if len(shape) == 3 and shape[2] <= 4:
+        return 'HWC'
+    if len(shape) == 3 and shape[0] <= 4:
+        return 'CHW'
+    raise ValueError(f"Cannot infer the layout of an array of shape {tuple(shape)}; pass layout=")
+
+
+def as_hwc(image, layout='auto'):
+    """
+    View an image array as height x width x channels, without copying
+
+    Args:
+        image: 2-D (mono) or 3-D array with 1 to 4 channels
+        layout: 'HWC', 'CHW', 'HW' or 'auto' (see detect_layout)
+
+    Returns:
+        numpy.ndarray: View with 1 (mono), 2 (mono + alpha), 3 (RGB) or 4
+            (RGBA) channels on the last axis
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}. Must be one of {LAYOUTS}")
+    if image.dtype == np.bool_:
+        image = image.view(np.uint8)
+    elif not np.issubdtype(image.dtype, np.integer) and not np.issubdtype(image.dtype, np.floating):
+        raise TypeError(f"Unsupported image dtype: {image.dtype}")
+
+    if layout == 'auto':
+        layout = detect_layout(image.shape)
+    if image.ndim != (2 if layout == 'HW' else 3):
+        raise ValueError(f"Array of shape {image.shape} does not match layout {layout}")
+
+    if layout == 'CHW':
+        image = np.moveaxis(image, 0, -1)
+    elif layout == 'HW':
+        image = image[:, :, np.newaxis]
+    if not 1 <= image.shape[2] <= 4:
+        raise ValueError(f"Unsupported channel count: {image.shape[2]}")
+    return image
+
+
+def color_channels(channels):
+    """Number of color channels (1 or 3) of an HWC image with that many channels"""
+    return 1 if channels <= 2 else 3
+
+
+def alpha_to_uint8(alpha):
+    """Convert an alpha plane to 8 bits over its dtype's full range (float: 0-1)"""
+    if alpha.dtype == np.uint8:
+        return np.array(alpha)
+    if np.issubdtype(alpha.dtype, np.integer):
+        scale = 255.0 / np.iinfo(alpha.dtype).max
+    else:
+        scale = 255.0
+    result = np.multiply(alpha, np.float32(scale), dtype=np.float32)
+    np.clip(result, 0, 255, out=result)
+    result += 0.5
+    return result.astype(np.uint8)
+
+
+def split_alpha(image):
+    """
+    Separate the color channels of an HWC view from its alpha channel
+
+    Returns:
+        tuple: (color view, 8-bit alpha plane or None)
+    """
+    if image.shape[2] not in ALPHA_CHANNELS:
+        return image, None
+    return image[:, :, :-1], alpha_to_uint8(image[:, :, -1])
+
+
+def output_shape(hwc_shape):
+    """Shape of the 8-bit output for an HWC input shape"""
+    height, width, channels = hwc_shape
+    output_channels = color_channels(channels) + (1 if channels in ALPHA_CHANNELS else 0)
+    return (height, width) if output_channels == 1 else (height, width, output_channels)
@@ -0,0 +1,81 @@
+"""
+Latest-wins coalescing of superseded requests for Auto Stretch
+
+Dragging a slider produces a burst of /reprocess requests for the same
+image, of which only the newest will ever be displayed. Every request takes
+a ticket for its key (client and input file); taking a new ticket
+supersedes all older ones for that key. Superseded work stops at the next
+checkpoint by raising Superseded:
+
+- while waiting for memory admission (it leaves the queue), and
+- between pipeline stages (stage outputs already computed stay cached, so
+  the newer request reuses them).
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class Superseded(Exception):
+    """Raised at a checkpoint when a newer request for the same key has arrived"""
+
+
+class Ticket:
+    """One request's claim on a key"""
+
+    def __init__(self, registry, key, generation):
+        self._registry = registry
+        self.key = key
+        self.generation = generation
+
+    @property
+    def superseded(self):
+        return self._registry.latest(self.key) != self.generation
+
+    def check(self):
+        """Checkpoint: raise Superseded if a newer request has taken over"""
+        if self.superseded:
+            self._registry.count_superseded()
+            raise Superseded('Superseded by a newer request')
+
+
+class LatestWins:
+    """Tracks the newest request per key"""
+
+    def __init__(self):
+        self._latest = {}  # key -> generation of the newest ticket
+        self._next_generation = 0
+        self._superseded = 0
+        self._lock = threading.Lock()
+
+    def latest(self, key):
+        with self._lock:
+            return self._latest.get(key)
+
+    def count_superseded(self):
+        with self._lock:
+            self._superseded += 1
+
+    @contextmanager
+    def track(self, key):
+        """
+        Take a ticket for key for the duration of the with-block
+
+        Yields:
+            Ticket: Call ticket.check() at checkpoints
+        """
+        with self._lock:
+            self._next_generation += 1
+            ticket = Ticket(self, key, self._next_generation)
+            self._latest[key] = ticket.generation
+        try:
+            yield ticket
+        finally:
+            with self._lock:
+                # Forget the key once its newest request is done
+                if self._latest.get(key) == ticket.generation:
+                    del self._latest[key]
+
+    def stats(self):
+        with self._lock:
+            return {'active_keys': len(self._latest), 'superseded': self._superseded}
@@ -0,0 +1,173 @@
+"""
+Compressed uploads for Auto Stretch
+
+Raw astro TIFFs often compress 2-4x, which matters on slow uplinks. Two
+ways of sending compressed data are accepted, and both are decompressed
+incrementally while the input file is written, so no compressed copy is
+ever stored:
+
+- A whole request body sent with 'Content-Encoding: gzip' or 'zstd'. The
+  DecodeRequestBody middleware swaps the WSGI input for a decompressing
+  stream before Flask parses the form; the upload limit (MAX_CONTENT_LENGTH)
+  then applies to the decompressed body.
+- Pre-compressed files ('.tif.gz', '.tif.zst', ...) in a multipart upload;
+  see decompressed_stream() and copy_limited().
+
+zstd needs the optional 'zstandard' package.
+"""
+
+import gzip
+import io
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.wsgi import LimitedStream
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Content-Encoding values and file suffixes, by codec
+CONTENT_ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+FILE_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+class UnsupportedEncoding(UnsupportedMediaType):
+    """The body or file uses a compression this server cannot decode"""
+
+
+class CorruptCompressedData(BadRequest):
+    """The compressed stream is truncated or invalid"""
+
+
+class DecompressedTooLarge(RequestEntityTooLarge):
+    """The decompressed data exceeds the upload limit"""
+
+
+# Errors an upload route turns into a JSON response with the error's status
+UPLOAD_ERRORS = (UnsupportedEncoding, CorruptCompressedData, DecompressedTooLarge)
+
+
+def split_compression_suffix(filename):
+    """
+    Split a compression suffix off a filename
+
+    Returns:
+        tuple: (filename without the suffix, codec or None)
+    """
+    for suffix, codec in FILE_SUFFIXES.items():
+        if filename.lower().endswith(suffix):
+            return filename[:-len(suffix)], codec
+    return filename, None
+
+
+class _DecompressedReader(io.RawIOBase):
+    """Readable stream of decompressed data, reporting bad input as CorruptCompressedData"""
+
+    def __init__(self, decoder, codec):
+        self._decoder = decoder
+        self._codec = codec
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            return self._decoder.readinto(buffer)
+        except (OSError, EOFError, zlib.error) as e:
+            raise CorruptCompressedData(f'Invalid {self._codec} data: {e}')
+        except Exception as e:
+            if ZSTD_AVAILABLE and isinstance(e, zstandard.ZstdError):
+                raise CorruptCompressedData(f'Invalid {self._codec} data: {e}')
+            raise
+
+
+def decompressed_stream(stream, codec):
+    """
+    Wrap a readable stream of compressed data
+
+    Args:
+        stream: Source with a read(size) method; read incrementally
+        codec: 'gzip' or 'zstd'
+
+    Raises:
+        UnsupportedEncoding: Unknown codec, or zstd without 'zstandard'
+    """
+    if codec == 'gzip':
+        # Handles concatenated gzip members like gunzip does
+        decoder = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif codec == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise UnsupportedEncoding('zstd uploads require the zstandard package on the server')
+        decoder = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    else:
+        raise UnsupportedEncoding(f'Unsupported compression: {codec}')
+    return io.BufferedReader(_DecompressedReader(decoder, codec))
+
+
+def copy_limited(source, destination, limit, chunk_size, on_chunk=None):
+    """
+    Copy a (decompressing) stream to a file, enforcing a size limit
+
+    Args:
+        on_chunk: Called with every chunk written (e.g. to hash it)
+
+    Returns:
+        int: Bytes written
+
+    Raises:
+        DecompressedTooLarge: More than limit bytes came out
+    """
+    written = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return written
+        written += len(chunk)
+        if limit is not None and written > limit:
+            raise DecompressedTooLarge(f'Decompressed upload exceeds the {limit // (1024 * 1024)} MB limit')
+        if on_chunk is not None:
+            on_chunk(chunk)
+        destination.write(chunk)
+
+
+class DecodeRequestBody:
+    """
+    WSGI middleware decoding request bodies sent with a Content-Encoding
+
+    The decoded body has no known length, so the environ is marked as
+    terminated by the stream; werkzeug then enforces MAX_CONTENT_LENGTH on
+    the decompressed bytes as they are read.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            codec = CONTENT_ENCODINGS.get(encoding)
+            try:
+                if codec is None:
+                    raise UnsupportedEncoding(f'Unsupported Content-Encoding: {encoding}')
+                self._decode(environ, codec)
+            except UnsupportedEncoding as e:
+                return e(environ, start_response)
+        return self.app(environ, start_response)
+
+    @staticmethod
+    def _decode(environ, codec):
+        stream = environ['wsgi.input']
+        length = environ.get('CONTENT_LENGTH')
+        if length:
+            # Never read past the compressed body (keep-alive connections)
+            stream = LimitedStream(stream, int(length))
+        elif 'wsgi.input_terminated' not in environ:
+            # Neither a length nor a terminated stream: there is no safe way to read it
+            raise UnsupportedEncoding('Compressed request bodies need a Content-Length or chunked encoding')
+        environ['wsgi.input'] = decompressed_stream(stream, codec)
+        environ['wsgi.input_terminated'] = True
+        environ.pop('CONTENT_LENGTH', None)
+        environ.pop('HTTP_CONTENT_ENCODING', None)
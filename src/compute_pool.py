@@ -0,0 +1,120 @@
+"""
+Compute worker processes for Auto Stretch
+
+Runs the stretch pipeline in separate processes, so CPU-heavy stages do not
+compete with request handling for the GIL. Images cross the process
+boundary only as shared-memory handles (see shared_arrays):
+
+- A decoded input that lives in shared memory is passed by handle; the
+  worker maps it. Memory-mapped inputs are not passed at all, since the
+  worker maps the same file.
+- The worker writes the 8-bit result into a new segment and returns its
+  handle; the web process adopts the segment and releases it once saved.
+
+Each worker has its own stage cache. Jobs for the same input always go to
+the same worker, so reprocessing an image with new parameters still reuses
+its cached upstream stages.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import shared_arrays
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(cache_bytes, decode_workers):
+    """Configure a worker's image stack once, when the process starts"""
+    import pipeline
+    import tiff_io
+
+    pipeline.stage_cache.resize(cache_bytes)
+    tiff_io.configure(decode_workers)
+
+
+def _run_pipeline(input_path, params, use_cache, stats, image_handle, owner_pid):
+    """Worker side of ComputePool.run_pipeline; returns the result's handle"""
+    import numpy as np
+    import pipeline
+
+    image = shared_arrays.attach(image_handle) if image_handle is not None else None
+    result = pipeline.run_pipeline(input_path, params, use_cache=use_cache, stats=stats, image=image)
+    del image
+
+    handle, shared = shared_arrays.create(result.shape, result.dtype, owner_pid=owner_pid)
+    np.copyto(shared, result)
+    return handle
+
+
+class ComputePool:
+    """Single-process executors, one per worker, with input affinity"""
+
+    def __init__(self, store, workers, cache_bytes=0, decode_workers=0):
+        """
+        Args:
+            store: SharedArrayStore of the web process (owns all segments)
+            workers: Number of worker processes
+            cache_bytes: Stage cache budget of each worker
+            decode_workers: Decode threads per worker (0 = auto)
+        """
+        self.store = store
+        self.workers = max(1, int(workers))
+        self.cache_bytes = cache_bytes
+        self.decode_workers = decode_workers
+        # spawn: forking a threaded web server is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._executors = [None] * self.workers
+        self._lock = threading.Lock()
+
+    def _executor(self, index):
+        with self._lock:
+            if self._executors[index] is None:
+                self._executors[index] = ProcessPoolExecutor(
+                    max_workers=1, mp_context=self._context, initializer=_init_worker,
+                    initargs=(self.cache_bytes, self.decode_workers))
+            return self._executors[index]
+
+    def _replace_broken(self, index, executor):
+        with self._lock:
+            if self._executors[index] is executor:
+                self._executors[index] = None
+        executor.shutdown(wait=False)
+        shared_arrays.sweep_orphans(keep=self.store.owned_names())
+
+    def run_pipeline(self, input_path, params, use_cache=True, stats=None, image=None):
+        """
+        Run pipeline.run_pipeline() in a worker process
+
+        Args:
+            image: Decoded input; passed by handle if it was allocated in the
+                store, otherwise the worker loads input_path itself
+
+        Returns:
+            SharedArray: Handle of the result, owned by the store; release it
+                once the result has been consumed
+        """
+        index = zlib.crc32(os.path.abspath(input_path).encode()) % self.workers
+        executor = self._executor(index)
+        image_handle = self.store.handle_for(image) if image is not None else None
+        try:
+            handle = executor.submit(_run_pipeline, input_path, params, use_cache, stats,
+                                     image_handle, os.getpid()).result()
+        except BrokenProcessPool:
+            logger.error(f"Compute worker {index} died; restarting it")
+            self._replace_broken(index, executor)
+            raise RuntimeError('Compute worker crashed while processing the image')
+        self.store.adopt(handle)
+        return handle
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executors, self._executors = self._executors, [None] * self.workers
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=wait)
@@ -6,11 +6,18 @@ and Windows Registry as fallback/metadata storage.
 
 This eliminates the configuration drift issues from the old implementation
 where config was scattered across .env files, PowerShell variables, NSIS vars, etc.
+
+Loaded configuration is cached in-process and revalidated against the
+file's mtime, so get()/set() no longer re-parse config.json on every call.
+A background watcher can deliver change notifications to subscribers,
+letting performance tunables be reloaded without restarting the service.
 """
 
+import copy
 import json
 import os
 import sys
+import threading
 
 # Windows registry support (graceful degradation if not available)
 try:
@@ -18,14 +25,19 @@ try:
     REGISTRY_AVAILABLE = True
 except ImportError:
     REGISTRY_AVAILABLE = False
-    print("Warning: winreg not available. Registry operations will be skipped.")
+    # winreg only exists on Windows; its absence is expected everywhere else
+    if sys.platform == 'win32':
+        print("Warning: winreg not available. Registry operations will be skipped.")
 
 
 class ConfigManager:
     """Unified configuration management for Auto Stretch"""
 
     # Default paths (adjusted based on installation location)
-    DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+    # AUTO_STRETCH_CONFIG overrides the location (used by scripts/load_test.py)
+    DEFAULT_CONFIG_PATH = os.environ.get(
+        'AUTO_STRETCH_CONFIG',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"))
     REGISTRY_KEY = r"SOFTWARE\AutoStretch"
     REGISTRY_ROOT = winreg.HKEY_LOCAL_MACHINE if REGISTRY_AVAILABLE else None
 
@@ -37,6 +49,34 @@ class ConfigManager:
         'max_upload_mb': 500,
         'log_level': 'INFO',
         'temp_dir': None,  # Will use system temp if not specified
+        'index_db': None,  # Artifact index database (default: <temp_dir>/auto-stretch-index.db)
+        'stage_cache_mb': 1024,  # Memory budget for cached pipeline intermediates
+        'preview_cache_mb': 64,  # Memory budget for hot preview PNGs
+        'decode_workers': 0,  # Threads for compressed TIFF decoding (0 = auto)
+        'memory_budget_mb': 0,  # Memory budget for concurrent processing (0 = half of RAM)
+        'admission_queue_size': 8,  # Jobs allowed to wait for memory before returning 503
+        'admission_timeout_s': 60,  # Seconds a job may wait for memory before returning 503
+        'preview_max_width': 1200,  # Width of generated preview PNGs
+        'output_compression': None,  # TIFF codec for outputs (e.g. 'tiff_deflate'; None = raw)
+        'batch_workers': 2,  # Files of a multi-file upload processed concurrently
+        'max_batch_files': 50,  # Maximum number of files per multi-file upload
+        'compute_workers': 0,  # Processes running the stretch via shared memory (0 = request thread)
+        'dedupe_store_mb': 10240,  # Uploaded content kept for /preflight after cleanup (0 disables)
+        'watch_folders': [],  # Folders the watch daemon ingests: {"path", "params", "output_dir", "recursive"}
+        'watch_workers': 2,  # Files the watch daemon processes concurrently
+        'watch_poll_s': 10,  # Seconds between watch folder scans
+        'watch_settle_s': 5,  # Seconds a file must stay unchanged before it is processed
+        'watch_ledger': None,  # Processed-file ledger (default: <temp_dir>/auto-stretch-watch.db)
+        'artifact_store': None,  # Store shared by cluster nodes: {"backend": "local", "path"} or {"backend": "s3", "bucket", ...}
+        'node_url': None,  # This node's base URL as listed in cluster_nodes
+        'cluster_nodes': [],  # Base URLs of all nodes; requests about an input go to the node owning it
+        'cluster_secret': None,  # Shared by all nodes; authenticates forwarded requests (required for cluster_nodes)
+        'affinity_timeout_s': 600,  # Seconds to wait for the owner node to answer a forwarded request
+        'warm_up': True,  # Load the image stack and prime the pipeline before serving
+        'config_poll_s': 2,  # Seconds between config file change checks (0 disables hot reload)
+        'drain_timeout_s': 300,  # Seconds in-flight work may take to finish on stop or reload
+        'admin_token': None,  # Token required by /admin endpoints (None disables them)
+        'profiles_dir': None,  # Profiling captures (default: <temp_dir>/auto-stretch-profiles)
         'paths': {
             'base': None,  # Will be auto-detected
             'app': None,
@@ -45,11 +85,36 @@ class ConfigManager:
         }
     }
 
+    # In-process cache: config path -> (file signature, parsed config)
+    _cache = {}
+    # Config path -> signature of a file that failed to parse or validate
+    _rejected = {}
+    _cache_lock = threading.RLock()
+
+    # Change notification callbacks and the background file watcher
+    _subscribers = []
+    _watcher = None
+    _watcher_stop = None
+
+    @staticmethod
+    def _file_signature(config_path):
+        """Return (mtime_ns, size) of the config file, or None if it is missing"""
+        try:
+            st = os.stat(config_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
     @classmethod
     def load_config(cls, config_path=None):
         """
         Load configuration from JSON file with registry fallback
 
+        The parsed file is cached and only re-read when its mtime or size
+        changes. Once a config has loaded, a changed file that fails to parse
+        or validate (e.g. half-written) is logged and the last good config is
+        kept; that file is not re-read until it changes again.
+
         Args:
             config_path: Path to config file (default: DEFAULT_CONFIG_PATH)
 
@@ -57,17 +122,43 @@ class ConfigManager:
             dict: Configuration dictionary
         """
         config_path = config_path or cls.DEFAULT_CONFIG_PATH
-        config = cls.DEFAULT_CONFIG.copy()
+        signature = cls._file_signature(config_path)
+
+        with cls._cache_lock:
+            cached = cls._cache.get(config_path)
+            if signature is not None and cached is not None and cached[0] == signature:
+                return copy.deepcopy(cached[1])
+            if signature is not None and cached is not None and cls._rejected.get(config_path) == signature:
+                return copy.deepcopy(cached[1])
+
+        config = copy.deepcopy(cls.DEFAULT_CONFIG)
 
         # Try to load from JSON file
-        if os.path.exists(config_path):
+        if signature is not None:
             try:
                 with open(config_path, 'r') as f:
                     file_config = json.load(f)
-                    config.update(file_config)
-                    return config
+                if not isinstance(file_config, dict):
+                    raise ValueError("not a JSON object")
+                config.update(file_config)
+
+                if cached is not None:
+                    is_valid, errors = cls.validate_config(config)
+                    if not is_valid:
+                        raise ValueError("; ".join(errors))
+
+                with cls._cache_lock:
+                    cls._cache[config_path] = (signature, copy.deepcopy(config))
+                    cls._rejected.pop(config_path, None)
+                return config
             except Exception as e:
                 print(f"Warning: Failed to load config from {config_path}: {e}")
+                with cls._cache_lock:
+                    cls._rejected[config_path] = signature
+                if cached is not None:
+                    # Keep the last good config until the file changes again
+                    print("Keeping the last good configuration")
+                    return copy.deepcopy(cached[1])
 
         # Fallback to registry if file doesn't exist or failed to load
         if REGISTRY_AVAILABLE:
@@ -102,10 +193,20 @@ class ConfigManager:
             # Ensure directory exists
             os.makedirs(os.path.dirname(config_path), exist_ok=True)
 
-            with open(config_path, 'w') as f:
-                json.dump(config, f, indent=2)
+            with cls._cache_lock:
+                previous = cls._cache.get(config_path, (None, None))[1]
+
+                with open(config_path, 'w') as f:
+                    json.dump(config, f, indent=2)
+
+                merged = copy.deepcopy(cls.DEFAULT_CONFIG)
+                merged.update(config)
+                cls._cache[config_path] = (cls._file_signature(config_path), copy.deepcopy(merged))
             print(f"Configuration saved to {config_path}")
 
+            if config_path == cls.DEFAULT_CONFIG_PATH and previous is not None:
+                cls._notify(previous, merged)
+
             # Also save key values to registry
             if REGISTRY_AVAILABLE:
                 cls._save_to_registry(config)
@@ -171,6 +272,99 @@ class ConfigManager:
 
         return cls.save_config(config, config_path)
 
+    @classmethod
+    def subscribe(cls, callback, keys=None):
+        """
+        Register a callback for configuration changes
+
+        Args:
+            callback: Called as callback(config, changed_keys) after a change
+            keys: Only notify when one of these top-level keys changed (default: any)
+        """
+        cls._subscribers.append((callback, set(keys) if keys else None))
+
+    @classmethod
+    def _notify(cls, old_config, new_config):
+        """Deliver a change notification to interested subscribers"""
+        changed = {key for key in set(old_config) | set(new_config)
+                   if old_config.get(key) != new_config.get(key)}
+        if not changed:
+            return
+
+        for callback, keys in list(cls._subscribers):
+            if keys is not None and not (keys & changed):
+                continue
+            try:
+                callback(copy.deepcopy(new_config), changed)
+            except Exception as e:
+                print(f"Warning: Config change handler {callback!r} failed: {e}")
+
+    @classmethod
+    def check_for_changes(cls):
+        """
+        Reload the default config file if it changed and notify subscribers
+
+        Subscribers are only notified once the new file has parsed and
+        validated; a bad file leaves the last good config in place (see
+        load_config).
+
+        Returns:
+            bool: True if a change was applied
+        """
+        config_path = cls.DEFAULT_CONFIG_PATH
+        signature = cls._file_signature(config_path)
+        if signature is None:
+            return False
+
+        with cls._cache_lock:
+            cached = cls._cache.get(config_path)
+            if cached is not None and cached[0] == signature:
+                return False
+            if cls._rejected.get(config_path) == signature:
+                return False
+
+        old_config = cached[1] if cached is not None else copy.deepcopy(cls.DEFAULT_CONFIG)
+        new_config = cls.load_config(config_path)
+        with cls._cache_lock:
+            loaded = cls._cache.get(config_path)
+        if loaded is None or loaded[0] != signature:
+            # Rejected, or replaced again while it was being read
+            return False
+
+        cls._notify(old_config, new_config)
+        return True
+
+    @classmethod
+    def start_watcher(cls, interval=2.0):
+        """
+        Poll the default config file's mtime in a background thread
+
+        Args:
+            interval: Seconds between checks
+        """
+        if cls._watcher is not None and cls._watcher.is_alive():
+            return
+
+        cls._watcher_stop = threading.Event()
+
+        def watch(stop_event):
+            while not stop_event.wait(interval):
+                try:
+                    cls.check_for_changes()
+                except Exception as e:
+                    print(f"Warning: Config watcher error: {e}")
+
+        cls._watcher = threading.Thread(target=watch, args=(cls._watcher_stop,),
+                                        daemon=True, name="ConfigWatcher")
+        cls._watcher.start()
+
+    @classmethod
+    def stop_watcher(cls):
+        """Stop the background config watcher"""
+        if cls._watcher_stop is not None:
+            cls._watcher_stop.set()
+        cls._watcher = None
+
     @classmethod
     def _load_from_registry(cls):
         """Load configuration from Windows Registry"""
@@ -262,6 +456,107 @@ class ConfigManager:
             if not isinstance(max_upload, (int, float)) or max_upload <= 0:
                 errors.append(f"Invalid max_upload_mb: {max_upload}. Must be positive number")
 
+        # Validate stage_cache_mb
+        if 'stage_cache_mb' in config:
+            stage_cache_mb = config['stage_cache_mb']
+            if not isinstance(stage_cache_mb, (int, float)) or stage_cache_mb < 0:
+                errors.append(f"Invalid stage_cache_mb: {stage_cache_mb}. Must be zero or a positive number")
+
+        # Validate preview_cache_mb
+        if 'preview_cache_mb' in config:
+            preview_cache_mb = config['preview_cache_mb']
+            if not isinstance(preview_cache_mb, (int, float)) or preview_cache_mb < 0:
+                errors.append(f"Invalid preview_cache_mb: {preview_cache_mb}. Must be zero or a positive number")
+
+        # Validate decode_workers
+        if 'decode_workers' in config:
+            decode_workers = config['decode_workers']
+            if not isinstance(decode_workers, int) or decode_workers < 0:
+                errors.append(f"Invalid decode_workers: {decode_workers}. Must be zero or a positive integer")
+
+        # Validate admission control limits
+        for key in ('memory_budget_mb', 'admission_queue_size', 'admission_timeout_s', 'config_poll_s',
+                    'drain_timeout_s', 'watch_poll_s', 'watch_settle_s', 'affinity_timeout_s',
+                    'dedupe_store_mb'):
+            if key in config:
+                value = config[key]
+                if not isinstance(value, (int, float)) or value < 0:
+                    errors.append(f"Invalid {key}: {value}. Must be zero or a positive number")
+
+        # Validate batch limits
+        for key in ('batch_workers', 'max_batch_files', 'watch_workers'):
+            if key in config:
+                value = config[key]
+                if not isinstance(value, int) or value < 1:
+                    errors.append(f"Invalid {key}: {value}. Must be a positive integer")
+
+        # Validate compute_workers
+        if 'compute_workers' in config:
+            compute_workers = config['compute_workers']
+            if not isinstance(compute_workers, int) or compute_workers < 0:
+                errors.append(f"Invalid compute_workers: {compute_workers}. Must be zero or a positive integer")
+
+        # Validate watch_folders
+        if 'watch_folders' in config:
+            watch_folders = config['watch_folders']
+            if not isinstance(watch_folders, list):
+                errors.append(f"Invalid watch_folders: {watch_folders}. Must be a list")
+            else:
+                for entry in watch_folders:
+                    if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+                        errors.append(f"Invalid watch folder: {entry}. Must be an object with a 'path'")
+                    elif not isinstance(entry.get('params', {}), dict):
+                        errors.append(f"Invalid params for watch folder {entry['path']}. Must be an object")
+
+        # Validate artifact_store
+        artifact_store = config.get('artifact_store')
+        if artifact_store is not None:
+            if not isinstance(artifact_store, dict) or artifact_store.get('backend', 'local') not in ('local', 's3'):
+                errors.append(f"Invalid artifact_store: {artifact_store}. Must be an object with backend 'local' or 's3'")
+            elif artifact_store.get('backend', 'local') == 'local' and not isinstance(artifact_store.get('path'), str):
+                errors.append("Invalid artifact_store: the 'local' backend needs a 'path'")
+            elif artifact_store.get('backend') == 's3' and not isinstance(artifact_store.get('bucket'), str):
+                errors.append("Invalid artifact_store: the 's3' backend needs a 'bucket'")
+
+        # Validate cluster membership
+        if config.get('cluster_nodes'):
+            cluster_nodes = config['cluster_nodes']
+            if not isinstance(cluster_nodes, list) or not all(isinstance(node, str) for node in cluster_nodes):
+                errors.append(f"Invalid cluster_nodes: {cluster_nodes}. Must be a list of base URLs")
+            elif config.get('node_url') not in cluster_nodes:
+                errors.append(f"Invalid node_url: {config.get('node_url')}. Must be one of cluster_nodes")
+            elif not config.get('cluster_secret'):
+                errors.append("Missing cluster_secret: required with cluster_nodes")
+
+        # Validate cluster_secret
+        if config.get('cluster_secret') is not None:
+            cluster_secret = config['cluster_secret']
+            if not isinstance(cluster_secret, str) or len(cluster_secret) < 16:
+                errors.append("Invalid cluster_secret: must be a string of at least 16 characters")
+
+        # Validate warm_up
+        if 'warm_up' in config and not isinstance(config['warm_up'], bool):
+            errors.append(f"Invalid warm_up: {config['warm_up']}. Must be true or false")
+
+        # Validate preview_max_width
+        if 'preview_max_width' in config:
+            preview_max_width = config['preview_max_width']
+            if not isinstance(preview_max_width, int) or preview_max_width < 1:
+                errors.append(f"Invalid preview_max_width: {preview_max_width}. Must be a positive integer")
+
+        # Validate output_compression
+        if config.get('output_compression') is not None:
+            output_compression = config['output_compression']
+            valid_codecs = ['raw', 'tiff_deflate', 'tiff_adobe_deflate', 'tiff_lzw', 'packbits', 'jpeg']
+            if output_compression not in valid_codecs:
+                errors.append(f"Invalid output_compression: {output_compression}. Must be one of {valid_codecs}")
+
+        # Validate admin_token
+        if config.get('admin_token') is not None:
+            admin_token = config['admin_token']
+            if not isinstance(admin_token, str) or len(admin_token) < 16:
+                errors.append("Invalid admin_token: must be a string of at least 16 characters")
+
         # Validate log_level
         if 'log_level' in config:
             log_level = config['log_level']
@@ -285,7 +580,7 @@ class ConfigManager:
         config_path = config_path or cls.DEFAULT_CONFIG_PATH
 
         # Auto-detect base path
-        config = cls.DEFAULT_CONFIG.copy()
+        config = copy.deepcopy(cls.DEFAULT_CONFIG)
         base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         config['paths']['base'] = base_path
         config['paths']['app'] = os.path.join(base_path, 'app')
@@ -0,0 +1,199 @@
+"""
+Image statistics service for Auto Stretch
+
+Computes per-channel statistics (min, max, mean, median, MAD, the
+autostretch percentiles and a display histogram) once at upload time. The
+results are cached in memory and persisted next to the input file, so every
+later reprocess reuses them instead of rescanning the full array.
+
+Integer images (8/16-bit, the common case for astro TIFFs) are reduced to an
+exact value histogram with a single np.bincount pass per channel; every
+statistic is then derived from the histogram. Float images fall back to
+direct numpy reductions.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from channel_layout import ALPHA_CHANNELS, as_hwc
+from memory_cache import MemoryLRU
+
+
+# Percentiles used by the built-in autostretch stage
+AUTOSTRETCH_PERCENTILES = (0.001, 99.999)
+
+# Number of bins in the histograms returned to the UI
+DISPLAY_BINS = 256
+
+STATS_SUFFIX = '.stats.json'
+
+# Stats are small, so a modest budget holds thousands of entries
+_stats_cache = MemoryLRU(16 * 1024 * 1024)
+
+
+def _channels(img_array):
+    """Return the image as a list of 2D channel views (planar arrays included)"""
+    img_array = as_hwc(img_array)
+    return [img_array[:,:,i] for i in range(img_array.shape[2])]
+
+
+def _percentile_from_counts(values, cumulative, q):
+    """
+    Exact numpy-compatible ('linear' method) percentile from a value histogram
+
+    Args:
+        values: Sorted distinct values
+        cumulative: Cumulative counts for values
+        q: Percentile in the range 0-100
+    """
+    n = int(cumulative[-1])
+    position = q / 100.0 * (n - 1)
+    lo = int(np.floor(position))
+    frac = position - lo
+    v_lo = float(values[np.searchsorted(cumulative, lo, side='right')])
+    if frac == 0:
+        return v_lo
+    v_hi = float(values[np.searchsorted(cumulative, lo + 1, side='right')])
+    return v_lo + (v_hi - v_lo) * frac
+
+
+def _integer_channel_stats(channel):
+    """Derive all channel statistics from a single bincount pass"""
+    offset = int(np.iinfo(channel.dtype).min)
+    flat = channel.ravel()
+    if offset:
+        flat = flat.astype(np.int32) - offset
+    counts = np.bincount(flat)
+
+    present = np.nonzero(counts)[0]
+    values = present + offset
+    counts = counts[present]
+    cumulative = np.cumsum(counts)
+    total = int(cumulative[-1])
+
+    median = _percentile_from_counts(values, cumulative, 50)
+
+    # MAD is the median of |x - median|, computed on the same histogram
+    deviations = np.abs(values - median)
+    order = np.argsort(deviations, kind='stable')
+    mad = _percentile_from_counts(deviations[order], np.cumsum(counts[order]), 50)
+
+    histogram, _ = np.histogram(values, bins=DISPLAY_BINS,
+                                range=(float(values[0]), float(values[-1])),
+                                weights=counts)
+
+    return {
+        'min': float(values[0]),
+        'max': float(values[-1]),
+        'mean': float(np.dot(values.astype(np.float64), counts) / total),
+        'median': median,
+        'mad': mad,
+        'percentiles': {str(q): _percentile_from_counts(values, cumulative, q)
+                        for q in AUTOSTRETCH_PERCENTILES},
+        'histogram': histogram.astype(np.int64).tolist(),
+        'histogram_range': [float(values[0]), float(values[-1])]
+    }
+
+
+def _float_channel_stats(channel):
+    """Channel statistics for floating point data"""
+    flat = channel.ravel()
+    ch_min = float(flat.min())
+    ch_max = float(flat.max())
+
+    quantiles = np.percentile(flat, (50,) + AUTOSTRETCH_PERCENTILES)
+    median = float(quantiles[0])
+    mad = float(np.median(np.abs(flat - median)))
+
+    histogram_range = (ch_min, ch_max)
+    # A near-constant channel cannot be split into finite bins at its precision
+    if ch_max - ch_min < np.spacing(abs(flat.dtype.type(ch_max))) * DISPLAY_BINS:
+        histogram_range = (ch_min - 0.5, ch_max + 0.5)
+    histogram, _ = np.histogram(flat, bins=DISPLAY_BINS, range=histogram_range)
+
+    return {
+        'min': ch_min,
+        'max': ch_max,
+        'mean': float(flat.mean(dtype=np.float64)),
+        'median': median,
+        'mad': mad,
+        'percentiles': {str(q): float(v)
+                        for q, v in zip(AUTOSTRETCH_PERCENTILES, quantiles[1:])},
+        'histogram': histogram.astype(np.int64).tolist(),
+        'histogram_range': list(histogram_range)
+    }
+
+
+def compute_image_stats(img_array):
+    """
+    Compute per-channel statistics for an image in its native dtype
+
+    Args:
+        img_array: Image array (H x W, H x W x C or planar C x H x W)
+
+    Returns:
+        dict: Image-level and per-channel statistics; 'shape' is the H x W x C
+            shape, and the image-level max and mean leave out alpha
+    """
+    exact = (np.issubdtype(img_array.dtype, np.integer)
+             and img_array.dtype.itemsize <= 2)
+    channel_stats = _integer_channel_stats if exact else _float_channel_stats
+    planes = _channels(img_array)
+    channels = [channel_stats(channel) for channel in planes]
+    color = channels[:-1] if len(channels) in ALPHA_CHANNELS else channels
+
+    return {
+        'shape': list(planes[0].shape) + [len(planes)],
+        'dtype': str(img_array.dtype),
+        'exact': exact,
+        'max': max(ch['max'] for ch in color),
+        'mean': float(np.mean([ch['mean'] for ch in color])),
+        'channels': channels
+    }
+
+
+def stats_path(input_path):
+    """Path of the persisted statistics for an input file"""
+    return input_path + STATS_SUFFIX
+
+
+def save_image_stats(input_path, stats):
+    """Cache statistics in memory and persist them next to the input file"""
+    _stats_cache.put(os.path.abspath(input_path), stats, len(json.dumps(stats)))
+    try:
+        with open(stats_path(input_path), 'w') as f:
+            json.dump(stats, f)
+    except OSError as e:
+        print(f"Warning: Could not persist image stats for {input_path}: {e}")
+
+
+def load_image_stats(input_path):
+    """
+    Return cached statistics for an input file
+
+    Returns:
+        dict or None: Statistics, or None if they were never computed
+    """
+    key = os.path.abspath(input_path)
+    stats = _stats_cache.get(key)
+    if stats is not None:
+        return stats
+
+    try:
+        with open(stats_path(input_path), 'r') as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    _stats_cache.put(key, stats, len(json.dumps(stats)))
+    return stats
+
+
+def discard_image_stats(input_path):
+    """Forget statistics for an input file that is being removed"""
+    _stats_cache.pop(os.path.abspath(input_path))
+    path = stats_path(input_path)
+    if os.path.exists(path):
+        os.remove(path)
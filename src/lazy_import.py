@@ -0,0 +1,49 @@
+"""
+Deferred module imports for Auto Stretch
+
+numpy, Pillow and tifffile dominate the service's import time, yet many
+requests (the index page, status, artifact downloads) never touch them.
+LazyModule stands in for a module and imports it on first attribute access,
+so the server can bind its port before the image stack is loaded.
+"""
+
+import importlib
+import threading
+
+
+class LazyModule:
+    """Proxy that imports the named module the first time it is used"""
+
+    def __init__(self, name, on_load=None):
+        """
+        Args:
+            name: Dotted module name
+            on_load: Optional callback(module) run once right after import
+        """
+        self._name = name
+        self._module = None
+        self._on_load = on_load
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """True once the real module has been imported"""
+        return self._module is not None
+
+    def load(self):
+        """Import the module now (idempotent) and return it"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load is not None:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f'<LazyModule {self._name!r} ({state})>'
@@ -0,0 +1,106 @@
+"""
+Memory-bounded LRU cache for Auto Stretch
+
+Holds large in-process objects (intermediate image arrays, encoded previews)
+and evicts the least recently used entries once the configured byte budget
+is exceeded. All operations are thread-safe because Flask serves requests
+from multiple threads.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class MemoryLRU:
+    """Thread-safe LRU cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes: Byte budget for all cached values (0 disables caching)
+        """
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key and mark it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value, size):
+        """
+        Store a value, evicting older entries to stay within the budget
+
+        Args:
+            key: Hashable cache key
+            value: Object to cache
+            size: Size of the value in bytes (used for the budget)
+
+        Returns:
+            bool: True if the value was cached, False if it exceeds the budget
+        """
+        size = int(size)
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._current_bytes -= old[1]
+
+            self._entries[key] = (value, size)
+            self._current_bytes += size
+
+            while self._current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._current_bytes -= evicted_size
+
+        return True
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._current_bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        """Drop all cached values"""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def resize(self, max_bytes):
+        """Change the byte budget, evicting entries if it shrank"""
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            while self._current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._current_bytes -= evicted_size
+
+    def stats(self):
+        """Return a snapshot of cache usage for monitoring"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,575 @@
+"""
+Stage-graph stretch pipeline for Auto Stretch
+
+The stretch runs as a fixed chain of stages:
+
+    background -> normalize -> autostretch -> color -> tone -> saturation
+
+Stages work on H x W x C views with one (mono) or three (RGB) color
+channels; planar inputs are viewed, not transposed, and alpha bypasses the
+stages (see channel_layout).
+
+Each stage's output is cached under a key derived from the upstream stage's
+key plus only the parameters that stage depends on. Changing a late-stage
+parameter (e.g. saturation_boost) therefore reuses every cached upstream
+result and recomputes only the stages downstream of the change.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+import background
+from channel_layout import LAYOUTS, as_hwc, output_shape, split_alpha
+from image_stats import compute_image_stats
+from memory_cache import MemoryLRU
+from tiff_io import read_tiff
+
+
+# Parameters each stage depends on (in addition to its upstream key)
+STAGE_PARAMS = (
+    ('background', ('background_extraction', 'background_model',
+                    'background_grid', 'background_degree')),
+    ('normalize', ()),
+    ('autostretch', ('autostretch_mode', 'autostretch_target_bg', 'autostretch_shadows_clip')),
+    ('color', ('gamma_red', 'gamma_green', 'gamma_blue',
+               'green_multiplier', 'blue_multiplier')),
+    ('tone', ('dark_threshold', 'dark_multiplier', 'mid_threshold',
+              'mid_boost', 'bright_multiplier')),
+    ('saturation', ('saturation_boost',)),
+)
+
+# Default processing parameters (match the web UI's initial slider values)
+DEFAULT_PARAMS = {
+    'gamma_red': 0.7,
+    'gamma_green': 0.8,
+    'gamma_blue': 0.75,
+    'green_multiplier': 0.93,
+    'blue_multiplier': 1.08,
+    'dark_threshold': 0.15,
+    'dark_multiplier': 0.3,
+    'mid_threshold': 0.4,
+    'mid_boost': 1.5,
+    'bright_multiplier': 1.1,
+    'saturation_boost': 1.0,
+    'autostretch_mode': 'percentile',
+    'autostretch_target_bg': 0.25,
+    'autostretch_shadows_clip': -2.8,
+    'background_extraction': False,
+    'background_model': 'polynomial',
+    'background_grid': 16,
+    'background_degree': 2
+}
+
+AUTOSTRETCH_MODES = ('percentile', 'mtf')
+
+# Number of pixels sampled (with a stride) for MTF autostretch statistics
+MTF_SAMPLE_PIXELS = 250000
+
+# Input levels of the MTF lookup table (16-bit precision)
+MTF_LUT_SIZE = 65536
+
+# Scale factor turning a MAD into a standard deviation estimate
+MAD_TO_SIGMA = 1.4826
+
+DEFAULT_CACHE_MB = 1024
+
+# Shared cache of stage outputs, keyed by stage key
+stage_cache = MemoryLRU(DEFAULT_CACHE_MB * 1024 * 1024)
+
+
+def input_cache_key(input_path):
+    """
+    Build the root cache key for an input file
+
+    The key changes whenever the file is replaced or modified, so stale
+    intermediates are never reused. It identifies the file rather than the
+    path, so hard links to the same content (deduplicated uploads) share
+    their cached stages.
+    """
+    st = os.stat(input_path)
+    return f'{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}:{st.st_size}'
+
+
+def stage_key(upstream_key, stage_name, params, param_names):
+    """Derive a stage's cache key from its upstream key and its own parameters"""
+    own_params = {name: params[name] for name in param_names}
+    payload = json.dumps([upstream_key, stage_name, own_params], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def load_image(input_path, out=None):
+    """Load a TIFF as an array in its native dtype (see tiff_io)"""
+    return read_tiff(input_path, out=out)
+
+
+def initial_state(image, stats, layout='auto'):
+    """
+    Pipeline state for an input array: its color channels as an HWC view,
+    plus meta carrying the statistics and the 8-bit alpha plane (or None)
+    """
+    color, alpha = split_alpha(as_hwc(image, layout))
+    return color, {'stats': stats, 'alpha': alpha}
+
+
+def background_stage(img_array, meta, params):
+    """
+    Remove the sky background gradient (in-process replacement for Siril's bg)
+
+    Works in the input's native units and dtype; the statistics of the
+    corrected image replace the upload-time statistics for later stages.
+    """
+    if not params['background_extraction']:
+        return img_array, meta
+
+    model = background.fit_background(img_array, grid=params['background_grid'],
+                                      model=params['background_model'],
+                                      degree=params['background_degree'])
+    img_array = background.subtract_background(img_array, model)
+
+    meta = dict(meta)
+    meta['stats'] = compute_image_stats(img_array)
+    return img_array, meta
+
+
+def normalize_stage(img_array, meta, params):
+    """
+    Normalize to 0-1 range and decide whether autostretch is needed
+
+    Converts straight from the native dtype to float32 as part of the
+    division, so no intermediate full-size copy is made. Uses the
+    precomputed image statistics in meta['stats'] when available instead of
+    rescanning the array.
+    """
+    stats = meta.get('stats')
+    img_max = stats['max'] if stats is not None else img_array.max()
+
+    scale = 1.0
+    if img_max > 1:
+        scale = float(img_max)
+        img_array = np.divide(img_array, np.float32(img_max), dtype=np.float32)
+    elif img_array.dtype != np.float32 or isinstance(img_array, np.memmap):
+        # Detach from memory-mapped input so the file can be removed later
+        img_array = np.array(img_array, dtype=np.float32)
+
+    meta = dict(meta)
+    meta['scale'] = scale
+
+    # Apply initial autostretch if values are very low (typical for raw astro images)
+    # This replaces what Siril's autostretch would do
+    if stats is not None:
+        norm_max = stats['max'] / scale
+        norm_mean = stats['mean'] / scale
+    else:
+        norm_max = img_array.max()
+        norm_mean = img_array.mean()
+    meta['needs_autostretch'] = bool(norm_max < 0.9 and norm_mean < 0.1)
+    return img_array, meta
+
+
+def midtone_transfer(m, x):
+    """Midtone transfer function: maps 0 -> 0, m -> 0.5, 1 -> 1"""
+    return ((m - 1) * x) / ((2 * m - 1) * x - m)
+
+
+def _subsample_median_mad(channel):
+    """Median and MAD of a strided subsample of a channel"""
+    step = max(1, int(np.sqrt(channel.size / MTF_SAMPLE_PIXELS)))
+    sample = channel[::step, ::step]
+    median = float(np.median(sample))
+    return median, float(np.median(np.abs(sample - median)))
+
+
+def mtf_stretch(img_array, meta, params):
+    """
+    Adaptive midtone-transfer stretch (as in Siril's autostretch)
+
+    Per channel, the shadows clipping point sits autostretch_shadows_clip
+    standard deviations (from the MAD) around the median, and the midtone
+    balance is chosen so the median background lands on
+    autostretch_target_bg. The curve is applied through a 16-bit lookup table
+    spanning the channel's actual range.
+    """
+    stats = meta.get('stats')
+    stretched = np.empty_like(img_array)
+    scratch = np.empty(img_array.shape[:2], dtype=np.float32)
+    index = np.empty(img_array.shape[:2], dtype=np.uint16)
+
+    for i in range(img_array.shape[2]):
+        channel = img_array[:,:,i]
+
+        # Exact upload-time statistics when present, otherwise a subsample
+        if stats is not None:
+            median = stats['channels'][i]['median'] / meta['scale']
+            mad = stats['channels'][i]['mad'] / meta['scale']
+            high = stats['channels'][i]['max'] / meta['scale']
+        else:
+            median, mad = _subsample_median_mad(channel)
+            high = 1.0
+        high = max(high, 1e-10)
+
+        shadows = min(max(median + params['autostretch_shadows_clip'] * mad * MAD_TO_SIGMA, 0.0), median)
+        bg_level = (median - shadows) / (1 - shadows) if shadows < 1 else 0.0
+        midtones = midtone_transfer(params['autostretch_target_bg'], bg_level) if bg_level > 0 else 0.5
+
+        # Lookup table over the input range 0..high, quantized to 16 bits
+        levels = np.linspace(0, high, MTF_LUT_SIZE)
+        lut = np.clip((levels - shadows) / (1 - shadows + 1e-10), 0, 1)
+        lut = midtone_transfer(midtones, lut).astype(np.float32)
+
+        # Quantize to LUT indices (adding 0.5 before truncation rounds)
+        np.multiply(channel, np.float32((MTF_LUT_SIZE - 1) / high), out=scratch)
+        np.clip(scratch, 0, MTF_LUT_SIZE - 1, out=scratch)
+        scratch += 0.5
+        index[...] = scratch
+        stretched[:,:,i] = lut[index]
+
+    return stretched
+
+
+def autostretch_stage(img_array, meta, params):
+    """Aggressive histogram stretch for raw astronomical images"""
+    if not meta['needs_autostretch']:
+        return img_array, meta
+
+    mode = params['autostretch_mode']
+    if mode not in AUTOSTRETCH_MODES:
+        raise ValueError(f"Unknown autostretch mode: {mode}. Must be one of {AUTOSTRETCH_MODES}")
+    if mode == 'mtf':
+        return mtf_stretch(img_array, meta, params), meta
+
+    # Use global percentiles but with very aggressive clipping
+    stats = meta.get('stats')
+    stretched = np.empty_like(img_array)
+    for i in range(img_array.shape[2]):
+        channel = img_array[:,:,i]
+
+        # Use percentiles that focus on bringing out faint details
+        # This is similar to what Siril's autostretch does
+        if stats is not None:
+            percentiles = stats['channels'][i]['percentiles']
+            low_percentile = percentiles['0.001'] / meta['scale']  # Almost minimum
+            high_percentile = percentiles['99.999'] / meta['scale']  # Almost maximum
+        else:
+            low_percentile = np.percentile(channel, 0.001)  # Almost minimum
+            high_percentile = np.percentile(channel, 99.999)  # Almost maximum
+
+        # Clip and stretch
+        channel = np.clip(channel, low_percentile, high_percentile)
+        stretched[:,:,i] = (channel - low_percentile) / (high_percentile - low_percentile + 1e-10)
+
+    stretched = np.clip(stretched, 0, 1)
+
+    # Apply an aggressive midtone stretch to bring up faint details
+    stretched = np.power(stretched, 0.35)  # More aggressive midtone stretch
+    return stretched, meta
+
+
+# Luminosity weights of the R, G and B channels
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def color_stage(img_array, meta, params):
+    """Apply per-channel gamma correction and color multipliers"""
+    if img_array.shape[2] == 1:
+        # Mono: one curve with the luminosity-weighted gamma and multiplier
+        gamma = np.dot(LUMA_WEIGHTS, (params['gamma_red'], params['gamma_green'], params['gamma_blue']))
+        multiplier = np.dot(LUMA_WEIGHTS, (1.0, params['green_multiplier'], params['blue_multiplier']))
+        img_array = np.power(img_array, np.float32(gamma))
+        img_array *= np.float32(multiplier)
+        np.clip(img_array, 0, 1, out=img_array)
+        return img_array, meta
+
+    # Split into RGB channels
+    r, g, b = img_array[:,:,0], img_array[:,:,1], img_array[:,:,2]
+
+    # Apply gamma correction per channel (configurable)
+    r = np.power(r, params['gamma_red'])
+    g = np.power(g, params['gamma_green']) * params['green_multiplier']
+    b = np.power(b, params['gamma_blue']) * params['blue_multiplier']
+
+    # Recombine
+    img_array = np.stack([r, g, b], axis=-1)
+    img_array = np.clip(img_array, 0, 1)
+    return img_array, meta
+
+
+def tone_stage(img_array, meta, params):
+    """Apply the luminosity tone curve"""
+    # Apply tone curve only if NOT processing raw images
+    # Raw images are already mostly dark, no need to darken further
+    if meta['needs_autostretch']:
+        return img_array, meta
+
+    # Darken background while brightening bright areas
+    # Create a luminosity mask
+    if img_array.shape[2] == 1:
+        luminosity = img_array[:,:,0]
+    else:
+        luminosity = 0.299 * img_array[:,:,0] + 0.587 * img_array[:,:,1] + 0.114 * img_array[:,:,2]
+
+    # Create a non-linear stretch curve (configurable)
+    darkening_curve = np.where(luminosity < params['dark_threshold'],
+                                 luminosity * params['dark_multiplier'],
+                                 luminosity)
+    darkening_curve = np.where((luminosity >= params['dark_threshold']) & (luminosity < params['mid_threshold']),
+                                 params['dark_threshold'] * params['dark_multiplier'] + (luminosity - params['dark_threshold']) * params['mid_boost'],
+                                 darkening_curve)
+    darkening_curve = np.where(luminosity >= params['mid_threshold'],
+                                 luminosity * params['bright_multiplier'],
+                                 darkening_curve)
+
+    # Apply curve while preserving color ratios
+    ratio = np.divide(darkening_curve, luminosity + 1e-10)
+    ratio = np.clip(ratio, 0, 3)
+    ratio = np.expand_dims(ratio, axis=2)
+
+    img_array = img_array * ratio
+    img_array = np.clip(img_array, 0, 1)
+    return img_array, meta
+
+
+def saturation_stage(img_array, meta, params):
+    """
+    Boost saturation in HSV space and produce the 8-bit output
+
+    Mono images have no saturation and come out grayscale (H x W); the alpha
+    plane, if any, is attached as the last channel.
+    """
+    if img_array.shape[2] == 1:
+        result = (img_array[:,:,0] * 255).astype(np.uint8)
+        if meta.get('alpha') is not None:
+            result = np.dstack((result, meta['alpha']))
+        return result, meta
+
+    img_pil = Image.fromarray((img_array * 255).astype(np.uint8))
+
+    # Convert to HSV
+    hsv = img_pil.convert('HSV')
+    h, s, v = hsv.split()
+
+    # Boost saturation selectively (configurable)
+    s_array = np.array(s, dtype=np.float32)
+    v_array = np.array(v, dtype=np.float32)
+
+    # More saturation in bright areas
+    bright_mask = v_array / 255.0
+    saturation_multiplier = 1.0 + (bright_mask ** 0.5) * params['saturation_boost']
+    s_array = s_array * saturation_multiplier
+    s_array = np.clip(s_array, 0, 255)
+    s = Image.fromarray(s_array.astype(np.uint8))
+
+    # Merge back
+    result = np.asarray(Image.merge('HSV', (h, s, v)).convert('RGB'))
+    if meta.get('alpha') is not None:
+        result = np.dstack((result, meta['alpha']))
+    return result, meta
+
+
+STAGE_FUNCTIONS = {
+    'background': background_stage,
+    'normalize': normalize_stage,
+    'autostretch': autostretch_stage,
+    'color': color_stage,
+    'tone': tone_stage,
+    'saturation': saturation_stage,
+}
+
+
+def pipeline_keys(input_path, params):
+    """Return the cache key of every stage, in stage order"""
+    params = {**DEFAULT_PARAMS, **params}
+    keys = []
+    upstream = input_cache_key(input_path)
+    for name, param_names in STAGE_PARAMS:
+        upstream = stage_key(upstream, name, params, param_names)
+        keys.append(upstream)
+    return keys
+
+
+def result_digest(input_path, params):
+    """
+    Content digest of the pipeline result for an input and parameter set
+
+    The final stage key is fully determined by the input file and the
+    parameters, so it identifies the output content without hashing it.
+    """
+    return pipeline_keys(input_path, params)[-1][:16]
+
+
+def _deepest_cached(keys):
+    """(Index of the first stage to run, cached state) for the deepest cached stage, or (0, None)"""
+    for index in range(len(keys) - 1, -1, -1):
+        state = stage_cache.get(keys[index])
+        if state is not None:
+            return index + 1, state
+    return 0, None
+
+
+def cached_stage(input_path, params):
+    """
+    Look up the deepest cached stage of a run, as render_roi() would
+
+    Lets a caller see whether the input will have to be decoded, and hold on
+    to the state (passed back as render_roi(cached=...)) so it cannot be
+    evicted in between.
+
+    Returns:
+        tuple: (index of the first stage to run, state), or (0, None)
+    """
+    return _deepest_cached(pipeline_keys(input_path, {**DEFAULT_PARAMS, **params}))
+
+
+def run_pipeline(input_path, params, use_cache=True, stats=None, image=None, check=None):
+    """
+    Run the stretch pipeline, reusing cached stage outputs where possible
+
+    Args:
+        input_path: Path to input TIFF file
+        params: Dictionary of processing parameters
+        use_cache: Whether to read and populate the stage cache
+        stats: Precomputed image statistics (see image_stats), optional
+        image: Already decoded input array, optional (avoids a second decode)
+        check: Optional callable run before every stage; an exception it
+            raises aborts the run (completed stages stay cached)
+
+    Returns:
+        numpy.ndarray: 8-bit result: RGB, grayscale (H x W) for mono inputs,
+            plus the input's alpha as a last channel
+    """
+    # Parameters added after a client was written fall back to their defaults
+    params = {**DEFAULT_PARAMS, **params}
+
+    # Compute every stage key up front so the deepest cached stage can be found
+    keys = pipeline_keys(input_path, params)
+
+    start, state = _deepest_cached(keys) if use_cache else (0, None)
+
+    if state is None:
+        if image is None:
+            image = load_image(input_path)
+        state = initial_state(image, stats)
+
+    for index in range(start, len(STAGE_PARAMS)):
+        if check is not None:
+            check()
+        name = STAGE_PARAMS[index][0]
+        img_array, meta = state
+        result, meta = STAGE_FUNCTIONS[name](img_array, meta, params)
+
+        # Pass-through stages are not cached: their output is the upstream
+        # array, which for the first stages is the input itself (a memory map
+        # of the file, or shared memory released after the request)
+        if use_cache and result is not img_array:
+            # Cached arrays are shared between requests; never mutate them
+            result.flags.writeable = False
+            stage_cache.put(keys[index], (result, meta), result.nbytes)
+
+        state = (result, meta)
+
+    return state[0]
+
+
+def stretch_array(image, params=None, layout='auto', stats=None, out=None, check=None):
+    """
+    Stretch an in-memory image; the engine behind the web app and the CLI
+
+    Runs the same stages as run_pipeline() without touching disk or the
+    stage cache (arrays have no stable identity to cache them under).
+
+    Args:
+        image: numpy array of any integer or float dtype, in its native
+            range (normalized by its maximum like a TIFF would be)
+        params: Processing parameters; missing ones use DEFAULT_PARAMS
+        layout: Axis order of image (see channel_layout.as_hwc)
+        stats: Image statistics of the image (computed if missing, which
+            makes the result identical to processing the same pixels as a file)
+        out: Optional uint8 array to write into, of the result's shape
+        check: Optional callable run before every stage (see run_pipeline)
+
+    Returns:
+        numpy.ndarray: 8-bit array (out, if given): H x W x 3 for RGB, H x W
+            for mono, with alpha appended as a last channel if present
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    image = as_hwc(np.asarray(image), layout)
+    shape = output_shape(image.shape)
+    if out is not None and (out.shape != shape or out.dtype != np.uint8):
+        raise ValueError(f"out must be a uint8 array of shape {shape}")
+    if stats is None:
+        stats = compute_image_stats(image)
+
+    state = initial_state(image, stats, layout='HWC')
+    for name, _ in STAGE_PARAMS:
+        if check is not None:
+            check()
+        state = STAGE_FUNCTIONS[name](state[0], state[1], params)
+
+    if out is None:
+        return state[0]
+    np.copyto(out, state[0])
+    return out
+
+
+def stretch_to_image(image, params=None, layout='auto', stats=None):
+    """stretch_array() returning a PIL image (RGB, L, RGBA or LA)"""
+    return Image.fromarray(stretch_array(image, params, layout=layout, stats=stats))
+
+
+def render_roi(input_path, params, box, stats=None, image=None, cached=None):
+    """
+    Render only a rectangle of the output at full resolution
+
+    Every stage after background extraction is per-pixel once its global
+    inputs (normalization max, autostretch statistics) are known, and those
+    come from the image statistics. The deepest cached full-frame stage is
+    therefore cropped and only the crop runs through the remaining stages,
+    so the cost scales with the ROI area and the pixels match the full render.
+
+    Background extraction fits a model to the whole frame; when enabled and
+    not cached yet, that stage runs once on the full frame and is cached.
+
+    Args:
+        input_path: Path to input TIFF file
+        params: Dictionary of processing parameters
+        box: (x, y, width, height) in full-resolution pixels, already clipped
+        stats: Image statistics of the input (computed if missing)
+        image: Already decoded input array, optional
+        cached: Result of cached_stage() for these parameters, if the
+            caller already looked it up
+
+    Returns:
+        numpy.ndarray: 8-bit array of the region (same channels as run_pipeline)
+    """
+    params = {**DEFAULT_PARAMS, **params}
+    keys = pipeline_keys(input_path, params)
+    x, y, width, height = box
+
+    start, state = cached if cached is not None else _deepest_cached(keys)
+
+    if state is None:
+        if image is None:
+            image = load_image(input_path)
+        if stats is None:
+            stats = compute_image_stats(image)
+        color, meta = initial_state(image, stats)
+        state = background_stage(color, meta, params)
+        if state[0] is not color:
+            state[0].flags.writeable = False
+            stage_cache.put(keys[0], state, state[0].nbytes)
+        start = 1
+
+    img_array, meta = state
+    # Slicing a memory-mapped input only reads the pages of the region
+    img_array = img_array[y:y + height, x:x + width]
+    if meta.get('alpha') is not None:
+        meta = dict(meta, alpha=meta['alpha'][y:y + height, x:x + width])
+
+    for index in range(start, len(STAGE_PARAMS)):
+        name = STAGE_PARAMS[index][0]
+        img_array, meta = STAGE_FUNCTIONS[name](img_array, meta, params)
+
+    return img_array
@@ -0,0 +1,181 @@
+"""
+On-demand profiling of live requests for Auto Stretch
+
+An administrator arms the profiler for the next N processing requests. Each
+of those requests runs under cProfile with tracemalloc snapshots taken
+around the stretch, and leaves two files in the profiles directory:
+
+    <capture_id>.prof   cProfile data (load with pstats or snakeviz)
+    <capture_id>.json   request metadata: endpoint, image shape and dtype,
+                        parameters, branch taken, timings, memory peak and
+                        the top allocation sites
+
+While the profiler is not armed, capture() costs a single integer check.
+cProfile and tracemalloc are process-global, so captures are serialized; a
+request that arrives while another is being profiled runs unprofiled and
+does not consume the armed count.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import secrets
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Number of captures kept on disk (oldest are deleted)
+MAX_CAPTURES = 50
+
+# Functions and allocation sites summarized in the metadata file
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 20
+
+# Frames kept per tracemalloc traceback
+TRACEMALLOC_FRAMES = 5
+
+
+class Profiler:
+    """Profiles the next N armed requests and stores the captures"""
+
+    def __init__(self, profiles_dir):
+        """
+        Args:
+            profiles_dir: Directory the captures are written to
+        """
+        self.profiles_dir = profiles_dir
+        self._remaining = 0
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def arm(self, count):
+        """Profile the next count requests (0 disarms)"""
+        with self._lock:
+            self._remaining = max(0, int(count))
+            return self._remaining
+
+    @property
+    def remaining(self):
+        return self._remaining
+
+    def _claim(self):
+        """Reserve the profiler for this thread if armed and idle"""
+        if self._remaining <= 0:
+            return False
+        if not self._active.acquire(blocking=False):
+            return False
+        with self._lock:
+            if self._remaining <= 0:
+                self._active.release()
+                return False
+            self._remaining -= 1
+        return True
+
+    @contextmanager
+    def capture(self, metadata):
+        """
+        Profile the with-block if the profiler is armed
+
+        Args:
+            metadata: Dict describing the request; the block may add to it
+                (e.g. the branch taken) before it is written out
+
+        Yields:
+            dict: The metadata dict
+        """
+        if self._remaining <= 0 or not self._claim():
+            yield metadata
+            return
+
+        capture_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{secrets.token_hex(4)}'
+        profiler = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield metadata
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+            try:
+                self._write(capture_id, profiler, metadata, elapsed, before, after, current, peak)
+            finally:
+                self._active.release()
+
+    def _write(self, capture_id, profiler, metadata, elapsed, before, after, current, peak):
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.profiles_dir, f'{capture_id}.prof'))
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+        allocations = []
+        for stat in after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            allocations.append({
+                'location': f'{frame.filename}:{frame.lineno}',
+                'size_diff': stat.size_diff,
+                'count_diff': stat.count_diff
+            })
+
+        record = dict(metadata)
+        record.update({
+            'capture_id': capture_id,
+            'created': time.time(),
+            'elapsed_s': elapsed,
+            'traced_memory_bytes': current,
+            'traced_peak_bytes': peak,
+            'top_allocations': allocations,
+            'top_functions': summary.getvalue()
+        })
+        with open(os.path.join(self.profiles_dir, f'{capture_id}.json'), 'w') as f:
+            json.dump(record, f, indent=2, default=str)
+
+        self._prune()
+
+    def _prune(self):
+        """Delete the oldest captures beyond MAX_CAPTURES"""
+        captures = self.list_captures()
+        for capture in captures[MAX_CAPTURES:]:
+            for ext in ('.prof', '.json'):
+                path = os.path.join(self.profiles_dir, capture['capture_id'] + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def list_captures(self):
+        """Metadata of stored captures, newest first (without the function summary)"""
+        if not os.path.isdir(self.profiles_dir):
+            return []
+        captures = []
+        for name in os.listdir(self.profiles_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.profiles_dir, name)) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            record.pop('top_functions', None)
+            record.pop('top_allocations', None)
+            captures.append(record)
+        captures.sort(key=lambda record: record.get('created', 0), reverse=True)
+        return captures
+
+    def capture_path(self, capture_id, ext):
+        """Path of a stored capture file, or None if it does not exist"""
+        if ext not in ('.prof', '.json') or os.path.basename(capture_id) != capture_id:
+            return None
+        path = os.path.join(self.profiles_dir, capture_id + ext)
+        return path if os.path.exists(path) else None
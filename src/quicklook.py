@@ -0,0 +1,194 @@
+"""
+Quick looks at uploaded inputs for Auto Stretch
+
+Processing a large frame takes seconds, but a look at it takes milliseconds,
+so an upload can be answered with a thumbnail and the header metadata right
+away. The thumbnail is read as cheaply as the file allows:
+
+- A reduced-resolution page or pyramid level stored in the file (embedded
+  thumbnails, SubIFD pyramids), when present
+- Uncompressed, contiguous images: a strided read of a memory map; only the
+  pages holding the sampled rows are read from disk
+- Compressed strips: only the strips holding sampled rows are read and
+  decoded, and only the sampled pixels are kept from each
+- Anything else (e.g. compressed tiles without a pyramid, or a handful of
+  large strips) is decoded in full and subsampled
+
+Thumbnails are nearest-neighbour subsamples in the native dtype, ready to be
+stretched like the full image.
+"""
+
+import base64
+import io
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tifffile
+
+from channel_layout import as_hwc, detect_layout
+import tiff_io
+
+# Longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 320
+
+# JPEG quality of encoded thumbnails
+THUMBNAIL_QUALITY = 85
+
+# Fewer strips than this are too large to decode one at a time cheaply
+MIN_SAMPLED_STRIPS = 16
+
+
+def hwc_shape(shape):
+    """Height, width and channel count of an array shape (see channel_layout)"""
+    layout = detect_layout(shape)
+    if layout == 'HW':
+        return shape[0], shape[1], 1
+    if layout == 'CHW':
+        return shape[1], shape[2], shape[0]
+    return tuple(shape)
+
+
+def describe_tiff(input_path):
+    """
+    Read the metadata of a TIFF from its header, without decoding pixels
+
+    Returns:
+        dict: width, height, channels, layout, dtype, compression, tiled,
+            pages, reduced_levels and megapixels
+    """
+    with tifffile.TiffFile(input_path) as tif:
+        series = tif.series[0]
+        page = series.keyframe
+        height, width, channels = hwc_shape(series.shape)
+        return {
+            'width': width,
+            'height': height,
+            'channels': channels,
+            'layout': detect_layout(series.shape),
+            'dtype': str(series.dtype),
+            'compression': page.compression.name.lower(),
+            'tiled': page.is_tiled,
+            'pages': len(tif.pages),
+            'reduced_levels': len(series.levels) - 1,
+            'megapixels': round(width * height / 1e6, 2)
+        }
+
+
+def subsample(image, max_size=THUMBNAIL_SIZE):
+    """Strided H x W x C copy of an image whose longest side is at most max_size"""
+    image = as_hwc(image)
+    step = max(1, math.ceil(max(image.shape[:2]) / max_size))
+    return np.ascontiguousarray(image[::step, ::step])
+
+
+def _reduced_level(series, max_size):
+    """
+    Pick the stored reduced level to read a thumbnail from
+
+    Returns:
+        The smallest level whose longest side has at least max_size pixels,
+        else the largest one; None if the file stores no reduced levels
+    """
+    levels = sorted(series.levels[1:], key=lambda level: max(hwc_shape(level.shape)[:2]))
+    for level in levels:
+        if max(hwc_shape(level.shape)[:2]) >= max_size:
+            return level
+    return levels[-1] if levels else None
+
+
+def _sampled_strips(tif, page, max_size):
+    """
+    Decode the strips of a page that hold every n-th row, keeping every
+    n-th pixel of those rows
+
+    With strips shorter than n rows only some strips are read; otherwise
+    every strip is, but each is decoded and subsampled on its own, so the
+    full image is never held in memory.
+
+    Returns:
+        numpy.ndarray: H x W x C subsample, or None when the page is not
+            made of enough strips for sampling to save work
+    """
+    if page.is_tiled or page.imagedepth > 1 or page.dtype is None:
+        return None
+    height, width, samples = page.imagelength, page.imagewidth, page.samplesperpixel
+    strip_height = min(page.rowsperstrip, height)
+    strips = math.ceil(height / strip_height)
+    planes = samples if page.planarconfig == 2 else 1
+    if len(page.dataoffsets) != planes * strips or strips < MIN_SAMPLED_STRIPS:
+        return None
+
+    # Sampled rows are step apart, and so are the sampled columns
+    step = math.ceil(max(height, width) / max_size)
+    if step < 2:
+        return None
+    sampled = sorted({row // strip_height for row in range(0, height, step)})
+    indices = [plane * strips + strip for plane in range(planes) for strip in sampled]
+    result = np.zeros((math.ceil(height / step), math.ceil(width / step), samples), dtype=page.dtype)
+
+    segments = tif.filehandle.read_segments([page.dataoffsets[i] for i in indices],
+                                            [page.databytecounts[i] for i in indices], indices=indices)
+
+    def decode(item):
+        return page.decode(*item, jpegtables=page.jpegtables)
+
+    with ThreadPoolExecutor(tiff_io.decode_workers or os.cpu_count()) as pool:
+        for segment, (plane, _, top, _, _), _ in pool.map(decode, segments):
+            if segment is None:
+                continue
+            # Decoded segments are depth x rows x columns x samples
+            first = -top % step
+            rows = segment[0, first:strip_height:step, ::step]
+            start = (top + first) // step
+            rows = rows[:result.shape[0] - start]
+            result[start:start + rows.shape[0], :, plane:plane + rows.shape[2]] = rows
+    return result
+
+
+def read_thumbnail(input_path, max_size=THUMBNAIL_SIZE, full_decode=True):
+    """
+    Read a reduced-resolution copy of a TIFF as cheaply as its layout allows
+
+    Args:
+        full_decode: Fall back to decoding the whole image; if False, the
+            caller gets (None, None) and can decode it under its own limits
+
+    Returns:
+        tuple: (H x W x C array in the native dtype, name of the method used)
+    """
+    try:
+        with tifffile.TiffFile(input_path) as tif:
+            series = tif.series[0]
+
+            level = _reduced_level(series, max_size)
+            if level is not None:
+                return subsample(level.asarray(), max_size), 'reduced level'
+
+            if series.dataoffset is not None:
+                try:
+                    return subsample(tifffile.memmap(input_path, mode='r'), max_size), 'strided memory map'
+                except ValueError:
+                    pass
+
+            if len(series.pages) == 1:
+                sampled = _sampled_strips(tif, series.keyframe, max_size)
+                if sampled is not None:
+                    return subsample(sampled, max_size), 'sampled strips'
+    except (tifffile.TiffFileError, ValueError, IndexError):
+        pass
+
+    if not full_decode:
+        return None, None
+    return subsample(tiff_io.read_tiff(input_path), max_size), 'full decode'
+
+
+def encode_thumbnail(image):
+    """Encode a PIL image as a JPEG data URL (alpha is dropped)"""
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
@@ -0,0 +1,389 @@
+"""
+HTTP serving with systemd integration for Auto Stretch
+
+- Socket activation: when systemd passes a listening socket (LISTEN_FDS),
+  the server accepts on it instead of binding its own. The socket outlives
+  the process, so during a restart connections queue in the kernel backlog
+  instead of being refused.
+- Readiness and watchdog: READY=1 is sent via sd_notify only after the app
+  has warmed up. A WATCHDOG=1 keep-alive (WatchdogSec=) is sent only after
+  a loopback request to the health path was answered in time, so a hung
+  or deadlocked server gets restarted.
+- Graceful stop (SIGTERM): stop accepting, let in-flight requests and
+  queued background work finish (bounded by the drain timeout), then exit.
+- Graceful reload (SIGHUP): start a successor process on the same listening
+  socket, wait until it is warm and serving, hand it the main PID
+  (MAINPID=, requires NotifyAccess=all), then drain and exit as above.
+
+Without systemd every sd_notify call is a no-op and the server binds the
+port itself; SIGHUP handover works the same way.
+"""
+
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+# First file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+
+# Environment used to hand the listening socket to a successor process
+INHERITED_FD_ENV = 'AUTO_STRETCH_LISTEN_FD'
+READY_FD_ENV = 'AUTO_STRETCH_READY_FD'
+
+# Seconds a successor may take to become ready before a reload is abandoned
+SUCCESSOR_START_TIMEOUT = 300
+
+
+def notify(*states):
+    """
+    Send state lines (e.g. 'READY=1') to systemd
+
+    Returns:
+        bool: True if a notification socket was available
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # Abstract namespace socket
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall('\n'.join(states).encode())
+        return True
+    except OSError as e:
+        logger.warning(f"sd_notify failed: {e}")
+        return False
+
+
+def listen_fds():
+    """
+    Sockets passed by systemd socket activation (empty if not activated)
+
+    The LISTEN_* variables are removed so child processes do not see them.
+    """
+    try:
+        if int(os.environ.get('LISTEN_PID', -1)) != os.getpid():
+            return []
+        count = int(os.environ.get('LISTEN_FDS', 0))
+    except ValueError:
+        return []
+    finally:
+        for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+            os.environ.pop(name, None)
+    return [socket.socket(fileno=fd) for fd in range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count)]
+
+
+def watchdog_interval():
+    """Seconds between required watchdog pings, or None if not enabled"""
+    try:
+        usec = int(os.environ.get('WATCHDOG_USEC', 0))
+        pid = int(os.environ.get('WATCHDOG_PID', os.getpid()))
+    except ValueError:
+        return None
+    if usec <= 0 or pid != os.getpid():
+        return None
+    return usec / 1_000_000
+
+
+def open_listen_socket(host, port):
+    """
+    Return the socket to serve on and where it came from
+
+    Returns:
+        tuple: (socket, 'predecessor' | 'systemd' | 'bound')
+    """
+    inherited = os.environ.pop(INHERITED_FD_ENV, None)
+    if inherited is not None:
+        return socket.socket(fileno=int(inherited)), 'predecessor'
+
+    sockets = listen_fds()
+    if sockets:
+        if len(sockets) > 1:
+            logger.warning(f"systemd passed {len(sockets)} sockets; serving on the first")
+        return sockets[0], 'systemd'
+
+    sock = socket.create_server((host, port), backlog=128)
+    return sock, 'bound'
+
+
+class InflightTracker:
+    """WSGI middleware counting requests still being handled (including streamed bodies)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._active = 0
+        self._condition = threading.Condition()
+
+    @property
+    def active(self):
+        return self._active
+
+    def _finished(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def __call__(self, environ, start_response):
+        with self._condition:
+            self._active += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        return _ClosingIterator(body, self._finished)
+
+    def wait_idle(self, timeout):
+        """Wait until no request is active; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._active > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+
+class _ClosingIterator:
+    """Response iterable that reports completion once the server closes it"""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._iterator = iter(body)
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+
+class GracefulServer:
+    """Threaded WSGI server with graceful stop and zero-downtime reload"""
+
+    def __init__(self, app, sock, drain_timeout=300, on_drain=None, health_path='/'):
+        """
+        Args:
+            app: WSGI application
+            sock: Listening socket
+            drain_timeout: Seconds to wait for in-flight work when stopping
+            on_drain: Optional callback(timeout) that finishes background work
+            health_path: Path requested over loopback before each watchdog ping
+        """
+        self.sock = sock
+        self.drain_timeout = drain_timeout
+        self.on_drain = on_drain
+        self.health_path = health_path
+        self.tracker = InflightTracker(app)
+        host = sock.getsockname()[0]
+        self.server = make_server(host, sock.getsockname()[1], self.tracker,
+                                  threaded=True, fd=sock.fileno())
+        self._stopping = threading.Event()
+        self._reloading = threading.Lock()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_async())
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_async())
+
+    def stop_async(self):
+        threading.Thread(target=self.stop, name='GracefulStop', daemon=True).start()
+
+    def reload_async(self):
+        threading.Thread(target=self.reload, name='GracefulReload', daemon=True).start()
+
+    def stop(self, handed_over=False):
+        """
+        Stop accepting connections; serve_forever() then drains and returns
+
+        Args:
+            handed_over: A successor is now the main process, so systemd must
+                not be told the service is stopping
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if not handed_over:
+            notify('STOPPING=1', 'STATUS=Draining in-flight requests')
+        logger.info("Stopping: no longer accepting connections")
+        self.server.shutdown()
+
+    def reload(self):
+        """Start a successor on the same socket, then stop this process gracefully"""
+        if self._stopping.is_set() or not self._reloading.acquire(blocking=False):
+            return
+        try:
+            notify('RELOADING=1', f'MONOTONIC_USEC={time.monotonic_ns() // 1000}',
+                   'STATUS=Starting successor process')
+            if self._start_successor():
+                self.stop(handed_over=True)
+            else:
+                notify('READY=1', 'STATUS=Reload failed; still serving')
+        finally:
+            self._reloading.release()
+
+    def _start_successor(self):
+        """Launch a new process on the listening socket and wait until it is ready"""
+        read_fd, write_fd = os.pipe()
+        fd = self.sock.fileno()
+        os.set_inheritable(fd, True)
+        env = dict(os.environ, **{INHERITED_FD_ENV: str(fd), READY_FD_ENV: str(write_fd)})
+        # The watchdog follows the main PID, which the successor takes over
+        env.pop('WATCHDOG_PID', None)
+        command = list(getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv)
+        command[0] = sys.executable
+
+        logger.info("Reload: starting successor process")
+        try:
+            successor = subprocess.Popen(command, env=env, pass_fds=(fd, write_fd))
+        except OSError as e:
+            logger.error(f"Reload failed: could not start successor: {e}")
+            os.close(read_fd)
+            os.close(write_fd)
+            return False
+        os.close(write_fd)
+
+        try:
+            deadline = time.monotonic() + SUCCESSOR_START_TIMEOUT
+            while time.monotonic() < deadline:
+                readable, _, _ = select.select([read_fd], [], [], 1.0)
+                if readable:
+                    if os.read(read_fd, 1):
+                        logger.info(f"Reload: successor {successor.pid} is serving; draining")
+                        return True
+                    break  # Pipe closed without a ready byte
+                if successor.poll() is not None:
+                    break
+            logger.error("Reload failed: successor did not become ready")
+            successor.kill()
+            return False
+        finally:
+            os.close(read_fd)
+
+    def _probe(self, timeout):
+        """
+        Request the health path through the listening socket, like a client
+
+        Returns:
+            bool: True if a non-5xx status line arrived within timeout
+        """
+        address = self.sock.getsockname()
+        if self.sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Wildcard addresses are reached over loopback
+            host = {'0.0.0.0': '127.0.0.1', '::': '::1', '': '127.0.0.1'}.get(address[0], address[0])
+            address = (host,) + tuple(address[1:])
+        try:
+            with socket.socket(self.sock.family, socket.SOCK_STREAM) as probe:
+                probe.settimeout(timeout)
+                probe.connect(address)
+                probe.sendall(f'GET {self.health_path} HTTP/1.0\r\nHost: localhost\r\n\r\n'.encode())
+                status_line = probe.makefile('rb').readline().split()
+        except OSError as e:
+            logger.warning(f"Health probe failed: {e}")
+            return False
+        if len(status_line) < 2 or not status_line[1].isdigit() or int(status_line[1]) >= 500:
+            logger.warning(f"Health probe failed: {b' '.join(status_line).decode(errors='replace')!r}")
+            return False
+        return True
+
+    def _watchdog(self, interval):
+        # Ping every third of the interval, only after a probe answered within
+        # another third; a server that stops answering misses the deadline
+        while not self._stopping.wait(interval / 3):
+            if self._serving.is_alive() and self._probe(interval / 3) and not self._stopping.is_set():
+                notify('WATCHDOG=1')
+
+    def _announce_ready(self):
+        ready_fd = os.environ.pop(READY_FD_ENV, None)
+        if ready_fd is not None:
+            # Successor of a reload: take over as the service's main process
+            notify(f'MAINPID={os.getpid()}', 'READY=1', 'STATUS=Serving (reloaded)')
+            os.write(int(ready_fd), b'1')
+            os.close(int(ready_fd))
+        else:
+            notify('READY=1', 'STATUS=Serving')
+
+    def serve_forever(self):
+        """
+        Serve until stopped, then drain in-flight requests and background work
+
+        Returns:
+            bool: False if the drain timeout expired with work still running
+        """
+        self._serving = threading.current_thread()
+        self._announce_ready()
+
+        interval = watchdog_interval()
+        if interval:
+            threading.Thread(target=self._watchdog, args=(interval,), name='Watchdog', daemon=True).start()
+
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            self._stopping.set()
+
+        deadline = time.monotonic() + self.drain_timeout
+        drained = self.tracker.wait_idle(self.drain_timeout)
+        if not drained:
+            logger.warning(f"Drain timeout: {self.tracker.active} request(s) still running")
+        if self.on_drain is not None:
+            worker = threading.Thread(target=self.on_drain, args=(max(0, deadline - time.monotonic()),),
+                                      name='DrainBackground', daemon=True)
+            worker.start()
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logger.warning("Drain timeout: background work still running")
+                drained = False
+        self.server.server_close()
+        logger.info("Stopped")
+        return drained
+
+
+def serve(app, host, port, warm_up=None, drain_timeout=300, on_drain=None, health_path='/'):
+    """
+    Run app until SIGTERM/SIGINT, handing over to a new process on SIGHUP
+
+    Args:
+        app: WSGI application
+        host, port: Address to bind when no socket is passed in
+        warm_up: Optional callable run before readiness is announced
+        drain_timeout: Seconds to wait for in-flight work when stopping
+        on_drain: Optional callback(timeout) that finishes background work
+        health_path: Path that must answer before each watchdog ping
+    """
+    sock, source = open_listen_socket(host, port)
+    address = sock.getsockname()
+    logger.info(f"Listening on {address[0]}:{address[1]} (socket from {source})")
+
+    if warm_up is not None:
+        notify('STATUS=Warming up')
+        warm_up()
+
+    server = GracefulServer(app, sock, drain_timeout=drain_timeout, on_drain=on_drain,
+                            health_path=health_path)
+    server.install_signal_handlers()
+    if not server.serve_forever():
+        # Do not let interpreter shutdown wait on worker threads past the timeout
+        logging.shutdown()
+        os._exit(1)
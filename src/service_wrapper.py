@@ -116,20 +116,24 @@ class AutoStretchService(win32serviceutil.ServiceFramework):
             logger.info(f"Configuration loaded: port={port}, debug={debug}")
             logger.info(f"Base directory: {BASE_DIR}")
 
+            # Check if port is available before paying for the import
+            if not self.is_port_available(port):
+                logger.error(f"Port {port} is already in use")
+                raise Exception(f"Port {port} is already in use. Please change the port in {CONFIG_FILE}")
+
             # Import Flask app
             sys.path.insert(0, BASE_DIR)
 
             try:
-                from app import app
+                from app import app, warm_up
                 logger.info("Flask application imported successfully")
             except ImportError as e:
                 logger.error(f"Failed to import Flask app: {e}", exc_info=True)
                 raise
 
-            # Check if port is available
-            if not self.is_port_available(port):
-                logger.error(f"Port {port} is already in use")
-                raise Exception(f"Port {port} is already in use. Please change the port in {CONFIG_FILE}")
+            # Load the image stack now so the first upload is not slowed down
+            if config.get('warm_up', True):
+                warm_up()
 
             # Run Flask in separate thread
             logger.info(f"Starting Flask application on port {port}")
@@ -0,0 +1,280 @@
+"""
+Shared-memory image arrays for Auto Stretch
+
+Decoded inputs and pipeline results are passed between the web process and
+compute worker processes (see compute_pool) as small picklable handles
+instead of pickled multi-GB arrays or temporary TIFF files. Both sides map
+the same multiprocessing.shared_memory segment, so nothing is copied.
+
+Ownership and reference counting:
+
+- The web process owns every segment through a SharedArrayStore. Segments
+  are reference counted there and unlinked when the count drops to zero.
+- A worker only attaches to a segment while it holds a handle the owner
+  gave it. Results a worker creates are adopted by the owner, which then
+  manages their lifetime like its own.
+
+Cleanup after crashes:
+
+- Segment names encode the owner's and the creator's PID
+  (<prefix>_<owner>_<creator>_<token>). sweep_orphans() unlinks segments
+  whose owner is gone, and segments a dead worker created but never handed
+  over.
+- Segments are also registered with multiprocessing's resource tracker,
+  which workers share with the web process, so anything still linked when
+  the web process dies is unlinked by the tracker.
+"""
+
+import logging
+import os
+import secrets
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Prefix of every segment name (short: macOS limits names to 31 characters)
+SEGMENT_PREFIX = 'astr'
+
+# Where POSIX shared memory segments are visible as files (Linux)
+SHM_DIR = '/dev/shm'
+
+
+class SharedArray(namedtuple('SharedArray', ('name', 'shape', 'dtype'))):
+    """Picklable handle of an array stored in a shared memory segment"""
+
+    __slots__ = ()
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * np.dtype(self.dtype).itemsize
+
+
+# Segments mapped by this process, closed once no array uses them any more
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+
+def _close_unused():
+    """Close mappings whose arrays have all been garbage collected"""
+    with _mapped_lock:
+        for name, segment in list(_mapped.items()):
+            try:
+                segment.close()
+            except BufferError:
+                continue  # Arrays still reference the buffer
+            del _mapped[name]
+
+
+def _as_array(name, shape, dtype, segment=None):
+    """Array over a segment, mapping it unless this process already has"""
+    with _mapped_lock:
+        if segment is None:
+            segment = _mapped.get(name) or shared_memory.SharedMemory(name=name)
+        _mapped[name] = segment
+        # frombuffer keeps the segment's buffer exported while any view of the
+        # array lives, so _close_unused cannot unmap memory still in use
+        # (np.ndarray(buffer=...) only references the underlying mmap)
+        count = int(np.prod(shape, dtype=np.int64))
+        return np.frombuffer(segment.buf, dtype=dtype, count=count).reshape(shape)
+
+
+def create(shape, dtype, owner_pid=None):
+    """
+    Allocate a zero-filled array in a new shared memory segment
+
+    Args:
+        shape, dtype: Array layout
+        owner_pid: PID of the process that will own the segment (default: this one)
+
+    Returns:
+        tuple: (SharedArray handle, numpy.ndarray view of the segment)
+    """
+    _close_unused()
+    shape = tuple(int(n) for n in shape)
+    dtype = np.dtype(dtype).str
+    handle = SharedArray(None, shape, dtype)
+    name = f'{SEGMENT_PREFIX}_{owner_pid or os.getpid()}_{os.getpid()}_{secrets.token_hex(4)}'
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(1, handle.nbytes))
+    handle = handle._replace(name=segment.name)
+    return handle, _as_array(handle.name, shape, dtype, segment)
+
+
+def attach(handle):
+    """Map an existing segment and return it as an array (no copy)"""
+    _close_unused()
+    return _as_array(handle.name, handle.shape, handle.dtype)
+
+
+def unlink(name):
+    """Remove a segment's name; memory is freed once every mapping is closed"""
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    segment.unlink()
+    segment.close()
+    return True
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep_orphans(keep=()):
+    """
+    Unlink segments left behind by crashed processes
+
+    A segment is orphaned when its owner is no longer running, or when this
+    process owns it but the worker that created it died before handing it
+    over (it is then not in keep).
+
+    Args:
+        keep: Names of segments this process currently owns
+
+    Returns:
+        int: Number of segments removed
+    """
+    if not os.path.isdir(SHM_DIR):
+        return 0  # Segments cannot be listed here; the resource tracker still cleans up
+
+    me = os.getpid()
+    removed = 0
+    for name in os.listdir(SHM_DIR):
+        parts = name.split('_')
+        if len(parts) != 4 or parts[0] != SEGMENT_PREFIX or name in keep:
+            continue
+        try:
+            owner, creator = int(parts[1]), int(parts[2])
+        except ValueError:
+            continue
+        orphaned = not _pid_alive(owner) if owner != me else creator != me and not _pid_alive(creator)
+        if orphaned and unlink(name):
+            removed += 1
+    if removed:
+        logger.warning(f"Removed {removed} orphaned shared memory segment(s)")
+    return removed
+
+
+class SharedArrayStore:
+    """Owner-side registry of shared arrays with reference counts"""
+
+    def __init__(self):
+        self._segments = {}  # name -> [handle, refcount]
+        self._addresses = {}  # data address -> name, to find the handle of an array
+        self._lock = threading.Lock()
+
+    def _register(self, handle, array):
+        with self._lock:
+            self._segments[handle.name] = [handle, 1]
+            self._addresses[array.ctypes.data] = handle.name
+        return array
+
+    def allocate(self, shape, dtype):
+        """
+        New shared array with a reference count of one
+
+        Usable as an allocator for decoders (see tiff_io.read_tiff).
+        """
+        handle, array = create(shape, dtype)
+        return self._register(handle, array)
+
+    def put(self, array):
+        """Copy an existing array into shared memory; returns its handle"""
+        shared = self.allocate(array.shape, array.dtype)
+        np.copyto(shared, array)
+        return self.handle_for(shared)
+
+    def adopt(self, handle):
+        """Take ownership of a segment created by a worker; returns its array"""
+        return self._register(handle, attach(handle))
+
+    def get(self, handle):
+        """Array view of an owned segment"""
+        with self._lock:
+            if handle.name not in self._segments:
+                raise KeyError(f"Unknown shared array: {handle.name}")
+        array = attach(handle)
+        with self._lock:
+            self._addresses[array.ctypes.data] = handle.name
+        return array
+
+    def handle_for(self, array):
+        """Handle of an array allocated by this store, or None"""
+        if not isinstance(array, np.ndarray):
+            return None
+        with self._lock:
+            name = self._addresses.get(array.ctypes.data)
+            entry = self._segments.get(name)
+            if entry is None or entry[0].shape != array.shape or entry[0].dtype != array.dtype.str:
+                return None
+            return entry[0]
+
+    def _resolve(self, handle_or_array):
+        if isinstance(handle_or_array, SharedArray):
+            return handle_or_array
+        return self.handle_for(handle_or_array)
+
+    def acquire(self, handle_or_array):
+        """Add a reference"""
+        handle = self._resolve(handle_or_array)
+        with self._lock:
+            self._segments[handle.name][1] += 1
+
+    def release(self, handle_or_array):
+        """
+        Drop a reference; the segment is unlinked when none are left
+
+        Arrays that are not shared (e.g. memory-mapped files) are ignored.
+
+        Returns:
+            bool: True if a shared array was released
+        """
+        handle = self._resolve(handle_or_array)
+        if handle is None:
+            return False
+        with self._lock:
+            entry = self._segments.get(handle.name)
+            if entry is None:
+                return False
+            entry[1] -= 1
+            if entry[1] > 0:
+                return True
+            del self._segments[handle.name]
+            for address, name in list(self._addresses.items()):
+                if name == handle.name:
+                    del self._addresses[address]
+        unlink(handle.name)
+        _close_unused()
+        return True
+
+    def release_all(self):
+        """Unlink every owned segment (process shutdown)"""
+        with self._lock:
+            names = list(self._segments)
+            self._segments.clear()
+            self._addresses.clear()
+        for name in names:
+            unlink(name)
+        _close_unused()
+
+    def owned_names(self):
+        with self._lock:
+            return set(self._segments)
+
+    def stats(self):
+        """Segment count and total size for monitoring"""
+        with self._lock:
+            return {
+                'segments': len(self._segments),
+                'bytes': sum(handle.nbytes for handle, _ in self._segments.values())
+            }
@@ -0,0 +1,93 @@
+"""
+Fast TIFF ingestion for Auto Stretch
+
+Chooses the cheapest way to get pixels out of a TIFF:
+
+- Uncompressed, contiguous images are memory-mapped (zero-copy). Pages are
+  only read from disk as the pipeline touches them.
+- Compressed or fragmented images are decoded with tifffile, spreading
+  strips/tiles across a configurable number of worker threads.
+- Anything tifffile cannot read falls back to Pillow.
+
+Arrays are returned in their native dtype; conversion to the float32
+working dtype happens once, fused with normalization, in the pipeline.
+"""
+
+import logging
+import time
+
+import numpy as np
+from PIL import Image
+import tifffile
+
+logger = logging.getLogger(__name__)
+
+# Worker threads for compressed strip/tile decoding (None = tifffile default)
+decode_workers = None
+
+
+def configure(workers=None):
+    """
+    Set the number of decode worker threads
+
+    Args:
+        workers: Thread count, or None/0 to let tifffile pick (CPU count)
+    """
+    global decode_workers
+    decode_workers = int(workers) if workers else None
+
+
+def _log_read(path, method, nbytes, elapsed):
+    """Log which ingestion path was taken and its throughput"""
+    mb = nbytes / (1024 * 1024)
+    rate = mb / elapsed if elapsed > 0 else float('inf')
+    logger.info(f"Loaded {path} via {method}: {mb:.1f} MB in {elapsed:.3f}s ({rate:.1f} MB/s)")
+
+
+def read_tiff(input_path, out=None):
+    """
+    Read a TIFF image as fast as its layout allows
+
+    Args:
+        input_path: Path to input TIFF file
+        out: Optional allocator(shape, dtype) -> ndarray that decoded pixels
+            are written into (e.g. shared memory, see shared_arrays).
+            Memory-mapped images bypass it, as they need no decoding.
+
+    Returns:
+        numpy.ndarray: Image data in its native dtype (may be a read-only memmap)
+    """
+    start = time.perf_counter()
+
+    try:
+        with tifffile.TiffFile(input_path) as tif:
+            series = tif.series[0]
+
+            # Uncompressed data stored in one contiguous block can be mapped directly
+            if series.dataoffset is not None:
+                try:
+                    img_array = tifffile.memmap(input_path, mode='r')
+                    _log_read(input_path, 'memory map (zero-copy)',
+                              img_array.nbytes, time.perf_counter() - start)
+                    return img_array
+                except ValueError as e:
+                    logger.debug(f"Cannot memory-map {input_path}: {e}")
+
+            workers = decode_workers
+            target = out(series.shape, series.dtype) if out is not None else None
+            img_array = series.asarray(maxworkers=workers, out=target)
+            _log_read(input_path, f'threaded decode (workers={workers or "auto"})',
+                      img_array.nbytes, time.perf_counter() - start)
+            return img_array
+
+    except Exception as e:
+        # Fallback to PIL if tifffile fails
+        logger.warning(f"tifffile could not read {input_path} ({e}); falling back to Pillow")
+        img = Image.open(input_path)
+        img_array = np.array(img)
+        if out is not None:
+            target = out(img_array.shape, img_array.dtype)
+            np.copyto(target, img_array)
+            img_array = target
+        _log_read(input_path, 'Pillow', img_array.nbytes, time.perf_counter() - start)
+        return img_array
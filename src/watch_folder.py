@@ -0,0 +1,383 @@
+"""
+Watch-folder ingestion daemon for Auto Stretch
+
+Watches the directories listed under 'watch_folders' in config.json and
+stretches every new TIFF that appears there, so capture software can write
+frames all night without anyone uploading them:
+
+- New files are noticed through inotify when the optional inotify_simple
+  package is installed, and by polling otherwise. Polling also runs
+  alongside inotify, because network shares do not deliver inotify events
+  for writes made by other machines.
+- A file is only processed once its size and modification time have not
+  changed for 'watch_settle_s' seconds, so half-written frames are skipped.
+- Each folder has its own parameter preset and output location: next to
+  the inputs by default, or in the folder's 'output_dir'.
+- Files are processed on a bounded worker pool, with memory admission.
+- A SQLite ledger records every processed file with its size, mtime and
+  parameters. Restarts therefore do not reprocess anything, while a file
+  that is replaced, or a folder whose preset changes, is processed again.
+  Files that cannot be decoded are recorded too; transient failures (I/O
+  errors, memory) are not, and are retried on the next scan.
+
+Example configuration:
+
+    "watch_folders": [
+        {"path": "/mnt/capture/m31", "params": {"saturation_boost": 1.5}},
+        {"path": "/mnt/capture/ha", "output_dir": "/srv/stretched/ha",
+         "params": {"autostretch_mode": "mtf"}, "recursive": true}
+    ]
+
+Usage:
+    python watch_folder.py            # run until SIGTERM/SIGINT
+    python watch_folder.py --once     # process what is there now, then exit
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import inotify_simple
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+from admission import AdmissionController, AdmissionRejected, default_budget_bytes, estimate_job_bytes
+from config_manager import ConfigManager
+
+logger = logging.getLogger('AutoStretchWatch')
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+# Suffixes of the files the daemon writes (never treated as new inputs)
+OUTPUT_SUFFIX = '_stretched'
+PREVIEW_SUFFIX = '_preview'
+
+LEDGER_FILENAME = 'auto-stretch-watch.db'
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    params_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    output_path TEXT,
+    preview_path TEXT,
+    error TEXT,
+    processed REAL NOT NULL
+);
+"""
+
+
+def params_hash(params):
+    """Digest of a parameter preset, so preset changes trigger reprocessing"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class Ledger:
+    """Persistent record of processed files (thread-safe)"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(LEDGER_SCHEMA)
+
+    def is_done(self, path, size, mtime_ns, digest):
+        """True if this exact file version was already handled with these parameters"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime_ns, params_hash FROM processed WHERE path = ?', (path,)).fetchone()
+        return row is not None and tuple(row) == (size, mtime_ns, digest)
+
+    def record(self, path, size, mtime_ns, digest, status, output_path=None, preview_path=None,
+               error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO processed '
+                '(path, size, mtime_ns, params_hash, status, output_path, preview_path, error, processed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, size, mtime_ns, digest, status, output_path, preview_path, error, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WatchFolder:
+    """One watched directory with its preset and output location"""
+
+    def __init__(self, entry):
+        self.path = os.path.abspath(entry['path'])
+        self.params = dict(entry.get('params') or {})
+        self.output_dir = entry.get('output_dir')
+        self.recursive = bool(entry.get('recursive', False))
+        self.digest = params_hash(self.params)
+
+    def candidates(self):
+        """TIFF files currently in the folder (excluding the daemon's own outputs)"""
+        if self.recursive:
+            walker = os.walk(self.path)
+        else:
+            try:
+                walker = [(self.path, [], os.listdir(self.path))]
+            except OSError as e:
+                logger.warning(f"Cannot list {self.path}: {e}")
+                return
+        for root, _, names in walker:
+            for name in names:
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in TIFF_EXTENSIONS or name.startswith('.'):
+                    continue
+                if stem.endswith(OUTPUT_SUFFIX):
+                    continue
+                yield os.path.join(root, name)
+
+    def output_paths(self, input_path):
+        """Where the stretched TIFF and the PNG preview of input_path go"""
+        directory = self.output_dir or os.path.dirname(input_path)
+        if self.output_dir and self.recursive:
+            # Mirror the input's sub-directory below the output directory
+            directory = os.path.join(directory, os.path.relpath(os.path.dirname(input_path), self.path))
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        return (os.path.join(directory, f'{stem}{OUTPUT_SUFFIX}.tif'),
+                os.path.join(directory, f'{stem}{PREVIEW_SUFFIX}.png'))
+
+
+class StabilityTracker:
+    """Decides when a file has stopped growing"""
+
+    def __init__(self, settle_s):
+        self.settle_s = settle_s
+        self._seen = {}  # path -> (size, mtime_ns, monotonic time the signature was first seen)
+
+    def ready(self, path, size, mtime_ns):
+        """True once (size, mtime) has stayed the same for settle_s seconds"""
+        now = time.monotonic()
+        seen = self._seen.get(path)
+        if seen is None or seen[:2] != (size, mtime_ns):
+            self._seen[path] = (size, mtime_ns, now)
+            return self.settle_s <= 0
+        return now - seen[2] >= self.settle_s
+
+    def forget(self, path):
+        self._seen.pop(path, None)
+
+    @property
+    def pending(self):
+        return len(self._seen)
+
+
+def is_transient(error):
+    """
+    True for failures worth retrying: I/O errors (e.g. the capture software
+    still holding the file), running out of memory, admission rejections
+
+    Pillow reports undecodable files as OSError without an errno; those are
+    format errors, like tifffile's ValueErrors.
+    """
+    if isinstance(error, (MemoryError, AdmissionRejected)):
+        return True
+    return isinstance(error, OSError) and error.errno is not None
+
+
+def process_file(input_path, folder, preview_max_width=1200, output_compression=None):
+    """
+    Stretch one TIFF with the folder's preset and write output and preview
+
+    Returns:
+        tuple: (output_path, preview_path)
+    """
+    import pipeline
+    from image_stats import compute_image_stats
+    from PIL import Image
+
+    output_path, preview_path = folder.output_paths(input_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    image = pipeline.load_image(input_path)
+    stats = compute_image_stats(image)
+    result = pipeline.run_pipeline(input_path, folder.params, use_cache=False, stats=stats, image=image)
+    del image
+
+    # Write under a temporary name so a reader never sees a partial file
+    save_kwargs = {'compression': output_compression} if output_compression else {}
+    img = Image.fromarray(result)
+    img.save(output_path + '.part', format='TIFF', **save_kwargs)
+    os.replace(output_path + '.part', output_path)
+
+    if img.width > preview_max_width:
+        ratio = preview_max_width / img.width
+        img = img.resize((preview_max_width, int(img.height * ratio)), Image.Resampling.LANCZOS)
+    img.save(preview_path + '.part', format='PNG')
+    os.replace(preview_path + '.part', preview_path)
+
+    return output_path, preview_path
+
+
+class WatchDaemon:
+    """Scans watched folders and feeds stable new files to a worker pool"""
+
+    def __init__(self, config):
+        self.config = config
+        self.folders = [WatchFolder(entry) for entry in config.get('watch_folders') or []]
+        self.poll_s = config.get('watch_poll_s', 10)
+        self.workers = config.get('watch_workers', 2)
+        self.preview_max_width = config.get('preview_max_width', 1200)
+        self.output_compression = config.get('output_compression')
+
+        temp_dir = config.get('temp_dir') or tempfile.gettempdir()
+        self.ledger = Ledger(config.get('watch_ledger') or os.path.join(temp_dir, LEDGER_FILENAME))
+        self.stability = StabilityTracker(config.get('watch_settle_s', 5))
+
+        budget_mb = config.get('memory_budget_mb', 0)
+        # Workers simply wait for memory; nothing is rejected
+        self.admission = AdmissionController(budget_mb * 1024 * 1024 if budget_mb else default_budget_bytes(),
+                                             max_queue=self.workers, queue_timeout=24 * 3600)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='WatchWorker')
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._inotify = None
+
+    def _start_inotify(self):
+        if not INOTIFY_AVAILABLE:
+            logger.info("inotify_simple not installed; polling only")
+            return
+        flags = inotify_simple.flags
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self._inotify = inotify_simple.INotify()
+        for folder in self.folders:
+            directories = [root for root, _, _ in os.walk(folder.path)] if folder.recursive else [folder.path]
+            for directory in directories:
+                try:
+                    self._inotify.add_watch(directory, mask)
+                except OSError as e:
+                    logger.warning(f"Cannot watch {directory} with inotify ({e}); polling it")
+        threading.Thread(target=self._inotify_loop, name='WatchInotify', daemon=True).start()
+
+    def _inotify_loop(self):
+        while not self._stop.is_set():
+            if self._inotify.read(timeout=1000):
+                self._wake.set()
+
+    def _submit(self, path, folder, st):
+        with self._lock:
+            if path in self._in_flight:
+                return
+            self._in_flight.add(path)
+        self._executor.submit(self._process, path, folder, st.st_size, st.st_mtime_ns)
+
+    def _process(self, path, folder, size, mtime_ns):
+        try:
+            with self.admission.admit(estimate_job_bytes(path)):
+                start = time.perf_counter()
+                output_path, preview_path = process_file(path, folder, self.preview_max_width,
+                                                         self.output_compression)
+            self.ledger.record(path, size, mtime_ns, folder.digest, 'done',
+                               output_path=output_path, preview_path=preview_path)
+            logger.info(f"Processed {path} -> {output_path} in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            if is_transient(e):
+                # Not recorded, so the next scan retries it
+                logger.warning(f"Could not process {path} yet, will retry: {e}")
+            else:
+                # Recorded so a broken file is not retried until it changes
+                logger.error(f"Failed to process {path}: {e}")
+                self.ledger.record(path, size, mtime_ns, folder.digest, 'error', error=str(e))
+        finally:
+            with self._lock:
+                self._in_flight.discard(path)
+            self.stability.forget(path)
+
+    def scan(self):
+        """Submit every stable, unprocessed file; returns the number still settling"""
+        settling = 0
+        for folder in self.folders:
+            for path in folder.candidates():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed or renamed since listing
+                with self._lock:
+                    if path in self._in_flight:
+                        continue
+                if self.ledger.is_done(path, st.st_size, st.st_mtime_ns, folder.digest):
+                    self.stability.forget(path)
+                    continue
+                if self.stability.ready(path, st.st_size, st.st_mtime_ns):
+                    self._submit(path, folder, st)
+                else:
+                    settling += 1
+        return settling
+
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._in_flight)
+
+    def run(self, once=False):
+        """
+        Watch until stop() is called
+
+        Args:
+            once: Process the files present now (waiting for them to settle), then return
+        """
+        if not self.folders:
+            logger.error("No watch_folders configured")
+            return
+        for folder in self.folders:
+            logger.info(f"Watching {folder.path} (output: {folder.output_dir or 'next to inputs'}, "
+                        f"params: {folder.params or 'defaults'})")
+        if not once:
+            self._start_inotify()
+
+        settle_s = self.stability.settle_s
+        while not self._stop.is_set():
+            settling = self.scan()
+            if once and not settling and not self.busy:
+                break
+            # Re-check settling files soon; otherwise wait for inotify or the next poll
+            timeout = min(self.poll_s, max(settle_s, 0.5)) if settling or once else self.poll_s
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+        self._executor.shutdown(wait=True)
+        self.ledger.close()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Auto Stretch watch-folder daemon')
+    parser.add_argument('--once', action='store_true',
+                        help='Process the files present now, then exit')
+    args = parser.parse_args()
+
+    config = ConfigManager.load_config()
+    logging.basicConfig(level=getattr(logging, config.get('log_level', 'INFO'), logging.INFO),
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    daemon = WatchDaemon(config)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    daemon.run(once=args.once)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import tifffile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import quicklook
+
+def test_sampled_strips():
+    """Test that a compressed file with short strips gets a sampled thumbnail, not a full decode"""
+
+    # A typical deflate-compressed frame: 16 rows per strip
+    image = (np.random.default_rng(0).random((2000, 3000, 3)) * 65535).astype(np.uint16)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'strips.tif')
+        tifffile.imwrite(path, image, compression='zlib', rowsperstrip=16, photometric='rgb')
+
+        thumbnail, method = quicklook.read_thumbnail(path)
+
+    print(f"Thumbnail {thumbnail.shape} read by {method}")
+    assert method == 'sampled strips'
+    assert np.array_equal(thumbnail, quicklook.subsample(image))
+    print("[SUCCESS]")
+
+if __name__ == "__main__":
+    test_sampled_strips()